@@ -9,8 +9,22 @@ import multiprocessing
 import itertools
 from ast import literal_eval
 import time
+import resource
 from collections import defaultdict
 import timetools as tt
+import jsonstream as js
+import timewindow as tw
+import topobin as tb
+import interning as it
+import probeset as ps
+import topocache as tc
+import snapshots as sn
+import pathtable as pt
+import profiling as pf
+import layout as ly
+
+MANIFEST_SUFFIX = '.manifest'  # sidecar file of output, recording the input files of incremental updates
+WORKER_STATS = 'worker_stats'  # graph attribute holding the cost of a worker with --profile
 
 # hops to be removed in as path
 RM_HOP = ['', 'Invalid IP address', 'this', 'private', 'CGN', 'host', 'linklocal',
@@ -33,79 +47,107 @@ def type_convert(s):
         return s
 
 
-def worker(fn, end=None, begin=None, stop=None):
+def worker(fn, end=None, begin=None, stop=None, stream=False, bin_size=None, keep_paths=False, profile=False):
     """for each given file fn, read the paths sequences for each probe and create a graph out of these paths
 
     Args:
         fn (str): file to be handled
         end (str or int): a priori known destination of measurement. use it to filter out paths not ended there.
+        stream (bool): read the file one probe at a time instead of loading it as a whole
+        bin_size (int): see build_graph()
+        keep_paths (bool): keep the path table as graph attribute, see pathtable
+        profile (bool): keep the cost of handling fn and the counts of items in it as graph attribute
 
     Return:
-        g (nx.Graph)
+        g (nx.Graph), see build_graph(); with keep_paths, g.graph[pathtable.TABLE] is the pathtable.PathTable of fn;
+        with profile, g.graph[WORKER_STATS] is a dict with the wall and cpu time in sec, the number of probes,
+        distinct paths and measurements
     """
     t3 = time.time()
+    cpu = pf.usage()[0]
     try:  # load AS_path file
-        with open(os.path.join(fn), 'r') as fp:
-            traceroute = json.load(fp)
-    except IOError as e:
-        logging.error(e)
+        with open(fn, 'r') as fp:
+            g, table = build_graph(js.load_items(fp, stream), end, begin, stop, bin_size)
+    except (IOError, ValueError) as e:
+        # malformed content, e.g. a truncated file, may only be met halfway when streaming; the file is skipped
+        logging.error("%s skipped: %s" % (fn, e))
         return nx.Graph()
 
+    if keep_paths:
+        g.graph[pt.TABLE] = table
+
+    t4 = time.time()
+    if profile:
+        g.graph[WORKER_STATS] = dict(wall=t4-t3, cpu=pf.usage()[0]-cpu, probes=len(table.runs), paths=len(table.paths),
+                                     measurements=sum(r[3] for runs in table.runs.itervalues() for r in runs))
+    # ru_maxrss is in KB on Linux
+    logging.info("%s handled in %.2f sec, %d distinct paths, peak RSS %.1f MB." %
+                 (fn, t4-t3, len(table.paths), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.))
+    return g
+
+
+def build_graph(traceroute, end=None, begin=None, stop=None, bin_size=None):
+    """create a graph out of the paths sequences of probes
+
+    Paths are recorded in a path table, which cleans each distinct raw path only once;
+    the graph is then built by walking each distinct path once, with all the probes having measured it.
+
+    Args:
+        traceroute (iterable of tuple): (probe ID, {'epoch': [...], 'asn_path': [...]}), as read from file
+        end (str or int): a priori known destination of measurement. use it to filter out paths not ended there.
+        begin (int): sec since epoch, beginning of time window
+        stop (int): sec since epoch, end of time window
+        bin_size (int): if set, all the paths in window are considered even if begin and stop are not set,
+            and the paths measured by each probe are as well binned by their epoch, see snapshots
+
+    Return:
+        tuple (g, table), g (nx.Graph) built on interned node and probe ids, whose name tables are graph attributes,
+        see interning; with bin_size, g.graph[snapshots.TIMELINE] is {probe id: {sec since epoch of bin: set of paths}};
+        table (pathtable.PathTable) the paths of probes on the same ids
+    """
     end = type_convert(end) if end else None
 
+    nodes = it.Interner()
+    probes = it.Interner()
     g = nx.Graph()
+    g.graph[it.NODES] = nodes
+    g.graph[it.PROBES] = probes
+    table = pt.PathTable(nodes, probes, RM_HOP, end)
     source = set()
     dest = set()
     ixp = set()
-    hosting = defaultdict(set)
+    hosting = defaultdict(ps.ProbeSet)
+    timeline = defaultdict(lambda: defaultdict(set))
 
     if end:
-        dest.add(end)
-
-    for pb in traceroute:
-        if begin:
-            try:
-                begin_idx = next(i for i, v in enumerate(traceroute[pb]['epoch']) if v >= begin)
-            except StopIteration:
-                begin_idx = None
-        else:
-            begin_idx = None
-        if stop:
-            try:
-                stop_idx = next(i for i, v in enumerate(traceroute[pb]['epoch']) if v > stop)
-            except StopIteration:
-                stop_idx = None
-        else:
-            begin_idx = None
-        #logging.debug("Probe %s, begin idx = %r, stop idx = %r" % (pb, begin_idx, stop_idx))
-        if end:
-            if begin or stop:
-                as_path = [[j for j in i if j not in RM_HOP] for i in traceroute[pb]['asn_path'][begin_idx:stop_idx] if end in i]
-            else:
-                try:
-                    as_path = [next([j for j in i if j not in RM_HOP] for i in traceroute[pb]['asn_path'] if end in i)]
-                except StopIteration:
-                    as_path = []
-        else:
-            if begin or stop:
-                as_path = [[j for j in i if j not in RM_HOP] for i in traceroute[pb]['asn_path'][begin_idx:stop_idx]]
-            else:
-                try:
-                    as_path = [next([j for j in i if j not in RM_HOP] for i in traceroute[pb]['asn_path'])]
-                except StopIteration:
-                    as_path = []
-        if as_path:
-            for p in as_path:
-                last_idx = len(p) - 1
-                for idx, h in enumerate(p):
-                    if idx == 0:
-                        source.add(h)
-                        hosting[h].add(pb)
-                    elif idx == last_idx:
-                        dest.add(h)
-                    elif isinstance(h, (str, unicode)):
-                        ixp.add(h)
-            t.path_to_graph(as_path, pb, g)
+        dest.add(nodes.id(end))
+
+    # without time window, only the first path of each probe is considered
+    whole = bool(begin or stop or bin_size)
+    for pb, rec in traceroute:
+        begin_idx, stop_idx = tw.window_index(rec['epoch'], begin, stop)
+        measured = itertools.izip(rec['epoch'][begin_idx:stop_idx], rec['asn_path'][begin_idx:stop_idx])
+        if table.record(pb, measured, first_only=not whole) and bin_size:
+            bins = timeline[probes.id(pb)]
+            for e, raw in itertools.izip(rec['epoch'][begin_idx:stop_idx], rec['asn_path'][begin_idx:stop_idx]):
+                pid = table.path_id(raw)
+                if pid is not None:
+                    bins[tw.bin_floor(e, bin_size)].add(pid)
+
+    # each distinct path is walked once, both for graph building and node tagging
+    users = table.probe_sets()
+    t.paths_to_graph(((table.path(pid), pbs) for pid, pbs in users.iteritems()), g)
+    for pid, pbs in users.iteritems():
+        p = table.path(pid)
+        last_idx = len(p) - 1
+        for idx, h in enumerate(p):
+            if idx == 0:
+                source.add(h)
+                hosting[h] |= pbs
+            elif idx == last_idx:
+                dest.add(h)
+            elif isinstance(nodes.name(h), (str, unicode)):
+                ixp.add(h)
 
     for n in g:
         # 1 for source; 2 for ixp; 3 for dst; 4 for all the others
@@ -122,11 +164,91 @@ def worker(fn, end=None, begin=None, stop=None):
             attr['tag'].add(4)
         g.node[n] = attr
 
-    t4 = time.time()
-    logging.info("%s handled in %.2f sec." % (fn, t4-t3))
+    if bin_size:
+        g.graph[sn.TIMELINE] = {pb: {e: set(table.path(pid) for pid in pids) for e, pids in bins.iteritems()}
+                                for pb, bins in timeline.iteritems()}
+    return g, table
+
+
+def load_graph(fn):
+    """load a topology produced by this script, as the graphs built by worker()
+
+    Args:
+        fn (str): path to the .json or binary topology file
+
+    Returns:
+        g (nx.Graph), built on interned node and probe ids, see worker()
+    """
+    if tb.is_binary(fn):
+        data = tb.load(fn).to_data()
+    else:
+        with open(fn, 'r') as fp:
+            data = json.load(fp)
+    nodes = it.Interner()
+    probes = it.Interner()
+    g = nx.Graph()
+    g.graph[it.NODES] = nodes
+    g.graph[it.PROBES] = probes
+    for n in data['nodes']:
+        attr = dict(tag=set(n['tag']))
+        if 'hosting' in n:
+            attr['hosting'] = ps.ProbeSet([probes.id(pb) for pb in n['hosting']])
+        g.add_node(nodes.id(n['name']), attr)
+    for l in data['links']:
+        g.add_edge(nodes.id(l['src_name']), nodes.id(l['tgt_name']),
+                   probe=ps.ProbeSet([probes.id(pb) for pb in l['probe']]))
     return g
 
 
+def file_states(files, previous=None):
+    """size, modification time and content hash of files
+
+    Args:
+        files (list of str): paths to files
+        previous (dict): states of a previous call, hashes are reused for files whose size and mtime are unchanged
+
+    Returns:
+        dict {path: {'size': int, 'mtime': float, 'sha1': str}}
+    """
+    previous = previous or dict()
+    states = dict()
+    for fn in files:
+        st = os.stat(fn)
+        state = dict(size=st.st_size, mtime=st.st_mtime)
+        old = previous.get(fn)
+        if old and old['size'] == state['size'] and old['mtime'] == state['mtime']:
+            state['sha1'] = old['sha1']
+        else:
+            state['sha1'] = tc.file_digest(fn)
+        states[fn] = state
+    return states
+
+
+def update_plan(manifest, params, states):
+    """tell which files are to be handled in updating an existing topology
+
+    Graphs can only be merged, not subtracted; files are expected to only grow.
+    The update is thus impossible, and a full rebuild needed, if the parameters changed or if any file shrank or vanished.
+
+    Args:
+        manifest (dict): {'params': dict, 'files': file_states()} recorded by the run that produced the topology
+        params (dict): parameters of current run
+        states (dict): file_states() of current input files
+
+    Returns:
+        list of str, files new or changed since manifest; None if a full rebuild is needed
+    """
+    if manifest.get('params') != params:
+        logging.info("Parameters changed since last run, full rebuild.")
+        return None
+    old = manifest.get('files', dict())
+    for fn, state in old.iteritems():
+        if fn not in states or states[fn]['size'] < state['size']:
+            logging.info("%s vanished or shrank since last run, full rebuild." % fn)
+            return None
+    return sorted(fn for fn, state in states.iteritems() if fn not in old or old[fn]['sha1'] != state['sha1'])
+
+
 def worker_wrapper(args):
     try:
         return worker(*args)
@@ -160,8 +282,36 @@ def main():
                         help="the ending moment for traceroute rendering, format %s" % "%%Y-%%m-%%d %%H:%%M:%%S %%z",
                         action='store')
     parser.add_argument("-o", "--outfile",
-                        help="Specify the name of output .json file",
+                        help="Specify the name of output .json file, or binary topology file if ending with %s" %
+                             tb.EXTENSION,
+                        action="store")
+    parser.add_argument("--stream",
+                        help="read input files one probe at a time, bounding memory by the largest probe record",
+                        action="store_true")
+    parser.add_argument("--incremental",
+                        help="update the existing output with the input files new or changed since the run producing it",
+                        action="store_true")
+    parser.add_argument("--snapshots",
+                        help="as well save the topology of each bin of BIN_SIZE sec (default to 600) "
+                             "to output file name + %s, considering all the paths in files if no time window is set" %
+                             sn.SUFFIX,
+                        nargs='?', type=int, const=600, metavar='BIN_SIZE',
+                        action="store")
+    parser.add_argument("--path-table",
+                        help="save the distinct paths and the runs of paths measured by each probe to this .json file",
                         action="store")
+    parser.add_argument("--layout",
+                        help="store in the output the positions of nodes computed offline, "
+                             "so that the visualization renders them at once",
+                        action="store_true")
+    parser.add_argument("--profile",
+                        help="save the wall time, CPU time, peak RSS and item counts of each phase "
+                             "to output file name + %s" % pf.SUFFIX,
+                        action="store_true")
+    parser.add_argument("--cprofile",
+                        help="as --profile, along with the functions taking most time in each phase according to "
+                             "cProfile, those of workers excepted; slows the run down",
+                        action="store_true")
     args = parser.parse_args()
     args_dict = vars(args)
     if not args.directory or not args.suffix:
@@ -192,7 +342,7 @@ def main():
     else:
         begin = None
 
-    if args.beginTime:
+    if args.stopTime:
         try:
             stop = tt.string_to_epoch(args.stopTime)
         except (ValueError, TypeError):
@@ -204,13 +354,103 @@ def main():
     if not begin and not stop:
         logging.info("None begin and stop time input, default to consider the first traceroutes of each probe")
 
+    out_fn = args.outfile if args.outfile else 'graph.json'
+
+    if args.incremental and (args.snapshots or args.path_table):
+        logging.critical("--snapshots and --path-table can not be combined with --incremental.")
+        return
+
+    prof = pf.Profiler(args.profile, args.cprofile)
+
+    # in incremental mode, only the files new or changed since the run that produced the output are handled
+    # and merged into it; files handled are recorded in a manifest next to the output
+    base = None
+    if args.incremental:
+        prof.start('manifest')
+        manifest_fn = out_fn + MANIFEST_SUFFIX
+        params = dict(directory=os.path.abspath(trace_dir), suffix=args.suffix, end=args.end, begin=begin, stop=stop)
+        manifest = None
+        if os.path.exists(out_fn) and os.path.exists(manifest_fn):
+            try:
+                with open(manifest_fn, 'r') as fp:
+                    manifest = json.load(fp)
+            except (IOError, ValueError) as e:
+                logging.warning("Failed to read manifest %s, full rebuild: %s" % (manifest_fn, e))
+        states = file_states(files, manifest['files'] if manifest else None)
+        todo = update_plan(manifest, params, states) if manifest else None
+        if todo is not None:
+            t3 = time.time()
+            try:
+                base = load_graph(out_fn)
+            except (IOError, ValueError, KeyError) as e:
+                logging.warning("Failed to load %s, full rebuild: %s" % (out_fn, e))
+            else:
+                t4 = time.time()
+                logging.info("%s loaded in %.2f sec, %d out of %d files new or changed." %
+                             (out_fn, t4-t3, len(todo), len(files)))
+                files = todo
+        prof.stop(files=len(files), base_links=base.number_of_edges() if base is not None else 0)
+
+    prof.start('paths')
     pool = multiprocessing.Pool(processes=multiprocessing.cpu_count())
     res = pool.map(worker_wrapper,
                    itertools.izip(files, itertools.repeat(args.end),
-                                  itertools.repeat(begin), itertools.repeat(stop)))
-
-    g = t.graph_union(res)
-
+                                  itertools.repeat(begin), itertools.repeat(stop),
+                                  itertools.repeat(args.stream), itertools.repeat(args.snapshots),
+                                  itertools.repeat(bool(args.path_table)), itertools.repeat(prof.enabled)))
+    stats = [r.graph.pop(WORKER_STATS) for r in res if WORKER_STATS in r.graph]
+    prof.stop(files=len(files), probes=sum(s['probes'] for s in stats), paths=sum(s['paths'] for s in stats),
+              measurements=sum(s['measurements'] for s in stats), worker_cpu=round(sum(s['cpu'] for s in stats), 4),
+              worker_wall_max=round(max([s['wall'] for s in stats] or [0]), 4))
+    # paths binned per probe and path tables are set aside before graphs are merged
+    timelines = [(r.graph[it.NODES], r.graph[it.PROBES], r.graph.pop(sn.TIMELINE)) for r in res
+                 if sn.TIMELINE in r.graph]
+    tables = [r.graph.pop(pt.TABLE) for r in res if pt.TABLE in r.graph]
+
+    # merge the graphs of each file pairwise in the pool
+    t3 = time.time()
+    prof.start('union')
+    g = t.graph_union_tree(res, pool)
+    pool.close()
+    pool.join()
+    if base is not None:
+        t.graph_update(base, g)
+        g = base
+    t4 = time.time()
+    logging.info("%d graphs merged in %.2f sec." % (len(res), t4-t3))
+    prof.stop(graphs=len(res), nodes=g.number_of_nodes(), links=g.number_of_edges(),
+              probes=len(g.graph.get(it.PROBES, ())))
+
+    if args.path_table:
+        t3 = time.time()
+        prof.start('path_table')
+        table = pt.PathTable(g.graph.setdefault(it.NODES, it.Interner()), g.graph.setdefault(it.PROBES, it.Interner()))
+        for other in tables:
+            table.merge(other)
+        pt.dump(table, args.path_table)
+        t4 = time.time()
+        logging.info("%d distinct paths of %d probes saved to %s in %.2f sec." %
+                     (len(table.paths), len(table.runs), args.path_table, t4-t3))
+        prof.stop(paths=len(table.paths), probes=len(table.runs))
+
+    if args.snapshots:
+        t3 = time.time()
+        prof.start('snapshots')
+        nodes = g.graph.setdefault(it.NODES, it.Interner())
+        probes = g.graph.setdefault(it.PROBES, it.Interner())
+        timeline = sn.merge(timelines, nodes, probes)
+        epochs = [e for bins in timeline.itervalues() for e in bins]
+        first = tw.bin_floor(begin, args.snapshots) if begin else min(epochs or [0])
+        last = tw.bin_floor(stop, args.snapshots) if stop else max(epochs or [0])
+        node_attrs = {n: dict(d, name=nodes.name(n)) for n, d in g.nodes_iter(data=True)}
+        snap = sn.build(timeline, first, (last - first) // args.snapshots + 1, args.snapshots, node_attrs, probes)
+        sn.dump(snap, sn.snapshot_path(out_fn))
+        t4 = time.time()
+        logging.info("%d snapshots with %d deltas saved to %s in %.2f sec." %
+                     (snap.bin_count, len(snap.deltas), sn.snapshot_path(out_fn), t4-t3))
+        prof.stop(bins=snap.bin_count, deltas=len(snap.deltas))
+
+    prof.start('node_link')
     # listfy the node/link attributes, otherwise cannot be serialized
     for e in g.edges_iter():
         g[e[0]][e[1]]['probe'] = list(g[e[0]][e[1]]['probe'])
@@ -226,11 +466,30 @@ def main():
 
     d = t.node_link_data_modify(g)
 
-    out_fn = args.outfile if args.outfile else 'graph.json'
-    json.dump(d, open(out_fn, 'w'))
+    if args.layout:
+        t3 = time.time()
+        prof.start('layout')
+        ly.add_layout(d)
+        t4 = time.time()
+        logging.info("%d nodes laid out in %.2f sec." % (len(d['nodes']), t4-t3))
+        prof.stop(nodes=len(d['nodes']), links=len(d['links']))
+
+    prof.start('serialization')
+    if tb.is_binary(out_fn):
+        tb.dump(d, out_fn)
+    else:
+        json.dump(d, open(out_fn, 'w'))
+
+    if args.incremental:
+        with open(manifest_fn, 'w') as fp:
+            json.dump(dict(params=params, files=states), fp)
+    prof.stop(bytes=os.path.getsize(out_fn))
+    prof.dump(pf.report_path(out_fn))
 
     t2 = time.time()
-    logging.info("Graph formulated and saved in %.2f sec." % (t2-t1))
+    logging.info("Graph formulated and saved in %.2f sec, peak RSS %.1f MB, worker peak RSS %.1f MB." %
+                 (t2-t1, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.))
 
 
 if __name__ == '__main__':
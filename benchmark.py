@@ -0,0 +1,390 @@
+"""
+benchmark.py times the building of topology graph from synthetic RIPE Atlas like AS path sequences
+
+With --pipeline, synthetic path and change detection files are written for a range of probe populations, and each
+phase from parsing them to serializing the inference is timed; results are saved as .json to track scaling.
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import platform
+import argparse
+import random
+import time
+import numpy as np
+import networkx as nx
+import tracegraph as t
+import pathtable as pt
+import jsonstream as js
+import scorestore as ss
+import probeset as ps
+import binning as bn
+import as_graph
+import congestion as cg
+
+DST = 226  # destination ASN, the same as that of example.json
+EX_PROBE = 623  # number of probes seen in example.json
+START = 1480550400  # 2016-12-01 00:00:00 UTC, beginning of synthetic datasets
+TRACE_INTERVAL = 1800  # sec between two traceroutes of a probe
+RTT_INTERVAL = 240  # sec between two RTT measurements of a probe, i.e. change detection records
+
+
+def synthetic_paths(n_probe, n_trace=48, churn=0.05, seed=0):
+    """generate AS path sequences for a population of probes
+
+    Paths go from a source AS through one or two transit AS (possibly an IXP) to DST.
+    The population of transit AS grows with the number of probes, so does the graph size.
+
+    Args:
+        n_probe (int): number of probes
+        n_trace (int): number of traceroutes per probe
+        churn (float): probability that a traceroute takes a different path from the previous one
+        seed (int): seed of the random generator
+
+    Returns:
+        dict {probe id (string): [path, ...]}, path is a list of hops from source to DST
+    """
+    rnd = random.Random(seed)
+    n_tier1 = max(5, n_probe // 60)
+    n_tier2 = max(20, n_probe // 4)
+    tier1 = range(1000, 1000 + n_tier1)
+    tier2 = range(10000, 10000 + n_tier2)
+    ixp = ["IXP-%d" % i for i in range(max(2, n_probe // 200))]
+    upstream = {a: rnd.sample(tier1, 2) for a in tier2}
+
+    def one_path(src):
+        a2 = rnd.choice(tier2)
+        path = [src, a2, rnd.choice(upstream[a2])]
+        if rnd.random() < 0.3:
+            path.append(rnd.choice(ixp))
+        path.append(DST)
+        return path
+
+    res = dict()
+    for i in range(n_probe):
+        src = 100000 + rnd.randrange(n_probe)
+        current = one_path(src)
+        seq = []
+        for _ in range(n_trace):
+            if rnd.random() < churn:
+                current = one_path(src)
+            seq.append(current)
+        res[str(20000 + i)] = seq
+    return res
+
+
+def legacy_path_to_graph(paths, probe, g):
+    """the original edge-list based path_to_graph, kept for comparison"""
+    for p in paths:
+        for e in zip(p[:-1], p[1:]):
+            if e not in g.edges():
+                g.add_edge(e[0], e[1], probe=set([]))
+            g[e[0]][e[1]]['probe'].add(probe)
+
+
+def time_build(func, paths):
+    """build a graph out of all the probe paths with func
+
+    Returns:
+        tuple (number of hops, seconds taken, resulted graph)
+    """
+    g = nx.Graph()
+    hops = sum(len(p) - 1 for seq in paths.values() for p in seq)
+    t1 = time.time()
+    # probes are interned as ints, as done by as_graph.worker
+    for pb, seq in enumerate(paths.values()):
+        func(seq, pb, g)
+    t2 = time.time()
+    return hops, t2 - t1, g
+
+
+def time_table_build(paths):
+    """build a graph out of all the probe paths through a path table, as done by as_graph.worker
+
+    Returns:
+        tuple (number of hops, seconds taken, resulted graph)
+    """
+    g = nx.Graph()
+    hops = sum(len(p) - 1 for seq in paths.values() for p in seq)
+    t1 = time.time()
+    table = pt.PathTable()
+    for pb, seq in enumerate(paths.values()):
+        table.record(pb, enumerate(seq))
+    t.paths_to_graph(((table.path(pid), pbs) for pid, pbs in table.probe_sets().iteritems()), g)
+    t2 = time.time()
+    return hops, t2 - t1, g
+
+
+def synthetic_changes(paths, n_event, noise=0.001, seed=0):
+    """generate change detection series coherent with AS path sequences
+
+    Each event raises a change at the same moment on all the probes traversing a link, the link of a random path
+    at a random moment; probes as well have changes on their own at random.
+
+    Args:
+        paths (dict): {probe id: [path, ...]}, one path every TRACE_INTERVAL sec from START, see synthetic_paths()
+        n_event (int): number of events
+        noise (float): probability of a change at a record not caused by event
+        seed (int): seed of the random generator
+
+    Returns:
+        dict {probe id: [0 or 1, ...]}, one value every RTT_INTERVAL sec from START, over the span of paths
+    """
+    rnd = random.Random(seed)
+    n_trace = len(next(paths.itervalues())) if paths else 0
+    n_record = n_trace * TRACE_INTERVAL // RTT_INTERVAL
+    res = {pb: [1 if rnd.random() < noise else 0 for _ in xrange(n_record)] for pb in paths}
+    probes = sorted(paths)
+    for _ in xrange(n_event if probes and n_record else 0):
+        k = rnd.randrange(n_record)
+        slot = k * RTT_INTERVAL // TRACE_INTERVAL
+        p = paths[rnd.choice(probes)][slot]
+        i = rnd.randrange(len(p) - 1)
+        link = (p[i], p[i + 1])
+        for pb in probes:
+            q = paths[pb][slot]
+            if any(e == link for e in zip(q[:-1], q[1:])):
+                res[pb][k] = 1
+    return res
+
+
+def write_dataset(directory, n_probe, hours=24, churn=0.05, n_files=4, n_event=24, seed=0):
+    """write synthetic path files and change detection files, in the formats read by as_graph.py and congestion.py
+
+    Probes are spread over n_files path files, named <i>_paths.json, and as many change detection files, named
+    changes_<i>.json, the same probes in the files of the same index.
+
+    Args:
+        directory (string): where files are written, created if absent
+        n_probe (int): number of probes
+        hours (int): span of the measurements
+        churn (float): probability that a traceroute takes a different path from the previous one
+        n_files (int): number of files of each kind
+        n_event (int): number of events raising changes on all the probes of a link, see synthetic_changes()
+        seed (int): seed of the random generator
+
+    Returns:
+        dict, with the lists of 'paths' and 'changes' files and the 'begin' and 'stop' sec since epoch of measurements
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    n_trace = max(1, hours * 3600 // TRACE_INTERVAL)
+    paths = synthetic_paths(n_probe, n_trace=n_trace, churn=churn, seed=seed)
+    changes = synthetic_changes(paths, n_event, seed=seed)
+    trace_epochs = [START + i * TRACE_INTERVAL for i in xrange(n_trace)]
+    rtt_epochs = [START + i * RTT_INTERVAL for i in xrange(n_trace * TRACE_INTERVAL // RTT_INTERVAL)]
+    rnd = random.Random(seed)
+    probes = sorted(paths)
+    res = dict(paths=[], changes=[], begin=START, stop=START + n_trace * TRACE_INTERVAL - 1)
+    for i in xrange(n_files):
+        group = probes[i::n_files]
+        fn = os.path.join(directory, "%d_paths.json" % i)
+        with open(fn, 'w') as fp:
+            json.dump({pb: {"epoch": trace_epochs, "asn_path": paths[pb]} for pb in group}, fp)
+        res['paths'].append(fn)
+        fn = os.path.join(directory, "%d_cpt.json" % i)
+        with open(fn, 'w') as fp:
+            json.dump({pb: {"epoch": rtt_epochs, "min_rtt": [round(rnd.uniform(5, 300), 1)] * len(rtt_epochs),
+                            cg.CH_MTD: changes[pb]} for pb in group}, fp)
+        res['changes'].append(fn)
+    return res
+
+
+def time_pipeline(data, directory, engine='python'):
+    """time each phase from the files of a dataset to the inference, sequentially in this process
+
+    Phases are those of as_graph.py then congestion.py: parse, path_to_graph, graph_union, topology serialization,
+    divergent_set preparation, binning (including normalization), node_inference, link_inference and
+    serialization of the inference.
+
+    Args:
+        data (dict): dataset returned by write_dataset()
+        directory (string): where the topology and inference files are written
+        engine (string): binning engine of congestion.py, python or numpy
+
+    Returns:
+        list of dict, one per phase, with its 'phase' name, wall time in 'sec' and counts of the items handled
+    """
+    res = []
+
+    def done(name, t1, **counts):
+        counts.update(phase=name, sec=round(time.time() - t1, 4))
+        res.append(counts)
+
+    t1 = time.time()
+    records = []
+    for fn in data['paths']:
+        with open(fn, 'r') as fp:
+            records.append(list(js.load_items(fp)))
+    done('parse', t1, files=len(records), probes=sum(map(len, records)),
+         bytes=sum(os.path.getsize(fn) for fn in data['paths']))
+
+    t1 = time.time()
+    graphs, n_path, n_measure = [], 0, 0
+    for items in records:
+        g, table = as_graph.build_graph(items, DST, data['begin'], data['stop'])
+        graphs.append(g)
+        n_path += len(table.paths)
+        n_measure += sum(r[3] for runs in table.runs.itervalues() for r in runs)
+    done('path_to_graph', t1, paths=n_path, measurements=n_measure)
+
+    t1 = time.time()
+    g = t.graph_union_tree(graphs)
+    done('graph_union', t1, graphs=len(graphs), nodes=g.number_of_nodes(), links=g.number_of_edges())
+
+    # as done by as_graph.main
+    t1 = time.time()
+    for e in g.edges_iter():
+        g[e[0]][e[1]]['probe'] = list(g[e[0]][e[1]]['probe'])
+    for n in g.nodes_iter():
+        g.node[n]['tag'] = list(g.node[n]['tag'])
+        if 'hosting' in g.node[n]:
+            g.node[n]['hosting'] = list(g.node[n]['hosting'])
+    topo_fn = os.path.join(directory, "topo.json")
+    with open(topo_fn, 'w') as fp:
+        json.dump(t.node_link_data_modify(g), fp)
+    done('topology_serialization', t1, bytes=os.path.getsize(topo_fn))
+
+    t1 = time.time()
+    topo, probes, pb2links, pb2nodes, branches = cg.load_topology(topo_fn)
+    done('divergent_set', t1, nodes=topo.number_of_nodes(),
+         divergent=sum(1 for _, d in topo.nodes_iter(data=True) if 'probe' in d))
+
+    # as done by congestion.main
+    t1 = time.time()
+    begin, stop = data['begin'], data['stop']
+    store = ss.ScoreStore(topo.edges(), topo.nodes(), begin, stop, cg.BIN)
+    if engine == 'numpy':
+        probe_index, inc = bn.incidence_matrix(pb2links, pb2nodes, store.links, store.nodes)
+        inc_t = inc.T.tocsr()
+        bn.add_partials(store, (bn.partial_scores(fn, cg.CH_MTD, probe_index, inc_t, cg.BIN, begin, stop,
+                                                  probes=probes) for fn in data['changes']))
+    else:
+        for fn in data['changes']:
+            t.binsum_update(store, t.change_binsum_partial(fn, cg.CH_MTD, pb2links, pb2nodes, cg.BIN, begin, stop,
+                                                           probes=probes))
+    store.normalize([len(topo[l[0]][l[1]]['probe']) for l in store.links] +
+                    [len(topo.node[n].get('probe', [])) for n in store.nodes])
+    store.attach(topo)
+    active_nodes = store.active(cg.NODE_THRESHOLD, store.node_rows)
+    active_links = store.active(cg.LINK_THRESHOLD, store.link_rows)
+    done('binning', t1, files=len(data['changes']), bins=store.bin_count,
+         active_nodes=sum(map(len, active_nodes)), active_links=sum(map(len, active_links)))
+
+    t1 = time.time()
+    t.change_inference_node(topo, cg.NODE_THRESHOLD, store, active=active_nodes)
+    done('node_inference', t1, inferred=int((store.inference[store.node_rows] >= t.LIKELY).sum()))
+
+    t1 = time.time()
+    stats = dict()
+    t.change_inference_link(topo, cg.LINK_THRESHOLD, store, branches=branches, active=active_links, stats=stats)
+    done('link_inference', t1, inferred=int((store.inference[store.link_rows] >= t.LIKELY).sum()),
+         evaluated=stats['evaluated'], max_depth=stats['max_depth'])
+
+    t1 = time.time()
+    out_fn = os.path.join(directory, "congestion.json")
+    with open(out_fn, 'w') as fp:
+        json.dump(cg.result_data(topo, store, probes), fp)
+    done('serialization', t1, bytes=os.path.getsize(out_fn))
+    return res
+
+
+def run_pipeline(args):
+    """time the pipeline at each probe population, print the phases and save them to args.outfile if set"""
+    report = dict(python=platform.python_version(), networkx=nx.__version__, numpy=np.__version__,
+                  probeset='roaring' if ps.available() else 'int', engine=args.engine,
+                  hours=args.hours, churn=args.churn, files=args.files, events=args.events, runs=[])
+    print("%-8s %-24s %-10s %s" % ("probes", "phase", "sec", "counts"))
+    for n_probe in [int(i) for i in args.probes.split(',')]:
+        directory = os.path.join(args.keep, str(n_probe)) if args.keep else tempfile.mkdtemp(prefix='benchmark')
+        try:
+            t1 = time.time()
+            data = write_dataset(directory, n_probe, args.hours, args.churn, args.files,
+                                 args.events * max(1, args.hours // 24))
+            generation = time.time() - t1
+            phases = time_pipeline(data, directory, args.engine)
+        finally:
+            if not args.keep:
+                shutil.rmtree(directory)
+        for p in phases:
+            counts = ' '.join("%s=%s" % (k, v) for k, v in sorted(p.iteritems()) if k not in ('phase', 'sec'))
+            print("%-8d %-24s %-10.3f %s" % (n_probe, p['phase'], p['sec'], counts))
+        report['runs'].append(dict(probes=n_probe, generation=round(generation, 4),
+                                   total=round(sum(p['sec'] for p in phases), 4), phases=phases))
+        sys.stdout.flush()
+    if args.outfile:
+        with open(args.outfile, 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--scales",
+                        help="comma separated multiples of example.json probe population",
+                        default="1,10",
+                        action="store")
+    parser.add_argument("-n", "--ntrace",
+                        help="number of traceroutes per probe",
+                        type=int, default=48,
+                        action="store")
+    parser.add_argument("-l", "--legacy",
+                        help="as well time the original path_to_graph, slow on large scales",
+                        action="store_true")
+    parser.add_argument("--pipeline",
+                        help="time each phase from synthetic files to inference instead of graph building alone",
+                        action="store_true")
+    parser.add_argument("-p", "--probes",
+                        help="comma separated probe populations of --pipeline",
+                        default="100,1000",
+                        action="store")
+    parser.add_argument("--hours",
+                        help="span of the measurements of --pipeline in hours",
+                        type=int, default=24,
+                        action="store")
+    parser.add_argument("--churn",
+                        help="probability that a traceroute takes a different path from the previous one",
+                        type=float, default=0.05,
+                        action="store")
+    parser.add_argument("--files",
+                        help="number of path files, and of change detection files, of --pipeline",
+                        type=int, default=4,
+                        action="store")
+    parser.add_argument("--events",
+                        help="number of changes shared by all the probes of a link per day",
+                        type=int, default=24,
+                        action="store")
+    parser.add_argument("--engine",
+                        help="binning engine of --pipeline: python (default) or numpy, see congestion.py",
+                        choices=['python', 'numpy'], default='python',
+                        action="store")
+    parser.add_argument("--keep",
+                        help="write the synthetic files of --pipeline to this directory and keep them",
+                        action="store")
+    parser.add_argument("-o", "--outfile",
+                        help="save the phases timed by --pipeline to this .json file",
+                        action="store")
+    args = parser.parse_args()
+
+    if args.pipeline:
+        if args.engine == 'numpy' and not bn.available():
+            print("SciPy is required by --engine numpy.")
+            return
+        run_pipeline(args)
+        return
+
+    print("%-8s %-10s %-8s %-8s %-10s %-12s" % ("scale", "engine", "nodes", "edges", "hops", "ns/hop"))
+    for scale in [int(i) for i in args.scales.split(',')]:
+        paths = synthetic_paths(EX_PROBE * scale, n_trace=args.ntrace)
+        engines = [("indexed", lambda x: time_build(t.path_to_graph, x)), ("table", time_table_build)]
+        if args.legacy:
+            engines.append(("legacy", lambda x: time_build(legacy_path_to_graph, x)))
+        for name, build in engines:
+            hops, sec, g = build(paths)
+            print("%-8d %-10s %-8d %-8d %-10d %-12.1f" % (scale, name, g.number_of_nodes(), g.number_of_edges(),
+                                                         hops, sec * 1e9 / hops))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+binning.py computes binned sums of RTT changes for all the links and nodes of a topology at once with NumPy.
+
+Probes are mapped to topology elements (links then nodes) through a sparse incidence matrix built once.
+The change series of each probe are binned into a (probe x bin) matrix, and the scores of all elements
+follow from a single sparse matrix product.
+"""
+import time
+import logging
+import resource
+import jsonstream as js
+import timewindow as tw
+
+import numpy as np
+
+try:
+    import scipy.sparse as sp
+except ImportError:
+    sp = None
+
+
+def available():
+    """tell if SciPy required by this module is installed"""
+    return sp is not None
+
+
+def incidence_matrix(pb2links, pb2nodes, links, nodes):
+    """build the probe to element incidence matrix
+
+    Args:
+        pb2links (dict): {probe id : [link in g (n1, n2),...]}
+        pb2nodes (dict): {probe id: [nodes in g...]}
+        links (list of tuple): links of topology, in the order of score rows
+        nodes (list): nodes of topology; their score rows follow those of links
+
+    Returns:
+        tuple (probe_index, inc), probe_index is a dict {probe id: row in inc},
+        inc a sparse matrix of shape (probe #, link # + node #) with 1 where the probe traverses the element
+    """
+    link_col = {l: i for i, l in enumerate(links)}
+    node_col = {n: len(links) + i for i, n in enumerate(nodes)}
+    probe_index = dict()
+    rows, cols = [], []
+    for pb in set(pb2links) | set(pb2nodes):
+        row = probe_index.setdefault(pb, len(probe_index))
+        for l in pb2links.get(pb, []):
+            rows.append(row)
+            cols.append(link_col[l])
+        for n in pb2nodes.get(pb, []):
+            rows.append(row)
+            cols.append(node_col[n])
+    inc = sp.coo_matrix((np.ones(len(rows)), (rows, cols)),
+                        shape=(len(probe_index), len(links) + len(nodes))).tocsr()
+    return probe_index, inc
+
+
+def bin_probes(fn, method, probe_index, bin_size, begin, stop, stream=False, probes=None, segments=None):
+    """bin the change series of each probe recorded in a file
+
+    Args:
+        fn (string): path to the RTT file
+        method (string): field in the file to be extracted as the result of change detection
+        probe_index (dict): {probe id: row}, probes not in it are ignored
+        bin_size (int): the size of bin in seconds
+        begin (int): sec since epoch from which records in fn is considered
+        stop (int): sec since epoch till which records in fn is considered
+        stream (bool): read fn one probe at a time instead of loading it as a whole
+        probes (interning.Interner): if given, probe ids in probe_index are interned in it,
+            probe IDs in fn are translated with it
+        segments (np.array): if given, sorted sec since epoch where the topology changes, see snapshots;
+            probe_index is then keyed by (probe id, index of the segment the record falls in)
+
+    Returns:
+        tuple of sparse matrix (change sum, record count), both of shape (probe #, bin #);
+        bin i starts at tw.bin_floor(begin, bin_size) + i * bin_size
+    """
+    first = tw.bin_floor(begin, bin_size)
+    shape = (len(probe_index), len(tw.bin_range(begin, stop, bin_size)))
+    rows, cols, vals = [], [], []
+    try:
+        with open(fn, 'r') as fp:
+            for pb, pb_rec in js.load_items(fp, stream):
+                pb = pb if probes is None else probes.get(pb)
+                if not pb_rec or (segments is None and pb not in probe_index):
+                    continue
+                epochs = pb_rec.get("epoch", [])
+                begin_idx, stop_idx = tw.window_index(epochs, begin, stop)
+                t = np.asarray(epochs[begin_idx:stop_idx], dtype=np.int64)
+                v = np.asarray(pb_rec.get(method, [])[begin_idx:stop_idx], dtype=float)
+                t, v = t[:len(v)], v[:len(t)]
+                if segments is None:
+                    rows.append(np.full(len(t), probe_index[pb], dtype=np.int64))
+                else:
+                    # row of each record after the segment it falls in, records of unknown (probe, segment) dropped
+                    seg, inv = np.unique(np.searchsorted(segments, t, side='right') - 1, return_inverse=True)
+                    r = np.array([probe_index.get((pb, s), -1) for s in seg], dtype=np.int64)[inv]
+                    t, v, r = t[r >= 0], v[r >= 0], r[r >= 0]
+                    rows.append(r)
+                cols.append((t - first) // bin_size)
+                vals.append(v)
+    except (IOError, ValueError) as e:
+        # malformed content, e.g. a truncated file, may only be met halfway when streaming; the file is skipped
+        logging.critical("%s skipped: %s" % (fn, e))
+        rows, cols, vals = [], [], []
+    if rows:
+        rows, cols, vals = np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)
+    # duplicated (row, col) entries are summed up when converted to csr
+    change = sp.coo_matrix((vals, (rows, cols)), shape=shape).tocsr()
+    count = sp.coo_matrix((np.ones(len(rows)), (rows, cols)), shape=shape).tocsr()
+    return change, count
+
+
+def partial_scores(fn, method, probe_index, inc_t, bin_size, begin, stop, stream=False, probes=None, segments=None):
+    """calculate binned sum of RTT changes in a given file for each link and node
+
+    Args:
+        fn (string): path to the RTT file
+        method (string): field in the file to be extracted as the result of change detection
+        probe_index (dict): {probe id: column in inc_t}
+        inc_t (sparse matrix): transpose of the probe to element incidence matrix, see incidence_matrix()
+        bin_size (int): the size of bin in seconds
+        begin (int): sec since epoch from which records in fn is considered
+        stop (int): sec since epoch till which records in fn is considered
+        stream (bool): read fn one probe at a time instead of loading it as a whole
+        probes (interning.Interner): probe ID translation, see bin_probes()
+        segments (np.array): sec since epoch where the topology changes, see bin_probes()
+
+    Returns:
+        tuple of sparse matrix (change sum, record count), both of shape (element #, bin #)
+    """
+    t1 = time.time()
+    change, count = bin_probes(fn, method, probe_index, bin_size, begin, stop, stream, probes, segments)
+    res = (inc_t * change).tocsr(), (inc_t * count).tocsr()
+    t2 = time.time()
+    # ru_maxrss is in KB on Linux
+    logging.debug("%s handled in %.2f sec, peak RSS %.1f MB" %
+                  (fn, t2 - t1, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.))
+    return res
+
+
+def add_partials(store, partials):
+    """sum up the partial scores of each file into a score store
+
+    Args:
+        store (ScoreStore): store whose element rows follow the columns of the incidence matrix
+        partials (iterable of tuple): (change sum, record count) of each file, see partial_scores()
+    """
+    t1 = time.time()
+    change, count = None, None
+    for c, n in partials:
+        change = c if change is None else change + c
+        count = n if count is None else count + n
+    if change is not None:
+        store.score += change.toarray()
+        store.observed |= count.toarray() > 0
+    t2 = time.time()
+    logging.info("Change index summed up in %.2f sec" % (t2 - t1))
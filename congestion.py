@@ -1,7 +1,12 @@
 # calculated congestion index for a topology
 import os
 import argparse
+import multiprocessing
+import itertools
+import traceback
+import numpy as np
 import time
+import resource
 import tracegraph as tg
 import logging
 import json
@@ -9,11 +14,329 @@ from networkx.readwrite import json_graph
 from collections import defaultdict
 from itertools import chain
 import timetools as tt
+import binning as bn
+import scorestore as ss
+import topocache as tc
+import topobin as tb
+import interning as it
+import probeset as ps
+import snapshots as sn
+import profiling as pf
 
 BIN = 600  # bin size in sec
 CH_MTD = "cpt_poisson&MBIC"  # changepoint method for binning
 LINK_THRESHOLD = 0.5  # threshold for link inference
 NODE_THRESHOLD = 0.5  # threshold for node inference
+COLUMNAR, DICTS = 'columnar', 'dicts'  # layouts of score and inference series in output
+
+# read-only data shared by workers, set by init_worker for binning, inherited through fork for inference
+SHARED = dict()
+
+
+def init_worker(shared):
+    """set the data shared by all the files to be binned
+
+    Args:
+        shared (dict): engine, the probe to element mappings of that engine, begin, stop, stream, probes and segments
+    """
+    SHARED.clear()
+    SHARED.update(shared)
+
+
+def binsum_worker(fn):
+    """binned change sum of a file, with the engine and mappings set by init_worker
+
+    Args:
+        fn (string): path to the change detection file
+
+    Returns:
+        partial sums, see binning.partial_scores() and tracegraph.change_binsum_partial()
+    """
+    try:
+        if SHARED['engine'] == 'numpy':
+            return bn.partial_scores(fn, CH_MTD, SHARED['probe_index'], SHARED['inc_t'], BIN,
+                                     SHARED['begin'], SHARED['stop'], SHARED['stream'], SHARED['probes'],
+                                     SHARED['segments'])
+        else:
+            return tg.change_binsum_partial(fn, CH_MTD, SHARED['pb2links'], SHARED['pb2nodes'], BIN,
+                                            SHARED['begin'], SHARED['stop'], SHARED['stream'], SHARED['probes'],
+                                            SHARED['segments'])
+    except Exception:
+        logging.critical("Exception in worker.")
+        traceback.print_exc()
+        raise
+
+
+def inference_worker(bins):
+    """link inference over some bins, on the topology and store inherited from parent process, see SHARED
+
+    Args:
+        bins (list of int): offsets of bins to be inferred; node inference is supposed to be done
+
+    Returns:
+        tuple (rows, columns, values, stats), np.array of store.inference inferred other than NEG,
+        and the stats of tracegraph.change_inference_link()
+    """
+    try:
+        topo, store = SHARED['topo'], SHARED['store']
+        stats = dict()
+        tg.change_inference_link(topo, LINK_THRESHOLD, store, bins, SHARED['branches'], SHARED['active'], stats)
+        inference = store.inference[:, bins]
+        rows, cols = (inference > tg.NEG).nonzero()
+        return rows, np.asarray(bins)[cols], inference[rows, cols], stats
+    except Exception:
+        logging.critical("Exception in worker.")
+        traceback.print_exc()
+        raise
+
+
+def segment_inference_worker(segments):
+    """link inference over the bins of some time ranges of constant topology, see segment_mappings() and SHARED
+
+    Args:
+        segments (list of int): indexes of the time ranges to be inferred; node inference is supposed to be done
+
+    Returns:
+        tuple (rows, columns, values, stats), see inference_worker()
+    """
+    try:
+        topo, store = SHARED['topo'], SHARED['store']
+        bins = []
+        stats = dict()
+        for s in segments:
+            apply_segment(topo, SHARED['probe_sets'][s])
+            tg.change_inference_link(topo, LINK_THRESHOLD, store, SHARED['segment_bins'][s], dict(), SHARED['active'],
+                                     stats)
+            bins.extend(SHARED['segment_bins'][s])
+        inference = store.inference[:, bins]
+        rows, cols = (inference > tg.NEG).nonzero()
+        return rows, np.asarray(bins, dtype=int)[cols], inference[rows, cols], stats
+    except Exception:
+        logging.critical("Exception in worker.")
+        traceback.print_exc()
+        raise
+
+
+def merge_stats(stats, other):
+    """add the link inference stats of a worker to those of the whole run, see tracegraph.change_inference_link()"""
+    stats['evaluated'] = stats.get('evaluated', 0) + other.get('evaluated', 0)
+    stats['max_depth'] = max(stats.get('max_depth', 0), other.get('max_depth', 0))
+
+
+def load_topology(fn, cache=False, budget=None, seeds=None):
+    """load a topology and derive the probe mappings needed for binning and inference
+
+    Probes of links and nodes are turned into probe sets of interned ids; for each node, the probes with divergent paths
+    are selected, see tracegraph.divergent_set().
+
+    Args:
+        fn (string): path to the topology .json file, or binary topology file
+        cache (bool): reuse the derived structures saved in sidecar file by a previous run if still valid,
+            otherwise save them there, see topocache
+        budget (float): max sec spent in searching the divergent probe set of each node
+        seeds (int): max number of candidate sets started in searching the divergent probe set of each node
+
+    Returns:
+        tuple (topo, probes, pb2links, pb2nodes, branches), branches is None if not cached, they are then computed
+        on demand in inference; IOError or ValueError is raised if fn can not be loaded
+    """
+    # structures derived from topology are reused from previous runs if cached for the same topology and parameters
+    cached, key = None, None
+    t3 = time.time()
+    if cache:
+        key = tc.cache_key(fn, budget=budget, seeds=seeds)
+        cached = tc.load(fn, key)
+    if cached is not None:
+        t4 = time.time()
+        logging.info("Topology and probe mappings loaded from %s in %.2f sec" % (tc.cache_path(fn), t4-t3))
+        topo = tc.ordered_graph(cached['topo'], cached['nodes'], cached['links'])
+        return topo, cached['probes'], cached['pb2links'], cached['pb2nodes'], cached['branches']
+
+    # nodes and links are added to the graph in the order of file, kept as such in cache, see topocache
+    if tb.is_binary(fn):
+        # probes of links are loaded as probe sets of their index in the probe table of file
+        binary = tb.load(fn)
+        topo, probes = binary.to_graph(interned=True), it.Interner(binary.probes)
+        nodes, links = range(len(binary.names)), zip(binary.src.tolist(), binary.dst.tolist())
+    else:
+        with open(fn, 'r') as fp:
+            data = json.load(fp)
+        # load topo from json file
+        topo = json_graph.node_link_graph(data)
+        probes = None
+        nodes = [d.get('id', i) for i, d in enumerate(data['nodes'])]
+        links = [(nodes[d['source']], nodes[d['target']]) for d in data['links']]
+
+    pb2links = defaultdict(list)
+    pb2nodes = defaultdict(list)
+    t3 = time.time()
+    # probes are handled as sets of interned ids, translated back to probe IDs when serialized
+    # they are interned in sorted order, as in binary topology files, so that ids don't depend on the format
+    if probes is None:
+        probes = it.Interner(sorted(set(chain.from_iterable(d['probe'] for _, _, d in topo.edges_iter(data=True)))))
+        for l in topo.edges_iter():
+            topo[l[0]][l[1]]['probe'] = ps.ProbeSet([probes.id(pb) for pb in topo[l[0]][l[1]]['probe']])
+    # learn probe to link map, s.t. given a probe change trace, we know which links are meant to be updated
+    # the congestion and inference field for each link and node are rows of a ScoreStore attached later on
+    for l in topo.edges_iter():
+        for pb in topo[l[0]][l[1]]['probe']:
+            pb2links[pb].append(l)
+
+    # for each node, a probe set with divergent paths are as well needed to see if the congestion is caused by the node
+    # learn this probe set for each node and form a probe to node dict
+    for n in topo.nodes_iter():
+        p2n = defaultdict(lambda: {n})  # all the nodes traversed by probes on surrounding links
+        for neighbour in topo.neighbors(n):
+            for pb in topo[n][neighbour]["probe"]:
+                p2n[pb].add(neighbour)
+        # n is the only common node allowed
+        n_pb, res = tg.divergent_set(p2n, {n}, budget, seeds, probes.name, lambda x: topo.node[x]['name'])
+        # logging.debug("Node %r: %d possible divergent pbs sets of size %d" % (n, len(res), n_pb))
+        if res:
+            topo.node[n]['probe'] = ps.ProbeSet(res[0]['member'])
+            res[0]['attr'].remove(n)
+            topo.node[n]['effective_neighbour'] = list(res[0]['attr'])
+            for pb in topo.node[n]['probe']:
+                pb2nodes[pb].append(n)
+    t4 = time.time()
+    logging.info("Topo data preparation in %.2f sec" % (t4-t3))
+
+    branches = None
+    if cache:
+        t3 = time.time()
+        branches = tg.branch_index(topo)
+        tc.save(fn, key, dict(topo=topo, nodes=nodes, links=links, probes=probes, pb2links=dict(pb2links),
+                              pb2nodes=dict(pb2nodes), branches=branches))
+        t4 = time.time()
+        logging.info("Topology and probe mappings cached to %s in %.2f sec" % (tc.cache_path(fn), t4-t3))
+    return topo, probes, pb2links, pb2nodes, branches
+
+
+def segment_mappings(topo, snap, begin, stop, bin_size=BIN):
+    """the probe mappings of each time range of constant topology in [begin, stop], see snapshots.Snapshots.segments()
+
+    Links only have the probes traversing them in each range; nodes those of their divergent probe set, learnt on
+    the whole topology, traversing them in each range.
+    Ranges must be made of whole bins of inference, otherwise the records of a bin would be mapped after the range
+    the bin begins in by the python engine, after the range they fall in by the numpy one.
+
+    Args:
+        topo (nx.Graph): topology returned by load_topology(), the union of the snapshots
+        snap (snapshots.Snapshots): snapshots loaded on the nodes and probes of topo
+        begin (int): sec since epoch
+        stop (int): sec since epoch
+        bin_size (int): the size of bin of inference in seconds
+
+    Returns:
+        tuple (starts, pb2links, pb2nodes, probe_sets), starts the sorted sec since epoch beginning each range,
+        pb2links and pb2nodes keyed by (probe id, range index), probe_sets a tuple per range
+        ({link: ps.ProbeSet}, {node: ps.ProbeSet}); ValueError is raised if a link of snap is not in topo,
+        or if the bins of snap are not made of whole bins of bin_size
+    """
+    if snap.bin_size % bin_size or snap.first % bin_size:
+        raise ValueError("Snapshots of %d sec bins from %s don't align with bins of %d sec, see as_graph.py --snapshots."
+                         % (snap.bin_size, tt.epoch_to_string(snap.first), bin_size))
+    link_of = {sn.link_key(u, v): (u, v) for u, v in topo.edges_iter()}
+    starts, probe_sets = [], []
+    pb2links = defaultdict(list)
+    pb2nodes = defaultdict(list)
+    for s, (t, k) in enumerate(snap.segments(begin, stop)):
+        g = snap.at(k)
+        links, nodes = dict(), dict()
+        for u, v, d in g.edges_iter(data=True):
+            try:
+                l = link_of[sn.link_key(u, v)]
+            except KeyError:
+                raise ValueError("Link (%r, %r) of snapshots is not in topology." % (g.node[u]['name'], g.node[v]['name']))
+            # probe sets of snapshots are modified in place as the cursor moves, they are thus copied
+            links[l] = ps.ProbeSet() | d['probe']
+            for pb in links[l]:
+                pb2links[(pb, s)].append(l)
+        for n in g.nodes_iter():
+            if 'probe' in topo.node[n]:
+                traversing = ps.ProbeSet()
+                for neighbour in g.adj[n]:
+                    traversing |= g[n][neighbour]['probe']
+                nodes[n] = topo.node[n]['probe'] & traversing
+                for pb in nodes[n]:
+                    pb2nodes[(pb, s)].append(n)
+        starts.append(t)
+        probe_sets.append((links, nodes))
+    return starts, pb2links, pb2nodes, probe_sets
+
+
+def apply_segment(topo, probe_sets):
+    """set the probes of the links and nodes of topo to those of a time range, see segment_mappings()
+
+    Args:
+        topo (nx.Graph): topology returned by load_topology()
+        probe_sets (tuple of dict): ({link: ps.ProbeSet}, {node: ps.ProbeSet}), elements absent have no probe
+    """
+    links, nodes = probe_sets
+    for u, v, d in topo.edges_iter(data=True):
+        d['probe'] = links.get((u, v), ps.ProbeSet())
+    for n, d in topo.nodes_iter(data=True):
+        if 'probe' in d:
+            d['probe'] = nodes.get(n, ps.ProbeSet())
+
+
+def result_data(topo, store, probes, layout=COLUMNAR, digits=3, levels=None):
+    """format the change scores and inferences of topology as node-link data for js plot
+
+    Probe sets of links and nodes are translated back to probe IDs, topo is thus modified in place.
+
+    Args:
+        topo (nx.Graph): topology returned by load_topology(), with the store attached
+        store (scorestore.ScoreStore): change scores and inferences of topo
+        probes (interning.Interner): probe IDs of the probe ids in topo
+        layout (string): COLUMNAR, series given by bin offset along the bins of the window, see scorestore module doc;
+            or DICTS, the former layout, lists of {"epoch": sec since epoch, "value": ...}
+        digits (int): scores are rounded to that many decimal digits
+        levels (int): in the columnar layout, scores are instead quantized to integers, value * levels rounded
+
+    Returns:
+        dict, node-link data of topo along with the score and inference series of each link and node
+    """
+    # formatting congestion and inference filed for js plot
+    t3 = time.time()
+    for l in topo.edges_iter():
+        row = store.link_row[l]
+        attr = topo[l[0]][l[1]]
+        attr['probe'] = [probes.name(pb) for pb in attr['probe']]
+        if layout == COLUMNAR:
+            attr['score'], attr['inference'] = ss.encode_columns(store, row, tg.LIKELY, digits, levels)
+        else:
+            attr['score'] = [{"epoch": t, "value": round(v, digits)} for t, v in store.score_series(row)]
+            attr['inference'] = [{"epoch": t, "value": v} for t, v in store.inference_series(row, tg.LIKELY)]
+    for n in topo.nodes_iter():
+        row = store.node_row[n]
+        attr = topo.node[n]
+        if 'probe' in attr:
+            attr['probe'] = [probes.name(pb) for pb in attr['probe']]
+        if layout == COLUMNAR:
+            attr['score'], attr['inference'] = ss.encode_columns(store, row, tg.LIKELY, digits, levels)
+        else:
+            attr['score'] = dict(store.score_series(row))
+            attr['inference'] = [{"epoch": t, "value": v} for t, v in store.inference_series(row, tg.LIKELY)]
+    t4 = time.time()
+    logging.info("Change index and inference formatting in %.2f sec" % (t4 - t3))
+
+    # serialize graph to json
+    t3 = time.time()
+    res = dict()
+    res['congestion'] = True
+    if layout == COLUMNAR:
+        res['series'] = dict(layout=COLUMNAR, first=store.first, bin_size=store.bin_size, count=store.bin_count,
+                             scale=levels)
+    res['directed'] = topo.is_directed()
+    res['multigraph'] = topo.is_multigraph()
+    res['graph'] = topo.graph
+    res['nodes'] = [dict(chain(v.items(), [('id', k)])) for k, v in topo.nodes_iter(data=True)]
+    res['links'] = [dict(chain(v.items(), [('source', src), ('target', dst)])) for src, dst, v in topo.edges_iter(data=True)]
+    t4 = time.time()
+    logging.info("nx.Grape to dict in %.2f sec" % (t4-t3))
+
+    return res
 
 
 def main():
@@ -25,7 +348,7 @@ def main():
 
     parser = argparse.ArgumentParser()
     parser.add_argument("-g", "--topology",
-                        help="topology .json file",
+                        help="topology .json file, or binary topology file if ending with %s" % tb.EXTENSION,
                         action="store")
     parser.add_argument("-s", "--suffix",
                         help="the suffix of files to be considered in the directory",
@@ -42,24 +365,87 @@ def main():
     parser.add_argument("-o", "--outfile",
                         help="Specify the name of output .json file",
                         action="store")
+    parser.add_argument("--engine",
+                        help="engine binning the change detection results: python (default) or numpy, which requires NumPy and SciPy",
+                        choices=['python', 'numpy'], default='python',
+                        action="store")
+    parser.add_argument("-p", "--processes",
+                        help="number of worker processes handling change detection files and inference bins, default to CPU count",
+                        type=int, default=multiprocessing.cpu_count(),
+                        action="store")
+    parser.add_argument("--stream",
+                        help="read change detection files one probe at a time, bounding memory by the largest probe record",
+                        action="store_true")
+    parser.add_argument("--divergent-budget",
+                        help="max seconds spent in searching the divergent probe set of each node, no limit by default",
+                        type=float, default=None,
+                        action="store")
+    parser.add_argument("--divergent-seeds",
+                        help="max number of candidate sets started in searching the divergent probe set of each node, "
+                             "the fewer the faster but the set found may be smaller; all by default",
+                        type=int, default=None,
+                        action="store")
+    parser.add_argument("--cache",
+                        help="save the probe mappings derived from topology to a sidecar file next to it, "
+                             "and reuse them in later runs as long as the topology file is unchanged",
+                        action="store_true")
+    parser.add_argument("--snapshots",
+                        help="snapshot file saved along the topology by as_graph.py --snapshots; links and nodes are "
+                             "then only fed with the probes traversing them at each bin",
+                        action="store")
+    parser.add_argument("--series",
+                        help="layout of score and inference series in output: %s (default), along the bins of the "
+                             "window shared by all links and nodes, or %s, lists of {epoch, value} as in former "
+                             "versions" % (COLUMNAR, DICTS),
+                        choices=[COLUMNAR, DICTS], default=COLUMNAR,
+                        action="store")
+    parser.add_argument("--digits",
+                        help="decimal digits scores are rounded to in output, default to 3",
+                        type=int, default=3,
+                        action="store")
+    parser.add_argument("--quantize",
+                        help="in the %s layout, store scores as integers, value * LEVELS rounded" % COLUMNAR,
+                        type=int, metavar='LEVELS',
+                        action="store")
+    parser.add_argument("--store",
+                        help="as well save the scores and inferences to output file name + %s, "
+                             "as queried by server.py" % ss.SUFFIX,
+                        action="store_true")
+    parser.add_argument("--profile",
+                        help="save the wall time, CPU time, peak RSS and item counts of each phase "
+                             "to output file name + %s" % pf.SUFFIX,
+                        action="store_true")
+    parser.add_argument("--cprofile",
+                        help="as --profile, along with the functions taking most time in each phase according to "
+                             "cProfile; slows the run down",
+                        action="store_true")
     args = parser.parse_args()
     args_dict = vars(args)
 
-    if not all(map(bool, args_dict.values())):
+    if not all([args.topology, args.suffix, args.directory, args.beginTime, args.stopTime, args.outfile]):
         # all the parameters must be set
         print args.help
         return
 
+    if args.quantize and args.series != COLUMNAR:
+        logging.critical("--quantize only applies to the %s layout." % COLUMNAR)
+        return
+
+    if args.engine == 'numpy' and not bn.available():
+        logging.critical("SciPy is required by --engine numpy.")
+        return
+
+    prof = pf.Profiler(args.profile, args.cprofile)
+    prof.start('topology')
     try:
-        with open(args.topology, 'r') as fp:
-            topo = json.load(fp)
-    except IOError as e:
+        topo, probes, pb2links, pb2nodes, branches = load_topology(args.topology, args.cache,
+                                                                    args.divergent_budget, args.divergent_seeds)
+    except (IOError, ValueError) as e:
         logging.error(e)
         return
-
-    # load topo from json file
-    topo = json_graph.node_link_graph(topo)
     logging.info("%d node, %d links" % (len(topo.nodes()), len(topo.edges())))
+    prof.stop(nodes=topo.number_of_nodes(), links=topo.number_of_edges(), probes=len(probes),
+              divergent=sum(1 for _, d in topo.nodes_iter(data=True) if 'probe' in d))
 
     if not os.path.exists(args.directory):
         logging.error("%s doesn't exist." % args.directory)
@@ -87,103 +473,153 @@ def main():
         logging.critical("Wrong --stopTime format. Should be %s." % '%Y-%m-%d %H:%M:%S %z')
         return
 
+    # with snapshots, the window is split into time ranges of constant topology,
+    # probe mappings are keyed by (probe, range) and records are mapped after the range they fall in
+    segments, probe_sets = None, None
+    if args.snapshots:
+        t3 = time.time()
+        prof.start('snapshots')
+        try:
+            snap = sn.load(args.snapshots, {d['name']: n for n, d in topo.nodes_iter(data=True)}, probes)
+            segments, pb2links, pb2nodes, probe_sets = segment_mappings(topo, snap, begin, stop)
+        except (IOError, ValueError, KeyError) as e:
+            logging.error(e)
+            return
+        t4 = time.time()
+        logging.info("%d time ranges of constant topology learnt from %s in %.2f sec" %
+                     (len(segments), args.snapshots, t4-t3))
+        prof.stop(segments=len(segments))
+
     # log parameter to graph
     topo.graph['congestion_begin'] = begin
     topo.graph['congestion_end'] = stop
     topo.graph['cpt_method'] = CH_MTD
     topo.graph['cpt_bin_size'] = BIN
 
-    pb2links = defaultdict(list)
-    pb2nodes = defaultdict(list)
+    # calculate the change sum per bin per link, per node
+    # files are handled by a pool of workers, each returning partial sums
     t3 = time.time()
-    # learn probe to link map, s.t. given a probe change trace, we know which links are meant to be updated
-    # initialize the congestion and inference field for each link and node
-    for l in topo.edges_iter():
-        topo[l[0]][l[1]]['score'] = defaultdict(int)
-        topo[l[0]][l[1]]['inference'] = dict()
-        for pb in topo[l[0]][l[1]]['probe']:
-            pb2links[pb].append(l)
+    prof.start('binning')
+    store = ss.ScoreStore(topo.edges(), topo.nodes(), begin, stop, BIN)
+    if args.engine == 'numpy':
+        probe_index, inc = bn.incidence_matrix(pb2links, pb2nodes, store.links, store.nodes)
+        shared = dict(engine=args.engine, probe_index=probe_index, inc_t=inc.T.tocsr(),
+                      begin=begin, stop=stop, stream=args.stream, probes=probes,
+                      segments=None if segments is None else np.asarray(segments, dtype=np.int64))
+    else:
+        shared = dict(engine=args.engine, pb2links=pb2links, pb2nodes=pb2nodes,
+                      begin=begin, stop=stop, stream=args.stream, probes=probes, segments=segments)
+    if args.processes > 1:
+        pool = multiprocessing.Pool(processes=args.processes, initializer=init_worker, initargs=(shared,))
+        partials = pool.imap(binsum_worker, files)
+    else:
+        init_worker(shared)
+        partials = itertools.imap(binsum_worker, files)
 
-    # initialize the congestion and inference field for each link and node
-    # for each node, a probe set with divergent paths are as well needed to see if the congestion is caused by the node
-    # learn this probe set for each node and form a probe to node dict
-    for n in topo.nodes_iter():
-        topo.node[n]['score'] = defaultdict(int)
-        topo.node[n]['inference'] = dict()
-
-        p2n = defaultdict(lambda: {n})  # all the nodes traversed by probes on surrounding links
-        for neighbour in topo.neighbors(n):
-            for pb in topo[n][neighbour]["probe"]:
-                p2n[pb].add(neighbour)
-        n_pb, res = tg.divergent_set(p2n, {n})  # n is the only common node allowed
-        # logging.debug("Node %r: %d possible divergent pbs sets of size %d" % (n, len(res), n_pb))
-        if res:
-            topo.node[n]['probe'] = res[0]['member']
-            res[0]['attr'].remove(n)
-            topo.node[n]['effective_neighbour'] = list(res[0]['attr'])
-            for pb in topo.node[n]['probe']:
-                pb2nodes[pb].append(n)
+    if args.engine == 'numpy':
+        bn.add_partials(store, partials)
+    else:
+        for partial in partials:
+            tg.binsum_update(store, partial)
+    if args.processes > 1:
+        pool.close()
+        pool.join()
     t4 = time.time()
-    logging.info("Topo data preparation in %.2f sec" % (t4-t3))
-
-    # calculate the change sum per bin per link, per node
-    # incrementally update the entire, file by file
-    for f in files:
-        tg.change_binsum(f, CH_MTD, topo, pb2links, pb2nodes, BIN, begin, stop)
+    logging.info("%d files binned in %.2f sec" % (len(files), t4-t3))
+    prof.stop(files=len(files), bins=store.bin_count)
 
     # normalize the change count per bin per link by the probe numbers per link
     t3 = time.time()
-    for l in topo.edges_iter():
-        pb_count = len(topo[l[0]][l[1]]['probe'])
-        try:
-            for t in topo[l[0]][l[1]]['score']:
-                topo[l[0]][l[1]]['score'][t] /= float(pb_count)
-        except ZeroDivisionError:
-            logging.error("%r has no probe." % topo[l[0]][l[1]])
-
-    for n in topo.nodes_iter():
-        pb_count = len(topo.node[n]['probe'])
-        if pb_count:
-            for t in topo.node[n]['score']:
-                topo.node[n]['score'][t] /= float(pb_count)
+    prof.start('normalization')
+    if segments is None:
+        pb_count = [len(topo[l[0]][l[1]]['probe']) for l in store.links] + \
+                   [len(topo.node[n].get('probe', [])) for n in store.nodes]
+        for l, c in zip(store.links, pb_count):
+            if not c:
+                logging.error("%r has no probe." % topo[l[0]][l[1]])
+    else:
+        # bins of each time range, probe counts change from one range to another
+        bounds = [store.bin_index(t) for t in segments] + [store.bin_count]
+        segment_bins = [range(c0, c1) for c0, c1 in zip(bounds[:-1], bounds[1:])]
+        pb_count = np.zeros(store.score.shape)
+        for (links, nodes), bins in zip(probe_sets, segment_bins):
+            count = np.zeros(len(store.links) + len(store.nodes))
+            for l, pbs in links.iteritems():
+                count[store.link_row[l]] = len(pbs)
+            for n, pbs in nodes.iteritems():
+                count[store.node_row[n]] = len(pbs)
+            pb_count[:, bins] = count[:, np.newaxis]
+    store.normalize(pb_count)
+    store.attach(topo)
+    # for each bin, the elements above threshold; only they are visited by the inference
+    active_nodes = store.active(NODE_THRESHOLD, store.node_rows)
+    active_links = store.active(LINK_THRESHOLD, store.link_rows)
     t4 = time.time()
-    logging.info("Normalize change index in %.2f sec" % (t4-t3))
+    logging.info("Normalize change index in %.2f sec, %d node and %d link changes above threshold" %
+                 (t4-t3, sum(map(len, active_nodes)), sum(map(len, active_links))))
+    prof.stop(active_nodes=sum(map(len, active_nodes)), active_links=sum(map(len, active_links)))
 
     # perform change location inference
-    tg.change_inference_node(topo, NODE_THRESHOLD, BIN, begin, stop)
-    tg.change_inference_link(topo, LINK_THRESHOLD, BIN, begin, stop)
-
-    # formatting congestion and inference filed for js plot
-    t3 = time.time()
-    for l in topo.edges_iter():
-        topo[l[0]][l[1]]['score'] = [{"epoch": i[0], "value": round(i[1], 3)}
-                                     for i in sorted(topo[l[0]][l[1]]['score'].items(), key=lambda s: s[0])]
-        topo[l[0]][l[1]]['inference'] = [{"epoch": i[0], "value": i[1]}
-                                         for i in sorted(topo[l[0]][l[1]]['inference'].items(), key=lambda s: s[0])
-                                         if i[1] != tg.NEG]
-    for n in topo.nodes_iter():
-        topo.node[n]['inference'] = [{"epoch": i[0], "value": i[1]}
-                                     for i in sorted(topo.node[n]['inference'].items(), key=lambda s: s[0])
-                                     if i[1] != tg.NEG]
-    t4 = time.time()
-    logging.info("Change index and inference formatting in %.2f sec" % (t4 - t3))
-
-    # serialize graph to json
     t3 = time.time()
-    res = dict()
-    res['congestion'] = True
-    res['directed'] = topo.is_directed()
-    res['multigraph'] = topo.is_multigraph()
-    res['graph'] = topo.graph
-    res['nodes'] = [dict(chain(v.items(), [('id', k)])) for k, v in topo.nodes_iter(data=True)]
-    res['links'] = [dict(chain(v.items(), [('source', src), ('target', dst)])) for src, dst, v in topo.edges_iter(data=True)]
+    prof.start('inference')
+    stats = dict()
+    if segments is not None:
+        # each time range is inferred on its own topology, which is restored to the union of snapshots afterwards
+        union = ({l: topo[l[0]][l[1]]['probe'] for l in topo.edges_iter()},
+                 {n: d['probe'] for n, d in topo.nodes_iter(data=True) if 'probe' in d})
+        for sets, bins in zip(probe_sets, segment_bins):
+            apply_segment(topo, sets)
+            tg.change_inference_node(topo, NODE_THRESHOLD, store, bins, active_nodes)
+        if args.processes > 1 and len(segments) > 1:
+            SHARED.clear()
+            SHARED.update(topo=topo, store=store, probe_sets=probe_sets, segment_bins=segment_bins, active=active_links)
+            pool = multiprocessing.Pool(processes=args.processes)
+            chunks = [list(c) for c in np.array_split(np.arange(len(segments)), args.processes * 4) if len(c)]
+            for rows, cols, values, worker_stats in pool.imap_unordered(segment_inference_worker, chunks):
+                store.inference[rows, cols] = values
+                merge_stats(stats, worker_stats)
+            pool.close()
+            pool.join()
+        else:
+            for sets, bins in zip(probe_sets, segment_bins):
+                apply_segment(topo, sets)
+                tg.change_inference_link(topo, LINK_THRESHOLD, store, bins, dict(), active_links, stats)
+        apply_segment(topo, union)
+    else:
+        tg.change_inference_node(topo, NODE_THRESHOLD, store, active=active_nodes)
+        if args.processes > 1 and store.bin_count > 1:
+            # bins are independent from each other, they are split among workers sharing the topo through fork
+            SHARED.clear()
+            if branches is None:
+                branches = tg.branch_index(topo)
+            SHARED.update(topo=topo, store=store, branches=branches, active=active_links)
+            pool = multiprocessing.Pool(processes=args.processes)
+            chunks = [list(c) for c in np.array_split(np.arange(store.bin_count), args.processes * 4) if len(c)]
+            for rows, cols, values, worker_stats in pool.imap_unordered(inference_worker, chunks):
+                store.inference[rows, cols] = values
+                merge_stats(stats, worker_stats)
+            pool.close()
+            pool.join()
+        else:
+            tg.change_inference_link(topo, LINK_THRESHOLD, store, branches=branches, active=active_links, stats=stats)
     t4 = time.time()
-    logging.info("nx.Grape to dict in %.2f sec" % (t4-t3))
+    logging.info("Change location inference in %.2f sec" % (t4 - t3))
+    prof.stop(bins=store.bin_count, evaluated_links=stats.get('evaluated', 0), max_depth=stats.get('max_depth', 0),
+              inferred_links=int((store.inference[store.link_rows] >= tg.LIKELY).sum()),
+              inferred_nodes=int((store.inference[store.node_rows] >= tg.LIKELY).sum()))
 
+    prof.start('serialization')
+    if args.store:
+        ss.dump(store, ss.store_path(args.outfile))
+    res = result_data(topo, store, probes, args.series, args.digits, args.quantize)
     json.dump(res, open(args.outfile, 'w'))
+    prof.stop(bytes=os.path.getsize(args.outfile))
+    prof.dump(pf.report_path(args.outfile))
 
     t2 = time.time()
-    logging.info("Whole task finished in %.2f sec" % (t2 - t1))
+    # ru_maxrss is in KB on Linux
+    logging.info("Whole task finished in %.2f sec, peak RSS %.1f MB" %
+                 (t2 - t1, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,97 @@
+"""
+interning.py maps names, e.g. ASNs, IXP names and probe IDs, to dense integer ids assigned in the order of first appearance.
+
+Graphs are built and analysed on integer ids, which are cheaper to hash and to store than strings.
+A graph built on ids carries its name tables as graph attributes (see NODES and PROBES),
+so that graphs built separately, e.g. by different workers, can be merged, see remap(),
+and translated back to names when serialized, see tracegraph.node_link_data_modify().
+"""
+
+NODES = 'node_names'  # graph attribute holding the Interner of nodes
+PROBES = 'probe_names'  # graph attribute holding the Interner of probes
+PROBE_ATTRS = ('probe', 'hosting')  # node and link attributes that are collections of probe ids
+
+
+class Interner(object):
+    """a table of names and their integer ids
+
+    Attributes:
+        names (list): names indexed by their ids
+        ids (dict): {name: id}
+    """
+
+    def __init__(self, names=()):
+        """
+        Args:
+            names (iterable): names to be interned, in the order of ids
+        """
+        self.names = []
+        self.ids = dict()
+        for n in names:
+            self.id(n)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def __getstate__(self):
+        # ids are rebuilt from names when unpickled, halving what is sent between processes
+        return self.names
+
+    def __setstate__(self, names):
+        self.names = names
+        self.ids = {n: i for i, n in enumerate(names)}
+
+    def id(self, name):
+        """the id of name, a new one is assigned if name is seen for the first time"""
+        try:
+            return self.ids[name]
+        except KeyError:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+            return i
+
+    def get(self, name, default=None):
+        """the id of name, default if name is not interned"""
+        return self.ids.get(name, default)
+
+    def name(self, i):
+        """the name of id i"""
+        return self.names[i]
+
+    def remap(self, other):
+        """ids in this table of the names of another table, names unknown to this table are interned
+
+        Args:
+            other (Interner)
+
+        Returns:
+            list, the id in this table of each id in other
+        """
+        return [self.id(n) for n in other.names]
+
+
+def interned(g):
+    """tell if nodes and probes of a graph are integer ids, i.e. if it carries its name tables"""
+    return NODES in g.graph and PROBES in g.graph
+
+
+def remap(original, delta):
+    """the translations of the ids of delta graph to those of original graph, to be applied before merging them
+
+    Name tables of original are created if missing, and extended with the names only known to delta.
+
+    Args:
+        original (nx.Graph)
+        delta (nx.Graph)
+
+    Returns:
+        tuple of list (node id translation, probe id translation), (None, None) if delta is not interned
+    """
+    if not interned(delta):
+        return None, None
+    nodes = original.graph.setdefault(NODES, Interner())
+    probes = original.graph.setdefault(PROBES, Interner())
+    return nodes.remap(delta.graph[NODES]), probes.remap(delta.graph[PROBES])
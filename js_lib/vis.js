@@ -33,6 +33,14 @@ var tformatter = d3.utcFormat("%Y-%m-%d %H:%M");
 var opened_f, loaded_data, moment, is_congestion_graph, show_inference_result, bin_size, begin, end;
 var link_threshold = 0.5;
 
+// when the page is served by server.py, the topology is fetched once, then the scores and inferences of each bin
+// (bin_frame) as the moment changes; links and nodes refer to their values in bin_frame by their row
+var served = false, bin_frame = null;
+
+// axis of the bins of the window when series are in the columnar layout of congestion.py, null for lists of
+// {epoch, value}; see scorestore.py for the layout
+var series = null;
+
 function plot() {
     var file = document.getElementById("file_input");
     if ('files' in file && file.files.length > 0) {
@@ -47,6 +55,8 @@ function plot() {
                     //d3.select("#status").text(Math.round(f.size/(1048576)) + "MB loaded in " + parseFloat(Math.round((t1-t0) * 100) / 100).toFixed(2) + " milliseconds.\n Now scoping and plotting data...");
                     //console.log(f.name + ": " + Math.round(f.size/(1048576)) + "MB, " + parseFloat(Math.round((t1-t0) * 100) / 100).toFixed(2) + "msec");
                     opened_f = f;
+                    served = false;
+                    bin_frame = null;
                     try {
                         loaded_data = JSON.parse(evt.target.result); // read the file as text and parse it to JSON object
                     } catch (ex) {
@@ -77,6 +87,13 @@ function init() {
         is_congestion_graph = false
       }
 
+      series = null;
+      if (is_congestion_graph && loaded_data.hasOwnProperty("series") && !served) {
+          series = loaded_data.series;
+          loaded_data.links.forEach(decodeColumns);
+          loaded_data.nodes.forEach(decodeColumns);
+      }
+
       if (is_congestion_graph) {
           if (loaded_data.graph.hasOwnProperty("cpt_bin_size")) {
             bin_size = loaded_data.graph.cpt_bin_size;
@@ -101,23 +118,37 @@ function init() {
 
       show_inference_result = false;
 
+      // nodes laid out offline by layout.py are rendered at their stored positions, without simulation
+      var laid_out = loaded_data.nodes.length > 0 && loaded_data.nodes.every(function(d) {
+          return typeof d.x === "number" && typeof d.y === "number";
+      });
+
       var simulation = d3.forceSimulation()
             .force("link", d3.forceLink().id(function(d) { return d.id; }))
             .force("charge", d3.forceManyBody())
             .force("center", d3.forceCenter(width / 2, height / 2));
 
       function dragstarted(d) {
+          if (laid_out) return;
           if (!d3.event.active) simulation.alphaTarget(0.3).restart();
           d.fx = d.x;
           d.fy = d.y;
       }
 
       function dragged(d) {
+          if (laid_out) {
+              // only the dragged node moves
+              d.x = d3.event.x;
+              d.y = d3.event.y;
+              ticked();
+              return;
+          }
           d.fx = d3.event.x;
           d.fy = d3.event.y;
       }
 
       function dragended(d) {
+          if (laid_out) return;
           if (!d3.event.active) simulation.alphaTarget(0);
           d.fx = null;
           d.fy = null;
@@ -198,6 +229,12 @@ function init() {
       simulation.force("link")
           .links(loaded_data.links);
 
+      if (laid_out) {
+          // the simulation only resolved the nodes at link ends
+          simulation.stop();
+          ticked();
+      }
+
       function ticked() {
             link
             .attr("x1", function(d) { return d.source.x; })
@@ -218,22 +255,41 @@ function update() {
         moment = Math.floor(m / (bin_size * 1000)) * bin_size * 1000;
         document.getElementById("datetime").value = tformatter(moment);
 
-        svg.selectAll("line")
-            .attr("congestion_level", congestion)
-            .attr("inference", inference);
-        svg.selectAll("line")
-            .attr("stroke", linkColor)
-            .attr("opacity", linkOpacity);
-
-        svg.selectAll("circle")
-            .attr("inference", inference);
-        svg.selectAll("circle")
-            .attr("stroke", nodeBorder)
+        if (served) {
+            var requested = moment;
+            d3.json("api/bin?epoch=" + (requested / 1000), function(error, frame) {
+                // responses to moments navigated away from meanwhile are dropped
+                if (requested != moment) return;
+                if (error) {
+                    // out of the time window
+                    bin_frame = null;
+                } else {
+                    bin_frame = frame;
+                }
+                redraw();
+            });
+        } else {
+            redraw();
+        }
     } else {
         alert("Only congestion graph can be navigated in time.");
     }
 }
 
+function redraw() {
+    svg.selectAll("line")
+        .attr("congestion_level", congestion)
+        .attr("inference", inference);
+    svg.selectAll("line")
+        .attr("stroke", linkColor)
+        .attr("opacity", linkOpacity);
+
+    svg.selectAll("circle")
+        .attr("inference", inference);
+    svg.selectAll("circle")
+        .attr("stroke", nodeBorder)
+}
+
 function navigator(is_forward) {
     var m = is_forward? moment + bin_size * 1000 : moment - bin_size * 1000;
     document.getElementById("datetime").value = tformatter(m);
@@ -309,8 +365,53 @@ function showPath(d) {
     }
 }
 
+function deltaDecode(deltas) {
+    // bin offsets from their differences with the previous one
+    var k = 0;
+    return deltas.map(function(v) { return k += v; });
+}
+
+function decodeColumns(d) {
+    // in place, series as sorted bin offsets; the runs of bins with and without records as the bins they start at
+    var start = 0;
+    d.score.observed = d.score.observed.map(function(v) { return start += v; });
+    d.score.bin = deltaDecode(d.score.bin);
+    if (series.scale) {
+        d.score.value = d.score.value.map(function(v) { return v / series.scale; });
+    }
+    d.inference.bin = deltaDecode(d.inference.bin);
+}
+
+function columnValue(column, k) {
+    // value of a decoded series at bin offset k, null if the bin is not listed
+    var i = d3.bisectLeft(column.bin, k);
+    return (i < column.bin.length && column.bin[i] == k) ? column.value[i] : null;
+}
+
+function binOffset() {
+    return Math.round((moment / 1000 - series.first) / series.bin_size);
+}
+
+function frameValue(key, row) {
+    // value of a row in the bin fetched from server.py, null for no record
+    if (bin_frame && bin_frame[key][row] !== null) {
+        return bin_frame[key][row];
+    }
+    return 'NA';
+}
+
 function congestion(d) {
-    if(is_congestion_graph){
+    if (served) {
+        return frameValue('score', d.row);
+    } else if (series) {
+        var k = binOffset();
+        // runs alternate, starting with one without records
+        if (d3.bisectRight(d.score.observed, k) % 2 == 0) {
+            return 'NA';
+        }
+        var v = columnValue(d.score, k);
+        return v === null ? 0 : v;
+    } else if(is_congestion_graph){
         return datetimeSearch(d.score, moment);
     } else {
         return 'NA';
@@ -318,7 +419,12 @@ function congestion(d) {
 }
 
 function inference(d) {
-    if(is_congestion_graph){
+    if (served) {
+        return frameValue('inference', d.row);
+    } else if (series) {
+        var v = columnValue(d.inference, binOffset());
+        return v === null ? 'NA' : v;
+    } else if(is_congestion_graph){
         return datetimeSearch(d.inference, moment);
     } else {
         return 'NA';
@@ -425,6 +531,17 @@ function nodeBorder(d) {
 
 
 
+// when served by server.py, load the topology at once
+d3.json("api/topology", function(error, data) {
+    if (error) return;
+    served = true;
+    bin_frame = null;
+    loaded_data = data;
+    svg.selectAll("*").remove();
+    init();
+    if (is_congestion_graph) update();
+});
+
 d3.select('body')
     .on("keydown", function (){
         if (d3.event.shiftKey) {
@@ -0,0 +1,108 @@
+"""
+jsonstream.py reads the top level object of a .json file incrementally, one (key, value) pair at a time.
+Files produced by the path analysis and change detection are such objects with probe IDs as keys;
+reading them this way keeps in memory only one probe record instead of the whole file.
+"""
+import json
+
+CHUNK_SIZE = 1 << 16  # bytes read at a time
+_WS = ' \t\n\r'
+
+
+class _Buffer(object):
+    """a window over the file content not consumed yet"""
+
+    def __init__(self, fp, chunk_size):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.data = ''
+        self.pos = 0
+        self.eof = False
+
+    def more(self):
+        """read one more chunk from file; drop the consumed part; return False if nothing more to read"""
+        if self.eof:
+            return False
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.data = self.data[self.pos:] + chunk
+        self.pos = 0
+        # a value larger than the current chunk size is being read, read larger chunks to stay linear
+        if len(self.data) > self.chunk_size:
+            self.chunk_size *= 2
+        return True
+
+    def peek(self):
+        """skip white spaces and return the next char, '' at the end of file"""
+        while True:
+            while self.pos < len(self.data) and self.data[self.pos] in _WS:
+                self.pos += 1
+            if self.pos < len(self.data):
+                return self.data[self.pos]
+            if not self.more():
+                return ''
+
+    def expect(self, chars):
+        """consume the next char, which must be one of chars"""
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError("Expecting one of %r at position %d, got %r" % (chars, self.pos, c))
+        self.pos += 1
+        return c
+
+    def decode(self, decoder):
+        """decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.data, self.pos)
+            except ValueError:
+                if not self.more():
+                    raise
+                continue
+            # a number or a literal ending exactly at the end of buffer might be truncated
+            if end == len(self.data) and self.more():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_items(fp, chunk_size=CHUNK_SIZE):
+    """yield the (key, value) pairs of the top level JSON object stored in a file one by one
+
+    Args:
+        fp (file): file object opened for reading, positioned at the beginning of a JSON object
+        chunk_size (int): number of bytes read from fp at a time
+
+    Returns:
+        generator of (key, value); ValueError is raised on malformed content
+    """
+    decoder = json.JSONDecoder()
+    buf = _Buffer(fp, chunk_size)
+    buf.expect('{')
+    if buf.peek() == '}':
+        return
+    while True:
+        key = buf.decode(decoder)
+        buf.expect(':')
+        value = buf.decode(decoder)
+        yield key, value
+        if buf.expect(',}') == '}':
+            return
+
+
+def load_items(fp, stream=False):
+    """iterate over the (key, value) pairs of the top level JSON object stored in a file
+
+    Args:
+        fp (file): file object opened for reading
+        stream (bool): read the file incrementally if True, otherwise load it entirely with json.load
+
+    Returns:
+        iterator of (key, value)
+    """
+    if stream:
+        return iter_items(fp)
+    return json.load(fp).iteritems()
@@ -0,0 +1,263 @@
+"""
+layout.py computes offline the positions of the nodes of a topology, so that js_lib/vis.js renders it at once
+instead of running a force simulation in the browser until it settles.
+
+The layout is multilevel force-directed: the graph is coarsened repeatedly, by merging leaves into their neighbour and
+matching the remaining nodes pairwise, until a few dozen nodes are left. The coarsest graph is laid out with
+Fruchterman-Reingold forces; each finer graph starts from the positions of the coarser one and is only refined.
+Repulsion is computed between all pairs on small graphs, and on large ones only between nodes closer than a cutoff,
+found with a k-d tree if SciPy is installed.
+
+Positions are stored as 'x' and 'y' of each node in node-link data, in the coordinates of the canvas of vis.js:
+    python layout.py -i graph.json -o graph_layout.json
+as_graph.py does the same before saving the topology with --layout.
+"""
+import json
+import time
+import logging
+import argparse
+import numpy as np
+import topobin as tb
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+SIZE = 5000  # width and height of the canvas of vis.js
+MARGIN = 50  # distance kept between nodes and the border of canvas
+COARSEST = 50  # coarsening stops below that many nodes
+DENSE = 1000  # graphs up to that many nodes have repulsion computed between all pairs
+BLOCK = 256  # rows of pairwise distances computed at a time without k-d tree
+MIN_DIST2 = 1e-6  # squared distance below which nodes are considered as overlapping
+PAIRS_EVERY = 5  # iterations between two searches of close nodes with k-d tree
+
+
+def available():
+    """tell if SciPy is installed, i.e. if the repulsion of large graphs is computed with a k-d tree"""
+    return cKDTree is not None
+
+
+def _coarsen(n, edges, mass, rnd):
+    """merge nodes of a graph into groups of a coarser graph
+
+    Leaves are merged into their neighbour, the others are matched with an unmatched neighbour of least mass.
+
+    Args:
+        n (int): number of nodes
+        edges (np.array): int, shape (link #, 2), each link once, without self loop
+        mass (np.array): number of original nodes in each node
+        rnd (np.random.RandomState): order in which nodes are matched
+
+    Returns:
+        tuple (parent, coarse n, coarse edges, coarse mass), parent the group of each node
+    """
+    adj = [[] for _ in xrange(n)]
+    for u, v in edges.tolist():
+        adj[u].append(v)
+        adj[v].append(u)
+    parent = np.full(n, -1, dtype=np.int64)
+    groups = 0
+    # hubs and their leaves, e.g. a transit AS and its stub customers, collapse at once
+    for u in xrange(n):
+        if len(adj[u]) == 1 and len(adj[adj[u][0]]) > 1:
+            hub = adj[u][0]
+            if parent[hub] < 0:
+                parent[hub] = groups
+                groups += 1
+            parent[u] = parent[hub]
+    for u in rnd.permutation(n).tolist():
+        if parent[u] >= 0:
+            continue
+        free = [v for v in adj[u] if parent[v] < 0]
+        parent[u] = groups
+        if free:
+            parent[min(free, key=lambda v: (mass[v], v))] = groups
+        groups += 1
+    coarse = parent[edges]
+    coarse = coarse[coarse[:, 0] != coarse[:, 1]]
+    coarse.sort(axis=1)
+    coarse = np.unique(coarse, axis=0) if len(coarse) else coarse.reshape(0, 2)
+    return parent, groups, coarse, np.bincount(parent, weights=mass, minlength=groups)
+
+
+def _close_pairs(pos, cutoff):
+    """pairs of nodes closer than cutoff, as two arrays (i, j) with i < j"""
+    pairs = cKDTree(pos).query_pairs(cutoff, output_type='ndarray')
+    return pairs[:, 0], pairs[:, 1]
+
+
+def _repulsion(pos, mass, k, pairs=None, cutoff=None):
+    """displacement of each node away from the others, by k**2 * mass / distance
+
+    Args:
+        pos (np.array): float, shape (node #, 2)
+        mass (np.array): number of original nodes in each node
+        k (float): natural length of links
+        pairs (tuple of np.array): only these pairs of nodes repulse each other if set, see _close_pairs()
+        cutoff (float): otherwise, only nodes closer than that repulse each other if set
+
+    Returns:
+        np.array of the shape of pos
+    """
+    n = len(pos)
+    disp = np.zeros_like(pos)
+    if pairs is not None:
+        i, j = pairs
+        delta = pos[i] - pos[j]
+        w = k * k / np.maximum((delta ** 2).sum(axis=1), MIN_DIST2)
+        wi, wj = w * mass[j], w * mass[i]
+        for c in (0, 1):
+            disp[:, c] = np.bincount(i, delta[:, c] * wi, minlength=n) - np.bincount(j, delta[:, c] * wj, minlength=n)
+        return disp
+    for start in xrange(0, n, BLOCK):
+        delta = pos[start:start + BLOCK, np.newaxis, :] - pos[np.newaxis, :, :]
+        d2 = np.maximum((delta ** 2).sum(axis=2), MIN_DIST2)
+        w = k * k * mass[np.newaxis, :] / d2
+        if cutoff is not None:
+            w[d2 > cutoff ** 2] = 0
+        disp[start:start + BLOCK] = (delta * w[:, :, np.newaxis]).sum(axis=1)
+    return disp
+
+
+def _refine(pos, edges, mass, k, iterations, step):
+    """move nodes along Fruchterman-Reingold forces, in place, with a step shrinking at each iteration
+
+    On large graphs, the pairs of close nodes are only searched every PAIRS_EVERY iterations, nodes moving little
+    in between.
+
+    Args:
+        pos (np.array): float, shape (node #, 2), initial positions
+        edges (np.array): int, shape (link #, 2)
+        mass (np.array): number of original nodes in each node
+        k (float): natural length of links
+        iterations (int): number of moves
+        step (float): max move of a node in the first iteration
+    """
+    n = len(pos)
+    cutoff = None if n <= DENSE else 2 * k
+    pairs = None
+    u, v = edges[:, 0], edges[:, 1]
+    for i in xrange(iterations):
+        if cutoff is not None and cKDTree is not None and i % PAIRS_EVERY == 0:
+            pairs = _close_pairs(pos, cutoff)
+        disp = _repulsion(pos, mass, k, pairs, cutoff)
+        delta = pos[u] - pos[v]
+        f = delta * (np.sqrt((delta ** 2).sum(axis=1)) / k)[:, np.newaxis]
+        for c in (0, 1):
+            disp[:, c] += np.bincount(v, f[:, c], minlength=n) - np.bincount(u, f[:, c], minlength=n)
+        length = np.maximum(np.sqrt((disp ** 2).sum(axis=1)), 1e-9)
+        pos += disp * (np.minimum(length, step) / length)[:, np.newaxis]
+        step *= 1 - 1. / (iterations - i + 1)
+
+
+def layout(n, edges, size=SIZE, iterations=50, seed=0):
+    """positions of the nodes of a graph
+
+    Args:
+        n (int): number of nodes, numbered from 0
+        edges (iterable of tuple): links (u, v) between node numbers
+        size (int): positions are scaled into a square canvas of that width
+        iterations (int): moves in the refinement of each level, those of the coarsest level are 4 times more
+        seed (int): seed of the random generator
+
+    Returns:
+        np.array, float, shape (n, 2)
+    """
+    rnd = np.random.RandomState(seed)
+    if not n:
+        return np.zeros((0, 2))
+    edges = np.array([(u, v) if u < v else (v, u) for u, v in edges if u != v], dtype=np.int64).reshape(-1, 2)
+    edges = np.unique(edges, axis=0) if len(edges) else edges
+
+    # coarsen until few nodes are left or nodes can hardly be merged, e.g. many connected components
+    levels = [(n, edges, np.ones(n))]
+    parents = []
+    while levels[-1][0] > COARSEST:
+        m, e, mass = levels[-1]
+        parent, cm, ce, cmass = _coarsen(m, e, mass, rnd)
+        if cm > 0.9 * m:
+            break
+        parents.append(parent)
+        levels.append((cm, ce, cmass))
+
+    # natural length of links shrinks from level to level, as nodes are added in the area of the coarser graph
+    k = 1.
+    m, e, mass = levels[-1]
+    pos = rnd.uniform(0, np.sqrt(m) * k, (m, 2))
+    _refine(pos, e, mass, k, 4 * iterations, np.sqrt(m) * k / 4)
+    for (m, e, mass), parent in reversed(zip(levels[:-1], parents)):
+        k *= np.sqrt(4. / 7)
+        pos = pos[parent] + rnd.uniform(-k, k, (m, 2))
+        _refine(pos, e, mass, k, iterations, k)
+
+    # fit the canvas, keeping the aspect ratio
+    pos -= pos.min(axis=0)
+    extent = pos.max()
+    if extent > 0:
+        pos *= (size - 2 * MARGIN) / extent
+    return pos + MARGIN
+
+
+def add_layout(data, size=SIZE, iterations=50, seed=0):
+    """set the positions of the nodes of node-link data, as 'x' and 'y', in place
+
+    Args:
+        data (dict): node-link data, as produced by tracegraph.node_link_data_modify(), links refer to node 'id'
+        size (int), iterations (int), seed (int): see layout()
+    """
+    index = {nd['id']: i for i, nd in enumerate(data['nodes'])}
+    pos = layout(len(data['nodes']), ((index[l['source']], index[l['target']]) for l in data['links']),
+                 size, iterations, seed)
+    for nd, (x, y) in zip(data['nodes'], pos.tolist()):
+        nd['x'] = round(x, 1)
+        nd['y'] = round(y, 1)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S %z')
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--infile",
+                        help="topology file, binary if ending with %s, node-link .json otherwise" % tb.EXTENSION,
+                        action="store")
+    parser.add_argument("-o", "--outfile",
+                        help="topology file with node positions, binary if ending with %s, node-link .json otherwise; "
+                             "default to infile" % tb.EXTENSION,
+                        action="store")
+    parser.add_argument("-n", "--iterations",
+                        help="moves in the refinement of each level of the layout",
+                        type=int, default=50,
+                        action="store")
+    parser.add_argument("--seed",
+                        help="seed of the random generator",
+                        type=int, default=0,
+                        action="store")
+    args = parser.parse_args()
+
+    if not args.infile:
+        parser.print_help()
+        return
+    outfile = args.outfile if args.outfile else args.infile
+
+    if tb.is_binary(args.infile):
+        data = tb.load(args.infile).to_data()
+    else:
+        with open(args.infile, 'r') as fp:
+            data = json.load(fp)
+
+    t1 = time.time()
+    add_layout(data, iterations=args.iterations, seed=args.seed)
+    t2 = time.time()
+    logging.info("%d nodes laid out in %.2f sec" % (len(data['nodes']), t2 - t1))
+
+    if tb.is_binary(outfile):
+        tb.dump(data, outfile)
+    else:
+        with open(outfile, 'w') as fp:
+            json.dump(data, fp)
+    logging.info("%s saved with node positions to %s" % (args.infile, outfile))
+
+
+if __name__ == '__main__':
+    main()
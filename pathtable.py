@@ -0,0 +1,179 @@
+"""
+pathtable.py interns the AS paths measured by probes, so that each distinct path is cleaned and walked only once.
+
+Raw paths, as read from files, are looked up as they are; the first time one is seen, it is cleaned of the hops to be
+ignored, and the result is interned as a tuple of node ids.
+The paths measured by each probe are recorded as runs of consecutive measurements of the same path,
+[path id, first seen, last seen, count], in the order of time.
+
+The table can be saved as .json, with node names and probe IDs, e.g. as input to path change analysis:
+    {"paths": [[hop, ...]...], "runs": {probe ID: [[path id, first seen, last seen, count]...]}}
+"""
+import json
+from collections import defaultdict
+import interning as it
+import probeset as ps
+
+TABLE = 'path_table'  # graph attribute holding the PathTable of a worker
+
+
+class PathTable(object):
+    """distinct paths and the runs of paths measured by each probe
+
+    Attributes:
+        nodes (interning.Interner): names of the node ids in paths
+        probes (interning.Interner): IDs of the probe ids
+        paths (interning.Interner): distinct cleaned paths, tuples of node ids, indexed by path id
+        runs (dict): {probe id: [[path id, first seen, last seen, count]...]}, in the order of time
+    """
+
+    def __init__(self, nodes=None, probes=None, ignored=(), end=None):
+        """
+        Args:
+            nodes (interning.Interner): node names, e.g. those of a graph built on the same ids; a new one if None
+            probes (interning.Interner): probe IDs; a new one if None
+            ignored (iterable): hops removed from raw paths
+            end: if set, raw paths not traversing it are filtered out
+        """
+        self.nodes = it.Interner() if nodes is None else nodes
+        self.probes = it.Interner() if probes is None else probes
+        self.paths = it.Interner()
+        self.runs = defaultdict(list)
+        self.ignored = frozenset(ignored)
+        self.end = end
+        self._raw = dict()  # {raw path: path id, None if filtered out}
+
+    def __getstate__(self):
+        # the lookup of raw paths is only needed while reading files
+        state = self.__dict__.copy()
+        state['runs'] = dict(self.runs)
+        state['_raw'] = dict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.runs = defaultdict(list, self.runs)
+
+    def path_id(self, raw):
+        """the id of a raw path once cleaned, None if it is filtered out
+
+        Args:
+            raw (list): hops as read from file
+        """
+        key = tuple(raw)
+        try:
+            return self._raw[key]
+        except KeyError:
+            return self._clean(key)
+
+    def _clean(self, key):
+        """clean and intern a raw path seen for the first time"""
+        if self.end is not None and self.end not in key:
+            pid = None
+        else:
+            pid = self.paths.id(tuple(self.nodes.id(h) for h in key if h not in self.ignored))
+        self._raw[key] = pid
+        return pid
+
+    def record(self, probe, measured, first_only=False):
+        """record the paths measured by a probe
+
+        Args:
+            probe: probe ID
+            measured (iterable of tuple): (epoch, raw path) in the order of time, raw paths as read from file
+            first_only (bool): only record the first path not filtered out
+
+        Returns:
+            int, number of paths recorded
+        """
+        raw_ids = self._raw
+        runs = None
+        n = 0
+        for e, raw in measured:
+            key = tuple(raw)
+            pid = raw_ids[key] if key in raw_ids else self._clean(key)
+            if pid is None:
+                continue
+            if runs is None:
+                runs = self.runs[self.probes.id(probe)]
+            if runs and runs[-1][0] == pid:
+                run = runs[-1]
+                run[2] = e
+                run[3] += 1
+            else:
+                runs.append([pid, e, e, 1])
+            n += 1
+            if first_only:
+                break
+        return n
+
+    def path(self, pid):
+        """the path of an id, tuple of node ids"""
+        return self.paths.name(pid)
+
+    def probe_sets(self):
+        """the probes having measured each distinct path
+
+        Returns:
+            dict {path id: ps.ProbeSet}
+        """
+        res = defaultdict(ps.ProbeSet)
+        for pb, runs in self.runs.iteritems():
+            for r in runs:
+                res[r[0]].add(pb)
+        return res
+
+    def merge(self, other):
+        """add the paths and runs of another table, built on ids of its own
+
+        Runs of the same probe are sorted by first seen, and consecutive runs of the same path are joined.
+
+        Args:
+            other (PathTable)
+        """
+        node_map, probe_map = self.nodes.remap(other.nodes), self.probes.remap(other.probes)
+        path_map = [self.paths.id(tuple(node_map[h] for h in p)) for p in other.paths.names]
+        for pb, runs in other.runs.iteritems():
+            merged = self.runs[probe_map[pb]]
+            merged.extend([path_map[r[0]], r[1], r[2], r[3]] for r in runs)
+            merged.sort(key=lambda r: r[1])
+            joined = merged[:1]
+            for r in merged[1:]:
+                if r[0] == joined[-1][0]:
+                    joined[-1][2] = max(joined[-1][2], r[2])
+                    joined[-1][3] += r[3]
+                else:
+                    joined.append(r)
+            merged[:] = joined
+
+
+def dump(table, fn):
+    """save a path table to .json, with node names and probe IDs, see module doc
+
+    Args:
+        table (PathTable)
+        fn (string): path to the output file
+    """
+    data = dict(paths=[[table.nodes.name(h) for h in p] for p in table.paths.names],
+                runs={table.probes.name(pb): runs for pb, runs in table.runs.iteritems()})
+    with open(fn, 'w') as fp:
+        json.dump(data, fp)
+
+
+def load(fn):
+    """load a path table saved by dump()
+
+    Args:
+        fn (string): path to the path table file
+
+    Returns:
+        PathTable, nodes and probes are interned in the order of the file
+    """
+    with open(fn, 'r') as fp:
+        data = json.load(fp)
+    table = PathTable()
+    for p in data['paths']:
+        table.paths.id(tuple(table.nodes.id(h) for h in p))
+    for pb, runs in data['runs'].iteritems():
+        table.runs[table.probes.id(pb)] = runs
+    return table
@@ -0,0 +1,148 @@
+"""
+probeset.py provides the sets of interned probe ids attached to links and nodes, see interning.
+
+They are compressed Roaring bitmaps if pyroaring is installed, otherwise bitsets held in Python ints.
+Both offer the same subset of the set interface, plus intersection_cardinality() which counts common probes
+without building their intersection.
+"""
+import binascii
+
+try:
+    from pyroaring import BitMap, FrozenBitMap
+except ImportError:
+    BitMap = None
+
+
+def available():
+    """tell if pyroaring is installed, i.e. if ProbeSet is a Roaring bitmap"""
+    return BitMap is not None
+
+
+# offsets of the bits set in each byte value
+_BYTE_BITS = [tuple(i for i in xrange(8) if b >> i & 1) for b in xrange(256)]
+
+
+def _bits(values):
+    """the int whose bits are set at values, built in linear time out of a byte array"""
+    values = list(values)
+    if not values:
+        return 0
+    buf = bytearray((max(values) >> 3) + 1)
+    for v in values:
+        buf[v >> 3] |= 1 << (v & 7)
+    buf.reverse()
+    return int(binascii.hexlify(buf), 16)
+
+
+class IntBitSet(object):
+    """set of non-negative ints held as the bits of a Python int
+
+    Python ints being immutable, setting a bit copies the whole int; single additions are thus buffered,
+    and set in one go when the set is read.
+    """
+
+    __slots__ = ('_bits', '_pending')
+
+    def __init__(self, values=()):
+        """
+        Args:
+            values (iterable of int): initial members
+        """
+        self._bits = _bits(values)
+        self._pending = []
+
+    @property
+    def bits(self):
+        if self._pending:
+            self._bits |= _bits(self._pending)
+            self._pending = []
+        return self._bits
+
+    @classmethod
+    def _of(cls, bits):
+        s = cls()
+        s._bits = bits
+        return s
+
+    def __getstate__(self):
+        return self.bits
+
+    def __setstate__(self, bits):
+        self._bits = bits
+        self._pending = []
+
+    def add(self, value):
+        self._pending.append(value)
+
+    def update(self, *others):
+        for values in others:
+            if isinstance(values, IntBitSet):
+                self._bits |= values.bits
+            else:
+                self._pending.extend(values)
+
+    def __ior__(self, other):
+        self._bits |= other.bits
+        return self
+
+    def __or__(self, other):
+        return self._of(self.bits | other.bits)
+
+    def __and__(self, other):
+        return self._of(self.bits & other.bits)
+
+    def __isub__(self, other):
+        self._bits = self.bits & ~other.bits
+        return self
+
+    def __sub__(self, other):
+        return self._of(self.bits & ~other.bits)
+
+    def intersection_cardinality(self, other):
+        return bin(self.bits & other.bits).count('1')
+
+    def __len__(self):
+        return bin(self.bits).count('1')
+
+    def __nonzero__(self):
+        return self.bits != 0
+
+    def __contains__(self, value):
+        return (self.bits >> value) & 1 == 1
+
+    def __iter__(self):
+        """members in ascending order"""
+        bits = self.bits
+        if not bits:
+            return
+        # the int is converted to bytes once, shifting it word by word would copy it for each word
+        digits = '%x' % bits
+        buf = bytearray(binascii.unhexlify('0' * (len(digits) & 1) + digits))
+        buf.reverse()
+        for i, b in enumerate(buf):
+            if b:
+                base = i << 3
+                for offset in _BYTE_BITS[b]:
+                    yield base + offset
+
+    def __eq__(self, other):
+        return isinstance(other, IntBitSet) and self.bits == other.bits
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "IntBitSet(%r)" % list(self)
+
+    __hash__ = None  # mutable, see digest()
+
+
+ProbeSet = BitMap if BitMap is not None else IntBitSet
+
+
+def digest(s):
+    """hash of the members of a probe set, equal for sets with the same members"""
+    if isinstance(s, IntBitSet):
+        # hash of long folds its digits modulo 2**64 - 1, e.g. 1 << 64 and 1 collide, that of its hex digits doesn't
+        return hash('%x' % s.bits)
+    return hash(FrozenBitMap(s))
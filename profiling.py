@@ -0,0 +1,131 @@
+"""
+profiling.py records the cost of each phase of a run, see --profile of as_graph.py and congestion.py.
+
+For each phase, wall time, CPU time, peak RSS and the counts of items handled are recorded, and optionally the
+functions taking most time according to cProfile. They are saved as .json next to the output file
+(output file name + .profile.json):
+    {"script": ..., "argv": [...], "wall": sec, "cpu": sec, "peak_rss_mb": MB,
+     "phases": [{"name": ..., "wall": sec, "cpu": sec, "cpu_children": sec, "peak_rss_mb": MB,
+                 "peak_rss_children_mb": MB, "counts": {...}, "cprofile": [{"function": ..., "calls": int,
+                 "tottime": sec, "cumtime": sec}...]}...]}
+CPU time of worker processes is only accounted in cpu_children once they exit, i.e. when their pool is joined.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import cProfile
+import pstats
+
+SUFFIX = '.profile.json'
+TOP = 30  # number of functions reported per phase with cProfile
+
+
+def report_path(fn):
+    """the profile report going with an output file"""
+    return fn + SUFFIX
+
+
+def usage():
+    """(cpu time of this process, cpu time of its terminated children, peak RSS of both in MB)"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in KB on Linux
+    return (own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime,
+            own.ru_maxrss / 1024., children.ru_maxrss / 1024.)
+
+
+class Profiler(object):
+    """the phases of a run, one at a time
+
+    A disabled profiler records nothing, so that phases can be marked in the code whether profiling or not.
+
+    Attributes:
+        enabled (bool): if phases are recorded
+        cprofile (bool): if phases are as well run under cProfile
+        phases (list of dict): phases recorded so far, see module doc
+    """
+
+    def __init__(self, enabled=False, cprofile=False):
+        """
+        Args:
+            enabled (bool): record phases
+            cprofile (bool): as well run phases under cProfile, implies enabled
+        """
+        self.enabled = enabled or cprofile
+        self.cprofile = cprofile
+        self.phases = []
+        self._t0 = time.time()
+        self._current = None
+
+    def start(self, name):
+        """begin a phase, ending the current one if any
+
+        Args:
+            name (string): name of the phase
+        """
+        if not self.enabled:
+            return
+        if self._current is not None:
+            self.stop()
+        profile = None
+        if self.cprofile:
+            profile = cProfile.Profile()
+            profile.enable()
+        self._current = (name, time.time(), usage(), profile)
+
+    def stop(self, **counts):
+        """end the current phase
+
+        Args:
+            **counts: number of items handled in the phase, e.g. files=..., probes=...
+        """
+        if not self.enabled or self._current is None:
+            return
+        name, t1, (cpu1, children1, _, _), profile = self._current
+        if profile is not None:
+            profile.disable()
+        cpu2, children2, rss, rss_children = usage()
+        phase = dict(name=name, wall=round(time.time() - t1, 4), cpu=round(cpu2 - cpu1, 4),
+                     cpu_children=round(children2 - children1, 4), peak_rss_mb=round(rss, 1),
+                     peak_rss_children_mb=round(rss_children, 1), counts=counts)
+        if profile is not None:
+            phase['cprofile'] = top_functions(profile)
+        self.phases.append(phase)
+        self._current = None
+
+    def count(self, **counts):
+        """add counts to the last phase recorded, e.g. those only known later on"""
+        if self.enabled and self.phases:
+            self.phases[-1]['counts'].update(counts)
+
+    def dump(self, fn):
+        """save the phases recorded to .json, see module doc
+
+        Args:
+            fn (string): path to the report file
+        """
+        if not self.enabled:
+            return
+        self.stop()
+        cpu, children, rss, _ = usage()
+        report = dict(script=os.path.basename(sys.argv[0]), argv=sys.argv[1:], wall=round(time.time() - self._t0, 4),
+                      cpu=round(cpu + children, 4), peak_rss_mb=round(rss, 1), phases=self.phases)
+        with open(fn, 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+
+def top_functions(profile, n=TOP):
+    """the n functions of a cProfile.Profile taking most cumulative time
+
+    Returns:
+        list of dict, with the 'function' as file:line(name), the number of 'calls', 'tottime' and 'cumtime' in sec
+    """
+    stats = pstats.Stats(profile).stats
+    res = []
+    for (fn, line, func), (_, calls, tottime, cumtime, _) in stats.iteritems():
+        res.append(dict(function="%s:%d(%s)" % (os.path.basename(fn), line, func), calls=calls,
+                        tottime=round(tottime, 4), cumtime=round(cumtime, 4)))
+    res.sort(key=lambda f: f['cumtime'], reverse=True)
+    return res[:n]
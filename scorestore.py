@@ -0,0 +1,285 @@
+"""
+scorestore.py holds the change scores and location inferences of a topology over a time window.
+
+Each of them is a 2-D NumPy array, one row per element (links first, then nodes), one column per time bin.
+Rows are attached to the graph as the "score" and "inference" attributes of each link and node,
+hence are indexed by bin offset within the window, see ScoreStore.epoch() for the conversion.
+
+A store can be saved to an uncompressed .npz file, links and nodes being those of the topology it was computed on,
+e.g. to be queried bin by bin by server.py without parsing the output of congestion.py.
+
+In the columnar layout of the output of congestion.py, the bins of the window are an axis shared by all the elements,
+{"first": sec since epoch, "bin_size": sec, "count": int}, and the series of each element are given by bin offset:
+    "score": {"observed": [run without records, run with records, ...], "bin": [...], "value": [...]}
+    "inference": {"bin": [...], "value": [...]}
+observed holds the lengths of alternate runs of bins, the last run without records being omitted;
+score bins are only those with records and a non-zero score, inference bins those inferred at least LIKELY.
+Bin offsets are delta encoded, i.e. each as the difference with the previous one. Scores are rounded,
+or quantized to integers, see encode_columns().
+"""
+import numpy as np
+import timewindow as tw
+from tracegraph import UNKNOWN
+
+SUFFIX = '.scores.npz'
+
+
+class ScoreStore(object):
+    """binned change scores and inference results of all the links and nodes of a topology
+
+    Attributes:
+        links (list of tuple): links of topology, their rows come first
+        nodes (list): nodes of topology, their rows follow those of links
+        link_row (dict): {link: row}
+        node_row (dict): {node: row}
+        first (int): sec since epoch, beginning of the first bin
+        bin_size (int): the size of bin in seconds
+        score (np.array): float, normalized change sum per element per bin
+        observed (np.array): bool, if any probe on the element has records in the bin
+        inference (np.array): int8, SURE, LIKELY, NEG, or UNKNOWN when not yet inferred
+    """
+
+    def __init__(self, links, nodes, begin, stop, bin_size):
+        """
+        Args:
+            links (list of tuple): links of topology
+            nodes (list): nodes of topology
+            begin (int): sec since epoch, beginning of the time window
+            stop (int): sec since epoch, end of the time window
+            bin_size (int): the size of bin in seconds
+        """
+        self.links = list(links)
+        self.nodes = list(nodes)
+        self.link_row = {l: i for i, l in enumerate(self.links)}
+        self.node_row = {n: len(self.links) + i for i, n in enumerate(self.nodes)}
+        self.first = tw.bin_floor(begin, bin_size)
+        self.bin_size = bin_size
+        shape = (len(self.links) + len(self.nodes), len(tw.bin_range(begin, stop, bin_size)))
+        self.score = np.zeros(shape)
+        self.observed = np.zeros(shape, dtype=bool)
+        self.inference = np.full(shape, UNKNOWN, dtype=np.int8)
+
+    @property
+    def bin_count(self):
+        return self.score.shape[1]
+
+    @property
+    def link_rows(self):
+        return slice(0, len(self.links))
+
+    @property
+    def node_rows(self):
+        return slice(len(self.links), len(self.links) + len(self.nodes))
+
+    def element(self, row):
+        """the link or node of a row"""
+        return self.links[row] if row < len(self.links) else self.nodes[row - len(self.links)]
+
+    def bins(self):
+        """offsets of all the bins in the window"""
+        return xrange(self.bin_count)
+
+    def bin_index(self, t):
+        """offset of the bin sec since epoch t falls in"""
+        return (t - self.first) // self.bin_size
+
+    def epoch(self, k):
+        """sec since epoch of the beginning of bin k"""
+        return self.first + int(k) * self.bin_size
+
+    def add_sums(self, row, sums):
+        """add binned change sums to an element
+
+        Args:
+            row (int): row of the element
+            sums (dict): {sec since epoch of bin beginning: change sum}
+        """
+        for t, v in sums.iteritems():
+            k = self.bin_index(t)
+            self.score[row, k] += v
+            self.observed[row, k] = True
+
+    def normalize(self, pb_count):
+        """divide the change sum of each element by its probe count; elements without probe are left untouched
+
+        Args:
+            pb_count (np.array): probe count per element, or per element per bin if it changes over time
+        """
+        pb_count = np.asarray(pb_count, dtype=float)
+        pb_count = np.where(pb_count > 0, pb_count, 1)
+        self.score /= pb_count if pb_count.ndim == 2 else pb_count[:, np.newaxis]
+
+    def active(self, threshold, rows):
+        """for each bin, the rows whose score is above threshold
+
+        Args:
+            threshold (float): minimum score, exclusive
+            rows (slice): rows to be considered, e.g. link_rows or node_rows
+
+        Returns:
+            list of np.array, one per bin, rows above threshold in ascending order
+        """
+        rows = np.arange(self.score.shape[0])[rows]
+        bins, idx = (self.score[rows] > threshold).T.nonzero()
+        bounds = np.searchsorted(bins, np.arange(self.bin_count + 1))
+        return [rows[idx[bounds[k]:bounds[k + 1]]] for k in self.bins()]
+
+    def attach(self, g):
+        """set the rows of score and inference as attributes of each link and node of g
+
+        Args:
+            g (nx.Graph): the topology the store is built for
+        """
+        for l, i in self.link_row.iteritems():
+            g[l[0]][l[1]]['score'] = self.score[i]
+            g[l[0]][l[1]]['inference'] = self.inference[i]
+        for n, i in self.node_row.iteritems():
+            g.node[n]['score'] = self.score[i]
+            g.node[n]['inference'] = self.inference[i]
+
+    def score_series(self, row):
+        """[(sec since epoch, score)...] of the bins with records of an element"""
+        return [(self.epoch(k), float(self.score[row, k])) for k in np.flatnonzero(self.observed[row])]
+
+    def inference_series(self, row, minimum):
+        """[(sec since epoch, inference)...] of the bins where the element is inferred at least minimum"""
+        return [(self.epoch(k), int(self.inference[row, k])) for k in np.flatnonzero(self.inference[row] >= minimum)]
+
+
+class RingStore(ScoreStore):
+    """a ScoreStore over an unbounded time line, holding only its latest bins, whose columns are recycled
+
+    Bin t of the time line goes to column (t // bin_size) % bin_count, which must have been cleared beforehand,
+    see clear(); the epoch of the bin held by each column is recorded.
+
+    Attributes:
+        slot_epoch (list): sec since epoch of the bin held by each column, None if the column is free
+    """
+
+    def __init__(self, links, nodes, bin_count, bin_size):
+        """
+        Args:
+            links (list of tuple): links of topology
+            nodes (list): nodes of topology
+            bin_count (int): number of bins held at the same time
+            bin_size (int): the size of bin in seconds
+        """
+        super(RingStore, self).__init__(links, nodes, 0, (bin_count - 1) * bin_size, bin_size)
+        self.slot_epoch = [None] * bin_count
+
+    def bin_index(self, t):
+        """column of the bin sec since epoch t falls in"""
+        return (t // self.bin_size) % self.bin_count
+
+    def epoch(self, k):
+        """sec since epoch of the beginning of the bin held by column k"""
+        return self.slot_epoch[k]
+
+    def open(self, t):
+        """assign the bin sec since epoch t falls in to its column, which must be free; return the column"""
+        k = self.bin_index(t)
+        self.slot_epoch[k] = tw.bin_floor(t, self.bin_size)
+        return k
+
+    def clear(self, k):
+        """free column k, resetting its scores and inferences in place, so that the rows attached to graph stay valid"""
+        self.score[:, k] = 0
+        self.observed[:, k] = False
+        self.inference[:, k] = UNKNOWN
+        self.slot_epoch[k] = None
+
+
+def store_path(fn):
+    """the store file going with an output file of congestion.py"""
+    return fn + SUFFIX
+
+
+def dump(store, fn):
+    """save a store to an uncompressed .npz file
+
+    Args:
+        store (ScoreStore): links and nodes are expected to be ints, e.g. node ids of node-link data
+        fn (string): path to the output file
+    """
+    with open(fn, 'wb') as fp:
+        np.savez(fp, links=np.array(store.links, dtype=np.int64).reshape(-1, 2),
+                 nodes=np.array(store.nodes, dtype=np.int64), first=store.first, bin_size=store.bin_size,
+                 score=store.score, observed=store.observed, inference=store.inference)
+
+
+def load(fn):
+    """load a store saved by dump()
+
+    Args:
+        fn (string): path to the store file
+
+    Returns:
+        ScoreStore, links are tuples of ints
+    """
+    data = np.load(fn)
+    first, bin_size = int(data['first']), int(data['bin_size'])
+    score = data['score']
+    store = ScoreStore([tuple(l) for l in data['links'].tolist()], data['nodes'].tolist(),
+                       first, first + (score.shape[1] - 1) * bin_size, bin_size)
+    store.score, store.observed, store.inference = score, data['observed'], data['inference']
+    return store
+
+
+def delta_encode(ks):
+    """[k0, k1 - k0, k2 - k1, ...] of increasing ints ks"""
+    return np.diff(np.asarray(ks, dtype=np.int64), prepend=0).tolist()
+
+
+def delta_decode(deltas):
+    """the ints delta encoded by delta_encode(), as np.array"""
+    return np.cumsum(np.asarray(deltas, dtype=np.int64))
+
+
+def encode_columns(store, row, minimum, digits=3, levels=None):
+    """the score and inference series of an element in the columnar layout, see module doc
+
+    Args:
+        store (ScoreStore)
+        row (int): row of the element
+        minimum (int): only the inferences at least that are kept, e.g. LIKELY
+        digits (int): scores are rounded to that many decimal digits
+        levels (int): scores are instead quantized to integers, value * levels rounded, if set
+
+    Returns:
+        tuple of dict (score, inference)
+    """
+    observed = store.observed[row]
+    # bins where records start or stop, the first run being without records
+    bounds = np.flatnonzero(np.diff(observed.astype(np.int8), prepend=0))
+    runs = np.diff(np.concatenate(([0], bounds, [store.bin_count]))).tolist()
+    if len(bounds) % 2 == 0:
+        runs.pop()
+    ks = np.flatnonzero(observed & (store.score[row] != 0))
+    values = store.score[row, ks]
+    values = np.rint(values * levels).astype(np.int64).tolist() if levels else \
+        [round(v, digits) for v in values.tolist()]
+    inferred = np.flatnonzero(store.inference[row] >= minimum)
+    return (dict(observed=runs, bin=delta_encode(ks), value=values),
+            dict(bin=delta_encode(inferred), value=store.inference[row, inferred].tolist()))
+
+
+def decode_columns(score, inference, count, scale=None):
+    """the series of an element in the columnar layout as arrays over the bins of the window
+
+    Args:
+        score (dict), inference (dict): series of the element, see encode_columns()
+        count (int): number of bins in the window
+        scale (int): the levels scores are quantized to, if they are
+
+    Returns:
+        tuple of np.array (score, observed, inference), typed as the arrays of ScoreStore
+    """
+    observed = np.zeros(count, dtype=bool)
+    bounds = np.cumsum(score['observed'], dtype=np.int64)
+    for start, stop in zip(bounds[0::2], bounds[1::2]):
+        observed[start:stop] = True
+    values = np.zeros(count)
+    values[delta_decode(score['bin'])] = np.asarray(score['value'], dtype=float) / (scale if scale else 1)
+    inferred = np.full(count, UNKNOWN, dtype=np.int8)
+    inferred[delta_decode(inference['bin'])] = inference['value']
+    return values, observed, inferred
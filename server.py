@@ -0,0 +1,286 @@
+"""
+server.py serves graph.html along with the output of congestion.py, so that the browser loads the topology once and
+the change scores and inferences one bin at a time, whatever the length of the time window.
+
+Scores and inferences are indexed bin by bin in memory, either from the store saved by congestion.py --store
+(output file name + .scores.npz) if present, or from the series embedded in the output file.
+
+    python server.py -g congestion.json -p 8000
+then open http://localhost:8000/graph.html
+
+API:
+    GET /api/topology
+        node-link data of the topology without score nor inference series;
+        each link and node has the 'row' of its values in the responses below
+    GET /api/bin?epoch=T
+        {"epoch": beginning of the bin T falls in, "score": [value per row], "inference": [value per row]}
+        score is null where the element has no record in the bin, inference where it is below LIKELY
+    GET /api/range?begin=T0&end=T1[&row=r,...]
+        {"epoch": [beginning of each bin], "score": [[value per row] per bin], "inference": [...]},
+        only for the rows given if any, over at most MAX_BINS bins
+Other paths are served as static files from the directory of this script.
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import urlparse
+import BaseHTTPServer
+import SimpleHTTPServer
+import SocketServer
+import numpy as np
+import timewindow as tw
+import scorestore as ss
+from tracegraph import LIKELY, UNKNOWN
+
+API = '/api/'
+MAX_BINS = 1008  # a week of 600 sec bins
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class BinIndex(object):
+    """scores and inferences of the links and nodes of a topology, laid out bin by bin
+
+    Attributes:
+        first (int): sec since epoch, beginning of the first bin
+        bin_size (int): the size of bin in seconds
+        score (np.array): float, shape (bin #, row #), NaN where the element has no record
+        inference (np.array): int8, shape (bin #, row #)
+    """
+
+    def __init__(self, first, bin_size, score, observed, inference):
+        """
+        Args:
+            first (int): sec since epoch, beginning of the first bin
+            bin_size (int): the size of bin in seconds
+            score (np.array): float, shape (row #, bin #), as in scorestore.ScoreStore
+            observed (np.array): bool, of the same shape
+            inference (np.array): int8, of the same shape
+        """
+        self.first = first
+        self.bin_size = bin_size
+        self.score = np.ascontiguousarray(np.where(observed, score, np.nan).T)
+        self.inference = np.ascontiguousarray(inference.T)
+
+    @property
+    def bin_count(self):
+        return self.score.shape[0]
+
+    def bin_index(self, t):
+        """offset of the bin sec since epoch t falls in, IndexError if out of window"""
+        k = (t - self.first) // self.bin_size
+        if not 0 <= k < self.bin_count:
+            raise IndexError("%d is out of the time window." % t)
+        return k
+
+    def values(self, k, rows=None):
+        """scores and inferences of bin k, see module doc
+
+        Args:
+            k (int): bin offset
+            rows (list of int): all the rows if None
+
+        Returns:
+            tuple of list (scores, inferences)
+        """
+        score, inference = self.score[k], self.inference[k]
+        if rows is not None:
+            score, inference = score[rows], inference[rows]
+        return ([None if np.isnan(v) else round(v, 3) for v in score.tolist()],
+                [v if v >= LIKELY else None for v in inference.tolist()])
+
+
+def index_store(data, store):
+    """index a store saved by congestion.py --store, see scorestore.dump()
+
+    Args:
+        data (dict): node-link data output by congestion.py, whose nodes have the ids of the store
+        store (scorestore.ScoreStore)
+
+    Returns:
+        tuple (BinIndex, rows of data['links'], rows of data['nodes']); ValueError is raised if they do not match
+    """
+    try:
+        link_rows = [store.link_row[(l['source'], l['target'])] if (l['source'], l['target']) in store.link_row
+                     else store.link_row[(l['target'], l['source'])] for l in data['links']]
+        node_rows = [store.node_row[n['id']] for n in data['nodes']]
+    except KeyError as e:
+        raise ValueError("Element %r of topology is not in the store." % (e.args[0],))
+    return BinIndex(store.first, store.bin_size, store.score, store.observed, store.inference), link_rows, node_rows
+
+
+def index_series(data):
+    """index the score and inference series embedded in the output of congestion.py, in either layout
+
+    Args:
+        data (dict): node-link data output by congestion.py
+
+    Returns:
+        tuple (BinIndex, rows of data['links'], rows of data['nodes'])
+    """
+    if 'series' in data:
+        return index_columns(data)
+    graph = data['graph']
+    bin_size = graph['cpt_bin_size']
+    bins = tw.bin_range(graph['congestion_begin'], graph['congestion_end'], bin_size)
+    first = bins[0] if len(bins) else 0
+    shape = (len(data['links']) + len(data['nodes']), len(bins))
+    score, observed = np.zeros(shape), np.zeros(shape, dtype=bool)
+    inference = np.full(shape, UNKNOWN, dtype=np.int8)
+
+    def fill(row, scores, inferences):
+        for t, v in scores:
+            k = (int(t) - first) // bin_size
+            score[row, k] = v
+            observed[row, k] = True
+        for d in inferences:
+            inference[row, (d['epoch'] - first) // bin_size] = d['value']
+
+    for row, l in enumerate(data['links']):
+        fill(row, [(d['epoch'], d['value']) for d in l.get('score', [])], l.get('inference', []))
+    for i, n in enumerate(data['nodes']):
+        # node scores are {epoch: value}, see congestion.result_data()
+        fill(len(data['links']) + i, n.get('score', dict()).iteritems(), n.get('inference', []))
+    return (BinIndex(first, bin_size, score, observed, inference), range(len(data['links'])),
+            range(len(data['links']), shape[0]))
+
+
+def index_columns(data):
+    """index the series of the output of congestion.py in the columnar layout, see scorestore module doc"""
+    series = data['series']
+    elements = data['links'] + data['nodes']
+    shape = (len(elements), series['count'])
+    score, observed = np.zeros(shape), np.zeros(shape, dtype=bool)
+    inference = np.full(shape, UNKNOWN, dtype=np.int8)
+    for row, e in enumerate(elements):
+        score[row], observed[row], inference[row] = ss.decode_columns(e['score'], e['inference'], series['count'],
+                                                                      series['scale'])
+    return (BinIndex(series['first'], series['bin_size'], score, observed, inference), range(len(data['links'])),
+            range(len(data['links']), shape[0]))
+
+
+def topology_data(data, link_rows, node_rows):
+    """node-link data without score nor inference series, each link and node having the row of its values"""
+    res = {k: v for k, v in data.iteritems() if k not in ('links', 'nodes', 'series')}
+    res['links'] = [dict({k: v for k, v in l.iteritems() if k not in ('score', 'inference')}, row=r)
+                    for l, r in zip(data['links'], link_rows)]
+    res['nodes'] = [dict({k: v for k, v in n.iteritems() if k not in ('score', 'inference')}, row=r)
+                    for n, r in zip(data['nodes'], node_rows)]
+    return res
+
+
+class Handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """answers API queries, see module doc, and serves the other paths as static files from ROOT"""
+
+    topology = None  # serialized topology, see topology_data()
+    index = None  # BinIndex
+
+    def translate_path(self, path):
+        path = SimpleHTTPServer.SimpleHTTPRequestHandler.translate_path(self, path)
+        return os.path.join(ROOT, os.path.relpath(path, os.getcwd()))
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        if not url.path.startswith(API):
+            return SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+        query = urlparse.parse_qs(url.query)
+        try:
+            body = self.answer(url.path[len(API):], query)
+        except IndexError as e:
+            return self.send_error(404, str(e))
+        except (KeyError, ValueError) as e:
+            return self.send_error(400, "Invalid query: %s" % e)
+        if body is None:
+            return self.send_error(404, "Unknown API %s" % url.path)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def answer(self, api, query):
+        """the JSON body answering a query, None if api is unknown"""
+        index = self.index
+        if api == 'topology':
+            return self.topology
+        if api == 'bin':
+            k = index.bin_index(int(query['epoch'][0]))
+            score, inference = index.values(k)
+            return json.dumps(dict(epoch=index.first + k * index.bin_size, score=score, inference=inference))
+        if api == 'range':
+            b0 = index.bin_index(max(int(query['begin'][0]), index.first))
+            b1 = index.bin_index(min(int(query['end'][0]), index.first + index.bin_count * index.bin_size - 1))
+            if b1 - b0 + 1 > MAX_BINS:
+                raise ValueError("more than %d bins" % MAX_BINS)
+            rows = [int(r) for v in query.get('row', []) for r in v.split(',')] or None
+            if rows is not None and not all(0 <= r < index.score.shape[1] for r in rows):
+                raise IndexError("Row out of topology.")
+            values = [index.values(k, rows) for k in xrange(b0, b1 + 1)]
+            return json.dumps(dict(epoch=[index.first + k * index.bin_size for k in xrange(b0, b1 + 1)],
+                                   score=[s for s, _ in values], inference=[i for _, i in values]))
+        return None
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S %z')
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-g", "--graph",
+                        help="output .json file of congestion.py",
+                        action="store")
+    parser.add_argument("-s", "--store",
+                        help="store saved by congestion.py --store, default to graph file name + %s if present" %
+                             ss.SUFFIX,
+                        action="store")
+    parser.add_argument("-p", "--port",
+                        help="port listened to, default to 8000",
+                        type=int, default=8000,
+                        action="store")
+    parser.add_argument("--host",
+                        help="address listened to, default to localhost only",
+                        default='localhost',
+                        action="store")
+    args = parser.parse_args()
+
+    if not args.graph:
+        parser.print_help()
+        return
+
+    t1 = time.time()
+    try:
+        with open(args.graph, 'r') as fp:
+            data = json.load(fp)
+        store_fn = args.store if args.store else ss.store_path(args.graph)
+        if os.path.exists(store_fn):
+            index, link_rows, node_rows = index_store(data, ss.load(store_fn))
+            source = store_fn
+        elif args.store:
+            raise IOError("%s doesn't exist." % store_fn)
+        else:
+            index, link_rows, node_rows = index_series(data)
+            source = args.graph
+    except (IOError, ValueError, KeyError) as e:
+        logging.critical(e)
+        return
+    Handler.topology = json.dumps(topology_data(data, link_rows, node_rows))
+    Handler.index = index
+    t2 = time.time()
+    logging.info("%d bins of %d links and %d nodes indexed from %s in %.2f sec" %
+                 (index.bin_count, len(link_rows), len(node_rows), source, t2 - t1))
+
+    server = Server((args.host, args.port), Handler)
+    logging.info("Serving on http://%s:%d/graph.html" % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == '__main__':
+    main()
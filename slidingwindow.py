@@ -0,0 +1,423 @@
+"""
+slidingwindow.py locates changes continuously, as the records of change detection arrive.
+
+Records are binned into the few latest bins of a RingStore. Records may arrive out of order, but not later than
+a given number of bins after the newest one seen, otherwise they are dropped.
+Once a bin closes, i.e. a record is seen that many bins after it, its scores are normalized,
+node and link inference are performed on it alone, the results are emitted, and its column is recycled.
+Records of a batch are summed per bin before being added to the bins held, see SlidingWindow.add_records().
+Memory usage is thus bounded by the size of topology and the number of bins held or spanned by a batch,
+whatever the duration of the stream and the number of records.
+
+It can be used as script; results are written as newline delimited JSON, one line per closed bin.
+Records are read either as newline delimited JSON from stdin, each line being an object
+{probe id: {"epoch": [...], method: [...]}} as in change detection files:
+    cat changes.ndjson | python slidingwindow.py -g graph.json
+or from the change detection files appearing in a directory, each handled once complete:
+    python slidingwindow.py -g graph.json -d changes/ -s cpt.json -o inference.ndjson
+Change detection files are written per probe group over the same time span, the files written one after the other
+are thus binned together, one group of files spanning the same time range at a time, see SlidingWindow.feed_files().
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import numpy as np
+import tracegraph as tg
+import scorestore as ss
+import jsonstream as js
+import timewindow as tw
+import timetools as tt
+from congestion import BIN, CH_MTD, LINK_THRESHOLD, NODE_THRESHOLD, load_topology
+
+MAX_HOLD = 10  # files ready are held at most that many times the settle time, see tail_directory()
+
+
+class SlidingWindow(object):
+    """bins change detection records as they arrive, and infers change locations of each bin once closed
+
+    Attributes:
+        topo (nx.Graph): the topology, as returned by congestion.load_topology()
+        store (ss.RingStore): scores and inferences of the bins held, attached to topo
+        lateness (int): number of bins a record can arrive after the newest bin seen
+        newest (int): sec since epoch, beginning of the newest bin seen, None before any record
+        dropped (int): number of records arrived too late
+    """
+
+    def __init__(self, topo, probes, pb2links, pb2nodes, branches=None, lateness=1, method=CH_MTD, bin_size=BIN,
+                 link_threshold=LINK_THRESHOLD, node_threshold=NODE_THRESHOLD):
+        """
+        Args:
+            topo, probes, pb2links, pb2nodes, branches: the topology and its probe mappings, see congestion.load_topology()
+            lateness (int): number of bins a record can arrive after the newest bin seen
+            method (string): field in records to be extracted as the result of change detection
+            bin_size (int): the size of bin in seconds
+            link_threshold (float): parameter for link inference
+            node_threshold (float): parameter for node inference
+        """
+        self.topo = topo
+        self.probes = probes
+        self.branches = dict() if branches is None else branches
+        self.lateness = lateness
+        self.method = method
+        self.link_threshold = link_threshold
+        self.node_threshold = node_threshold
+        self.store = ss.RingStore(topo.edges(), topo.nodes(), lateness + 1, bin_size)
+        self.store.attach(topo)
+        self.newest = None
+        self.dropped = 0
+
+        # rows of the elements traversed by each probe
+        self.rows = dict()
+        for pb in set(pb2links) | set(pb2nodes):
+            self.rows[pb] = np.array([self.store.link_row[l] for l in pb2links.get(pb, [])] +
+                                     [self.store.node_row[n] for n in pb2nodes.get(pb, [])], dtype=np.int64)
+        # scores are normalized by the probe count of each element; elements without probe are left untouched
+        pb_count = np.array([len(topo[l[0]][l[1]]['probe']) for l in self.store.links] +
+                            [len(topo.node[n].get('probe', [])) for n in self.store.nodes], dtype=float)
+        self.norm = np.where(pb_count > 0, pb_count, 1)
+
+    def feed(self, items):
+        """bin a batch of records, in the order of time; records late for the bins already closed are dropped
+
+        Args:
+            items (iterable of tuple): (probe id, {"epoch": [...], method: [...]}) as read from change detection files
+
+        Returns:
+            list of dict, the results of the bins closed, see close()
+        """
+        sums = dict()
+        self.add_records(items, sums)
+        return self.feed_sums(sums)
+
+    def feed_files(self, files, stream=False):
+        """bin the records of change detection files, one group of files spanning overlapping time ranges at a time
+
+        Files are read twice: first for the time range they span, then for their records, summed per bin over the
+        files of a group before being fed; only the sums of the bins spanned by one group are thus held at a time.
+
+        Args:
+            files (list of string): paths to change detection files; malformed files are logged and skipped
+            stream (bool): read files one probe at a time instead of loading them as a whole
+
+        Returns:
+            list of dict, the results of the bins closed, see close()
+        """
+        spans = []
+        for fn in files:
+            try:
+                with open(fn, 'r') as fp:
+                    span = time_span(js.load_items(fp, stream))
+            except (IOError, ValueError) as e:
+                # malformed content, e.g. a truncated file, may only be met halfway when streaming; the file is skipped
+                logging.error("%s skipped: %s" % (fn, e))
+                continue
+            if span is not None:
+                spans.append(span + (fn,))
+
+        res = []
+        for group in overlapping(spans):
+            sums = dict()
+            for fn in group:
+                try:
+                    with open(fn, 'r') as fp:
+                        self.add_records(js.load_items(fp, stream), sums)
+                except (IOError, ValueError) as e:
+                    logging.error("%s skipped: %s" % (fn, e))
+            logging.info("%d records of %d files binned in %d bins" %
+                         (sum(c for _, _, c in sums.itervalues()), len(group), len(sums)))
+            res.extend(self.feed_sums(sums))
+        return res
+
+    def add_records(self, items, sums):
+        """add records to the sums of the bins they fall in
+
+        Args:
+            items (iterable of tuple): (probe id, {"epoch": [...], method: [...]}) as read from change detection files
+            sums (dict): {bin: [score column, observed column, record count]}, columns along the rows of store,
+                updated in place
+        """
+        size = self.store.bin_size
+        height = self.store.score.shape[0]
+        for pb, rec in items:
+            pb = self.probes.get(pb)
+            if pb not in self.rows or not rec:
+                continue
+            r = self.rows[pb]
+            for t, v in zip(rec.get("epoch", []), rec.get(self.method, [])):
+                b = tw.bin_floor(t, size)
+                s = sums.get(b)
+                if s is None:
+                    s = sums[b] = [np.zeros(height), np.zeros(height, dtype=bool), 0]
+                s[0][r] += v
+                s[1][r] = True
+                s[2] += 1
+
+    def feed_sums(self, sums):
+        """add the sums of bins to the bins held, in the order of time; the sums of bins already closed are dropped
+
+        Args:
+            sums (dict): {bin: [score column, observed column, record count]}, see add_records()
+
+        Returns:
+            list of dict, the results of the bins closed, see close()
+        """
+        res = []
+        store = self.store
+        dropped = 0
+        for b in sorted(sums):
+            score, observed, count = sums[b]
+            if self.newest is None or b > self.newest:
+                self.newest = b
+                res.extend(self.close_before(b - self.lateness * store.bin_size))
+            if b < self.newest - self.lateness * store.bin_size:
+                dropped += count
+                continue
+            k = store.bin_index(b)
+            if store.slot_epoch[k] is None:
+                store.open(b)
+            store.score[:, k] += score
+            store.observed[:, k] |= observed
+        if dropped:
+            self.dropped += dropped
+            logging.warning("%d late records dropped, of bins before %s" %
+                            (dropped, tt.epoch_to_string(self.newest - self.lateness * store.bin_size)))
+        return res
+
+    def close_before(self, t):
+        """close, in the order of time, all the bins held that begin before t
+
+        Returns:
+            list of dict, see close()
+        """
+        held = sorted((e, k) for k, e in enumerate(self.store.slot_epoch) if e is not None and e < t)
+        return [self.close(k) for _, k in held]
+
+    def flush(self):
+        """close all the bins held, e.g. at the end of stream"""
+        return self.close_before(float('inf'))
+
+    def close(self, k):
+        """normalize the scores of a bin, infer its change locations, then free its column
+
+        Args:
+            k (int): column of the bin
+
+        Returns:
+            dict {"epoch": beginning of the bin, "links": [...], "nodes": [...]}, only the links and nodes inferred
+            at least LIKELY are listed, along with their score and inference
+        """
+        t1 = time.time()
+        store, topo = self.store, self.topo
+        store.score[:, k] /= self.norm
+        rows = np.arange(store.score.shape[0])
+        nodes = rows[store.node_rows]
+        links = rows[store.link_rows]
+        active_nodes = {k: nodes[store.score[nodes, k] > self.node_threshold]}
+        active_links = {k: links[store.score[links, k] > self.link_threshold]}
+        tg.change_inference_node(topo, self.node_threshold, store, [k], active_nodes)
+        tg.change_inference_link(topo, self.link_threshold, store, [k], self.branches, active_links)
+
+        res = dict(epoch=store.epoch(k), links=[], nodes=[])
+        for row in np.flatnonzero(store.inference[:, k] >= tg.LIKELY):
+            e = store.element(row)
+            entry = dict(score=round(float(store.score[row, k]), 3), inference=int(store.inference[row, k]))
+            if row < len(store.links):
+                entry.update(src_name=topo.node[e[0]].get('name', e[0]), tgt_name=topo.node[e[1]].get('name', e[1]))
+                res['links'].append(entry)
+            else:
+                entry.update(name=topo.node[e].get('name', e))
+                res['nodes'].append(entry)
+        store.clear(k)
+        t2 = time.time()
+        logging.info("Bin %s closed in %.2f sec, %d links and %d nodes inferred, %d late records dropped so far" %
+                     (tt.epoch_to_string(res['epoch']), t2 - t1, len(res['links']), len(res['nodes']), self.dropped))
+        return res
+
+
+def time_span(items):
+    """the first and last epoch of records, None if there is none
+
+    Args:
+        items (iterable of tuple): (probe id, {"epoch": [...], method: [...]}), the epochs of each record being sorted
+
+    Returns:
+        tuple (first, last) of sec since epoch
+    """
+    first, last = None, None
+    for _, rec in items:
+        t = rec.get("epoch") if rec else None
+        if t:
+            first = t[0] if first is None else min(first, t[0])
+            last = t[-1] if last is None else max(last, t[-1])
+    return None if first is None else (first, last)
+
+
+def overlapping(spans):
+    """group the files whose time ranges overlap, in the order of time
+
+    Args:
+        spans (list of tuple): (first, last, path) per file, see time_span()
+
+    Returns:
+        list of list of path
+    """
+    groups, last = [], None
+    for first, end, fn in sorted(spans):
+        if not groups or first > last:
+            groups.append([])
+            last = end
+        groups[-1].append(fn)
+        last = max(last, end)
+    return groups
+
+
+def read_ndjson(fp):
+    """yield batches of records from newline delimited JSON, one per line
+
+    Args:
+        fp (file): each line an object {probe id: {"epoch": [...], method: [...]}}; malformed lines are logged and skipped
+
+    Returns:
+        generator of list of (probe id, record)
+    """
+    for line in iter(fp.readline, ''):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line).items()
+        except (ValueError, AttributeError) as e:
+            logging.error("Malformed line skipped: %s" % e)
+
+
+def tail_directory(directory, suffix, interval=10, settle=30):
+    """yield the change detection files appearing in a directory, those complete at the same time together
+
+    A file is ready once its size and modification time remain the same during interval, i.e. it is complete.
+    Files already there when starting are handled as well.
+    Files are written per probe group over the same time span, a record of one of them is thus only late with
+    respect to those of the same group. Files ready are held until no file has appeared or changed for settle sec,
+    MAX_HOLD times that at most, then yielded together, see SlidingWindow.feed_files().
+
+    Args:
+        directory (string): directory to watch
+        suffix (string): suffix of files to be considered
+        interval (float): sec between two scans of directory
+        settle (float): sec without any file appearing or changing before the files ready are yielded
+
+    Returns:
+        generator of list of path, in the order of modification time, never ending
+    """
+    seen = dict()  # {path: (size, mtime)} when last scanned, None once handled
+    last_change = first_ready = None  # time of the last scan with a file new or changed, of the first with files ready
+    while True:
+        now = time.time()
+        ready, pending = [], 0
+        for f in os.listdir(directory):
+            fn = os.path.join(directory, f)
+            if not f.endswith(suffix) or f.startswith('~') or seen.get(fn, 0) is None:
+                continue
+            try:
+                st = os.stat(fn)
+            except OSError:
+                continue
+            state = (st.st_size, st.st_mtime)
+            if seen.get(fn) == state:
+                ready.append((st.st_mtime, fn))
+            else:
+                seen[fn] = state
+                pending += 1
+        if pending:
+            last_change = now
+        if ready and first_ready is None:
+            first_ready = now
+        if ready and (now - last_change >= settle or now - first_ready >= MAX_HOLD * settle):
+            first_ready = None
+            for _, fn in ready:
+                seen[fn] = None
+            yield [fn for _, fn in sorted(ready)]
+        time.sleep(interval)
+
+
+def main():
+    logging.basicConfig(filename='slidingwindow.log', level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S %z')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-g", "--topology",
+                        help="topology .json file, or binary topology file",
+                        action="store")
+    parser.add_argument("-d", "--directory",
+                        help="the directory where change detection files appear; records are read from stdin if not set",
+                        action="store")
+    parser.add_argument("-s", "--suffix",
+                        help="the suffix of files to be considered in the directory",
+                        default='', action="store")
+    parser.add_argument("-o", "--outfile",
+                        help="newline delimited JSON file the results of each bin are appended to, stdout if not set",
+                        action="store")
+    parser.add_argument("-l", "--lateness",
+                        help="number of bins a record can arrive after the newest bin seen, default to 1",
+                        type=int, default=1,
+                        action="store")
+    parser.add_argument("-i", "--interval",
+                        help="seconds between two scans of the directory, default to 10",
+                        type=float, default=10,
+                        action="store")
+    parser.add_argument("--settle",
+                        help="seconds without any file appearing or changing in the directory before the files complete "
+                             "are binned together; default to 30",
+                        type=float, default=30,
+                        action="store")
+    parser.add_argument("--stream",
+                        help="read change detection files of the directory one probe at a time, "
+                             "bounding memory by the largest probe record instead of the largest file",
+                        action="store_true")
+    parser.add_argument("--cache",
+                        help="reuse the probe mappings derived from topology, see congestion.py",
+                        action="store_true")
+    args = parser.parse_args()
+
+    if not args.topology:
+        parser.print_help()
+        return
+
+    if args.directory and not os.path.isdir(args.directory):
+        logging.error("%s doesn't exist." % args.directory)
+        return
+
+    try:
+        topo, probes, pb2links, pb2nodes, branches = load_topology(args.topology, args.cache)
+    except (IOError, ValueError) as e:
+        logging.error(e)
+        return
+    logging.info("%d node, %d links" % (len(topo.nodes()), len(topo.edges())))
+
+    window = SlidingWindow(topo, probes, pb2links, pb2nodes, branches, args.lateness)
+    out = open(args.outfile, 'a') if args.outfile else sys.stdout
+
+    def emit(results):
+        for r in results:
+            out.write(json.dumps(r) + '\n')
+        out.flush()
+
+    try:
+        if args.directory:
+            for files in tail_directory(args.directory, args.suffix, args.interval, args.settle):
+                emit(window.feed_files(files, args.stream))
+        else:
+            for items in read_ndjson(sys.stdin):
+                emit(window.feed(items))
+    except KeyboardInterrupt:
+        logging.info("Interrupted.")
+    emit(window.flush())
+    if out is not sys.stdout:
+        out.close()
+
+
+if __name__ == '__main__':
+    main()
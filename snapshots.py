@@ -0,0 +1,309 @@
+"""
+snapshots.py holds the topology of each time bin over a time window, as the graph of its first bin plus per-bin deltas.
+
+The links traversed by each probe in a bin are those of the paths it measured in that bin;
+a probe not measured in a bin keeps the links of its latest measurement.
+The delta of a bin is the (link, probe) pairs appearing and disappearing in it, bins without change have none.
+The graph of any bin is reconstructed by a cursor moving from bin to bin, applying or reverting the deltas in between,
+hence in time proportional to their size, see Snapshots.at().
+
+Snapshots are saved as .json, with node names and probe IDs:
+    {"first": sec since epoch, "bin_size": int, "bin_count": int,
+     "nodes": [{"name":..., "tag": [...], "hosting": [...]}...],
+     "base": [[src name, tgt name, [probe IDs]]...],
+     "deltas": [{"bin": int, "add": [[src name, tgt name, [probe IDs]]...], "remove": [...]}...]}
+"""
+import json
+from bisect import bisect_right
+from collections import defaultdict
+import networkx as nx
+import timewindow as tw
+import interning as it
+import probeset as ps
+
+SUFFIX = '.snapshots'
+TIMELINE = 'timeline'  # graph attribute holding the paths measured by each probe per bin, see merge()
+
+
+def snapshot_path(fn):
+    """the snapshot file going with a topology file"""
+    return fn + SUFFIX
+
+
+def link_key(u, v):
+    """links are keyed by their end nodes in ascending order"""
+    return (u, v) if u <= v else (v, u)
+
+
+class Snapshots(object):
+    """the topology of each bin over a time window
+
+    Attributes:
+        first (int): sec since epoch, beginning of the first bin
+        bin_count (int): number of bins
+        bin_size (int): the size of bin in seconds
+        node_attrs (dict): {node: attributes}, having at least the 'name' of node, as in the union of all bins
+        probes (interning.Interner): probe IDs of the ids in probe sets
+        base (dict): {link: ps.ProbeSet}, links of the first bin and their probes
+        deltas (dict): {bin offset: (added, removed)}, each a dict {link: ps.ProbeSet} of the probes starting and
+            stopping to traverse the link in that bin
+        cursor (int): offset of the bin graph is at
+        graph (nx.Graph): the topology of bin cursor, modified in place when the cursor moves
+    """
+
+    def __init__(self, first, bin_count, bin_size, node_attrs, probes, base, deltas):
+        """
+        Args:
+            first (int): sec since epoch, beginning of the first bin
+            bin_count (int): number of bins
+            bin_size (int): the size of bin in seconds
+            node_attrs (dict): {node: attributes}
+            probes (interning.Interner): probe IDs of the ids in probe sets
+            base (dict): {link: ps.ProbeSet}, links of the first bin and their probes
+            deltas (dict): {bin offset: (added, removed)}, only for bins with changes
+        """
+        self.first = first
+        self.bin_count = bin_count
+        self.bin_size = bin_size
+        self.node_attrs = node_attrs
+        self.probes = probes
+        self.base = base
+        self.deltas = deltas
+        self.changes = sorted(deltas)  # offsets of bins with delta
+        self.cursor = 0
+        self.graph = nx.Graph()
+        self._apply(base, dict())
+
+    def bin_index(self, t):
+        """offset of the bin sec since epoch t falls in"""
+        return (t - self.first) // self.bin_size
+
+    def epoch(self, k):
+        """sec since epoch of the beginning of bin k"""
+        return self.first + k * self.bin_size
+
+    def _apply(self, added, removed):
+        """remove then add probes to the links of graph; links left without probe and isolated nodes are removed"""
+        g = self.graph
+        for (u, v), pbs in removed.iteritems():
+            g[u][v]['probe'] -= pbs
+        for (u, v), pbs in added.iteritems():
+            if g.has_edge(u, v):
+                g[u][v]['probe'] |= pbs
+            else:
+                for n in (u, v):
+                    if n not in g:
+                        g.add_node(n, self.node_attrs[n])
+                g.add_edge(u, v, probe=ps.ProbeSet() | pbs)
+        for u, v in removed:
+            if g.has_edge(u, v) and not g[u][v]['probe']:
+                g.remove_edge(u, v)
+                for n in (u, v):
+                    if n in g and not g.adj[n]:
+                        g.remove_node(n)
+
+    def at(self, k):
+        """move the cursor to bin k
+
+        Only the deltas of the bins between the cursor and k are applied, or reverted if k is before the cursor.
+
+        Args:
+            k (int): bin offset
+
+        Returns:
+            nx.Graph, the topology of bin k, links having the ps.ProbeSet of probes traversing them as 'probe';
+            it is the same object whichever the bin, modified in place
+        """
+        if not 0 <= k < self.bin_count:
+            raise IndexError("Bin %d out of snapshots of %d bins." % (k, self.bin_count))
+        if k > self.cursor:
+            for j in self.changes[bisect_right(self.changes, self.cursor):bisect_right(self.changes, k)]:
+                added, removed = self.deltas[j]
+                self._apply(added, removed)
+        elif k < self.cursor:
+            for j in reversed(self.changes[bisect_right(self.changes, k):bisect_right(self.changes, self.cursor)]):
+                added, removed = self.deltas[j]
+                self._apply(removed, added)
+        self.cursor = k
+        return self.graph
+
+    def segments(self, begin, stop):
+        """split [begin, stop] into time ranges of constant topology
+
+        Bins before the first one of snapshots take the topology of the first bin, those after the last one that of
+        the last bin.
+
+        Args:
+            begin (int): sec since epoch
+            stop (int): sec since epoch
+
+        Returns:
+            list of tuple (sec since epoch, bin offset), the beginning of each range and a bin whose topology holds in it
+        """
+        b0 = min(max(self.bin_index(begin), 0), self.bin_count - 1)
+        b1 = min(max(self.bin_index(stop), 0), self.bin_count - 1)
+        res = [(tw.bin_floor(begin, self.bin_size), b0)]
+        for k in self.changes[bisect_right(self.changes, b0):bisect_right(self.changes, b1)]:
+            res.append((self.epoch(k), k))
+        return res
+
+    def probe_series(self, u, v):
+        """probes traversing a link over time
+
+        Args:
+            u, v: end nodes of the link
+
+        Returns:
+            list of tuple (sec since epoch, ps.ProbeSet), the probes of the link from that bin on, whenever they change;
+            empty when the link is absent
+        """
+        l = link_key(u, v)
+        pbs = ps.ProbeSet() | self.base.get(l, ps.ProbeSet())
+        res = [(self.first, pbs)]
+        for k in self.changes:
+            added, removed = self.deltas[k]
+            if l in added or l in removed:
+                pbs = (pbs - removed.get(l, ps.ProbeSet())) | added.get(l, ps.ProbeSet())
+                res.append((self.epoch(k), pbs))
+        return res
+
+    def union(self):
+        """the links of all the bins with all their probes, i.e. the topology of the whole window
+
+        Returns:
+            nx.Graph
+        """
+        g = nx.Graph()
+        for added in [self.base] + [self.deltas[k][0] for k in self.changes]:
+            for (u, v), pbs in added.iteritems():
+                if g.has_edge(u, v):
+                    g[u][v]['probe'] |= pbs
+                else:
+                    g.add_node(u, self.node_attrs[u])
+                    g.add_node(v, self.node_attrs[v])
+                    g.add_edge(u, v, probe=ps.ProbeSet() | pbs)
+        return g
+
+
+def merge(timelines, nodes, probes):
+    """merge the paths measured by each probe per bin, as collected by several workers on their own ids
+
+    Args:
+        timelines (list of tuple): (node Interner, probe Interner, {probe id: {sec since epoch: set of paths}})
+            of each worker, paths are tuples of node ids
+        nodes (interning.Interner): node names of the merged timeline, extended with those unknown
+        probes (interning.Interner): probe IDs of the merged timeline, extended with those unknown
+
+    Returns:
+        dict {probe id: {sec since epoch: set of paths}}
+    """
+    res = defaultdict(lambda: defaultdict(set))
+    for worker_nodes, worker_probes, timeline in timelines:
+        node_map, probe_map = nodes.remap(worker_nodes), probes.remap(worker_probes)
+        for pb, bins in timeline.iteritems():
+            for t, paths in bins.iteritems():
+                res[probe_map[pb]][t].update(tuple(node_map[h] for h in p) for p in paths)
+    return res
+
+
+def build(timeline, first, bin_count, bin_size, node_attrs, probes):
+    """build snapshots out of the paths measured by each probe per bin
+
+    Args:
+        timeline (dict): {probe id: {sec since epoch of bin beginning: paths measured in that bin}},
+            paths being sequences of nodes
+        first (int): sec since epoch, beginning of the first bin
+        bin_count (int): number of bins
+        bin_size (int): the size of bin in seconds
+        node_attrs (dict): {node: attributes}, see Snapshots
+        probes (interning.Interner): probe IDs of the probe ids
+
+    Returns:
+        Snapshots
+    """
+    base = defaultdict(ps.ProbeSet)
+    deltas = defaultdict(lambda: (defaultdict(ps.ProbeSet), defaultdict(ps.ProbeSet)))
+    for pb, bins in timeline.iteritems():
+        current = set()
+        for t in sorted(bins):
+            k = (t - first) // bin_size
+            if not 0 <= k < bin_count:
+                continue
+            links = set(link_key(u, v) for p in bins[t] for u, v in zip(p[:-1], p[1:]))
+            if k == 0:
+                for l in links:
+                    base[l].add(pb)
+            else:
+                added, removed = deltas[k]
+                for l in links - current:
+                    added[l].add(pb)
+                for l in current - links:
+                    removed[l].add(pb)
+            current = links
+    deltas = {k: (dict(a), dict(r)) for k, (a, r) in deltas.iteritems() if a or r}
+    return Snapshots(first, bin_count, bin_size, node_attrs, probes, dict(base), deltas)
+
+
+def dump(snap, fn):
+    """save snapshots to .json, with node names and probe IDs, see module doc
+
+    Args:
+        snap (Snapshots)
+        fn (string): path to the output file
+    """
+    def name(n):
+        return snap.node_attrs[n]['name']
+
+    def links(d):
+        return [[name(u), name(v), [snap.probes.name(pb) for pb in pbs]] for (u, v), pbs in sorted(d.iteritems())]
+
+    nodes = []
+    for n, attrs in sorted(snap.node_attrs.iteritems()):
+        d = dict()
+        for k, v in attrs.iteritems():
+            if k in it.PROBE_ATTRS:
+                d[k] = [snap.probes.name(pb) for pb in v]
+            else:
+                d[k] = list(v) if isinstance(v, set) else v
+        nodes.append(d)
+    data = dict(first=snap.first, bin_size=snap.bin_size, bin_count=snap.bin_count, nodes=nodes,
+                base=links(snap.base),
+                deltas=[dict(bin=k, add=links(snap.deltas[k][0]), remove=links(snap.deltas[k][1]))
+                        for k in snap.changes])
+    with open(fn, 'w') as fp:
+        json.dump(data, fp)
+
+
+def load(fn, node_ids=None, probes=None):
+    """load snapshots saved by dump()
+
+    Args:
+        fn (string): path to the snapshot file
+        node_ids (dict): {node name: node}, e.g. those of the topology the snapshots go with;
+            nodes are the positions of their names in the file if None
+        probes (interning.Interner): probe IDs are interned in it, e.g. that of the topology; a new one if None
+
+    Returns:
+        Snapshots; ValueError is raised if a node is not in node_ids
+    """
+    with open(fn, 'r') as fp:
+        data = json.load(fp)
+    probes = it.Interner() if probes is None else probes
+    if node_ids is None:
+        node_ids = {n['name']: i for i, n in enumerate(data['nodes'])}
+
+    def node(name):
+        try:
+            return node_ids[name]
+        except KeyError:
+            raise ValueError("Node %r of %s is not in topology." % (name, fn))
+
+    def links(entries):
+        return {link_key(node(u), node(v)): ps.ProbeSet([probes.id(pb) for pb in pbs]) for u, v, pbs in entries}
+
+    node_attrs = dict()
+    for n in data['nodes']:
+        attrs = {k: ps.ProbeSet([probes.id(pb) for pb in v]) if k in it.PROBE_ATTRS else v for k, v in n.iteritems()}
+        node_attrs[node(n['name'])] = attrs
+    deltas = {d['bin']: (links(d['add']), links(d['remove'])) for d in data['deltas']}
+    return Snapshots(data['first'], data['bin_count'], data['bin_size'], node_attrs, probes, links(data['base']), deltas)
@@ -0,0 +1,45 @@
+"""
+tests of tracegraph.divergent_set(): ties between sets of the same size are broken on the names of elements and
+attributes, so that the set picked doesn't depend on the ids they are interned with.
+
+    python -m unittest discover -s tests -t .
+"""
+import random
+import unittest
+import tracegraph as tg
+
+
+def random_probes(seed):
+    """{probe ID: set of node names} of the probes around node 'n', with many sets of the same size"""
+    rnd = random.Random(seed)
+    neighbours = ['AS%d' % i for i in range(rnd.randint(2, 8))]
+    return {'%d' % (1000 + i): {'n', rnd.choice(neighbours), rnd.choice(neighbours)} for i in range(rnd.randint(1, 30))}
+
+
+def relabel(p2n, seed):
+    """p2n on random ids, as interned in another order, along with the names of these ids"""
+    rnd = random.Random(seed)
+    names = sorted(p2n) + sorted(set().union(*p2n.values()))
+    ids = range(len(names))
+    rnd.shuffle(ids)
+    name = dict(zip(ids, names))
+    index = {v: k for k, v in name.iteritems()}
+    return {index[pb]: {index[x] for x in nodes} for pb, nodes in p2n.iteritems()}, name, index
+
+
+class TestDivergentSet(unittest.TestCase):
+
+    def test_names_break_ties(self):
+        for seed in range(200):
+            p2n = random_probes(seed)
+            size, res = tg.divergent_set(p2n, {'n'})
+            for relabel_seed in range(3):
+                ids, name, index = relabel(p2n, relabel_seed)
+                id_size, id_res = tg.divergent_set(ids, {index['n']}, element_name=name.get, attr_name=name.get)
+                self.assertEqual(id_size, size)
+                self.assertEqual([name[pb] for pb in id_res[0]['member']], res[0]['member'], "seed %d" % seed)
+                self.assertEqual({name[x] for x in id_res[0]['attr']}, res[0]['attr'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,334 @@
+"""
+tests of the link change location inference of tracegraph.change_inference_link()
+
+Links waiting for the result of their trunk are kept on an explicit stack; the results are compared with those of
+the former recursive version, kept below as recursive_inference_link(), on random graphs and on a chain of trunk links
+longer than the recursion limit. Loops of 3 or more links depending on each other never ended in the recursive
+version; the trunk closing the loop is taken as LIKELY.
+
+    python -m unittest discover -s tests -t .
+"""
+import sys
+import copy
+import random
+import threading
+import unittest
+from collections import defaultdict
+import numpy as np
+import networkx as nx
+import tracegraph as tg
+import scorestore as ss
+import probeset as ps
+
+LINK_THRESHOLD = 0.3
+NODE_THRESHOLD = 0.5
+
+
+def recursive_inference_link(graph, link_threshold, store):
+    """link change location inference as before the explicit stack, each trunk link being inferred by a recursive call
+
+    See tracegraph.change_inference_link() for the arguments; all the bins of store are inferred.
+    """
+    branches = dict()
+
+    def helper(g, l, t, from_link=None):
+        """ the actual inference in done here
+
+        Args:
+            g (nx.Graph): the graph operated on
+            l (tuple of nodes): the link currently being investigated
+            t (int): the bin offset of inference
+            from_link (tuple of nodes): the function can be called recursively, from_link indicates the outerlayer link
+
+        Returns:
+            SURE, LIKELY, NEG
+        """
+
+        # skip if already inferred
+        if g[l[0]][l[1]]['inference'][t] != tg.UNKNOWN:
+            return g[l[0]][l[1]]['inference'][t]
+
+        # a safe check; the a link doesn't even meet the threshold, it can not be the cause
+        if g[l[0]][l[1]]["score"][t] <= link_threshold:
+            return tg.NEG
+
+        # if connecting nodes are the cause, then link can not be the cause according to single cause assumption
+        l0_res = g.node[l[0]]["inference"][t]
+        l1_res = g.node[l[1]]["inference"][t]
+        caused_by_node = bool(l0_res == tg.SURE or l1_res == tg.SURE)
+
+        if caused_by_node:
+            g[l[0]][l[1]]['inference'][t] = tg.NEG
+            return tg.NEG
+
+        # verifies if the link itself is the cause
+        # topology only, thus computed once per link and reused for all bins
+        ext = branches.get(l) or branches.get(l[::-1])
+        if ext is None:
+            ext = branches[l] = tg.link_branches(g, l[0], l[1])
+        ext_con_count_abs = {
+            k: sum([1 if g[i[0]][k]['score'][t] > link_threshold else 0 for i in v]) for
+            k, v in ext.items()}
+        ext_con_count_prop = {
+            k: sum([1 if g[i[0]][k]['score'][t] > float(i[2]) / i[1] * link_threshold else 0 for i in v])
+            for
+            k, v in ext.items()}
+
+        # 1/ l has multiple extension branches at both sides and multiple branches undergo same change
+        # NOTE: the extension branches can contain probes not in the current link, thus proportional threshold
+        if ext_con_count_prop[l[0]] > 1 and ext_con_count_prop[l[1]] > 1:
+            # verify if the extension branches are ALL LB branches; if the cause return LIKELY
+            pb_hash = defaultdict(set)
+            for n in l:
+                for ext_n, a, b, h in ext[n]:
+                    if g[n][ext_n]['score'][t] > float(b)/a * link_threshold:
+                        pb_hash[n].add(h)
+            if all([len(i[1]) > 1 for i in pb_hash.items()]):
+                g[l[0]][l[1]]['inference'][t] = tg.SURE
+            else:
+                g[l[0]][l[1]]['inference'][t] = tg.LIKELY
+        # 2/ one extension branches one side multiple the other side; the other side has multiple branch undergo same change
+        elif len(ext[l[0]]) == 1 and ext_con_count_prop[l[1]] > 1:
+            if ext_con_count_abs[l[0]] < 1:  # the single extension branch not being the cause
+                # again verify for LB
+                pb_hash = set()
+                for ext_n, a, b, h in ext[l[1]]:
+                    if g[l[1]][ext_n]['score'][t] > float(b) / a * link_threshold:
+                        pb_hash.add(h)
+                if len(pb_hash) > 1:
+                    g[l[0]][l[1]]['inference'][t] = tg.SURE
+                else:
+                    g[l[0]][l[1]]['inference'][t] = tg.LIKELY
+            # the result depends on the result of single extension branch
+            else:
+                trunk = (l[0], ext[l[0]][0][0])  # the only extension branch on l[0]
+                # the single extension branch depends as well on current link
+                if from_link and (trunk == from_link or trunk == from_link[::-1]):
+                    g[l[0]][l[1]]['inference'][t] = tg.LIKELY
+                else:
+                    trunk_res = helper(g, trunk, t, l)
+                    # if the trunk_res == neg
+                    # 1/ possible that l cause the change
+                    # 2/ possible that upstream of trunk causes a change,
+                    # and that change could be irrelevant to change on l
+                    # therefore all other cases are tg.LIKELY
+                    if trunk_res == tg.SURE:
+                        g[l[0]][l[1]]['inference'][t] = tg.NEG
+                    else:
+                        g[l[0]][l[1]]['inference'][t] = tg.LIKELY
+        elif len(ext[l[1]]) == 1 and ext_con_count_prop[l[0]] > 1:
+            if ext_con_count_abs[l[1]] < 1:  # the extension branch not being the cause
+                pb_hash = set()
+                for ext_n, a, b, h in ext[l[0]]:
+                    if g[l[0]][ext_n]['score'][t] > float(b) / a * link_threshold:
+                        pb_hash.add(h)
+                if len(pb_hash) > 1:
+                    g[l[0]][l[1]]['inference'][t] = tg.SURE
+                else:
+                    g[l[0]][l[1]]['inference'][t] = tg.LIKELY
+            else:
+                trunk = (l[1], ext[l[1]][0][0])  # the only extension branch on l[0]
+                if from_link and (trunk == from_link or trunk == from_link[::-1]):
+                    g[l[0]][l[1]]['inference'][t] = tg.LIKELY
+                else:
+                    trunk_res = helper(g, trunk, t, l)
+                    if trunk_res == tg.SURE:
+                        g[l[0]][l[1]]['inference'][t] = tg.NEG
+                    else:
+                        g[l[0]][l[1]]['inference'][t] = tg.LIKELY
+        # 3/ both sides have only only one extension branch
+        elif len(ext[l[0]]) == 1 and len(ext[l[1]]) == 1:
+            # if non of the two extension branches could be the cause, the current one must be
+            if ext_con_count_abs[l[0]] < 1 and ext_con_count_abs[l[1]] < 1:
+                g[l[0]][l[1]]['inference'][t] = tg.SURE
+            else:
+                # otherwise, the res of current branch depends on the res of the two extension branches
+                trunk_l0 = (l[0], ext[l[0]][0][0])
+                trunk_l1 = (l[1], ext[l[1]][0][0])
+                # if ext branch attached to l[0] depend on current link,
+                # then the res of current link depend on the ext branch attached to l[1]
+                if from_link and (trunk_l0 == from_link or trunk_l0 == from_link[::-1]):
+                    # it now depends on the result of trunk_l1 which must be different from l
+                    trunk_l1_res = helper(g, trunk_l1, t, l)
+                    if trunk_l1_res == tg.SURE:
+                        g[l[0]][l[1]]['inference'][t] = tg.NEG
+                    else:
+                        g[l[0]][l[1]]['inference'][t] = tg.LIKELY
+                elif from_link and (trunk_l1 == from_link or trunk_l1 == from_link[::-1]):
+                    # it now depends on the result of trunk_l0 which must be different from l
+                    trunk_l0_res = helper(g, trunk_l0, t, l)
+                    if trunk_l0_res == tg.SURE:
+                        g[l[0]][l[1]]['inference'][t] = tg.NEG
+                    else:
+                        g[l[0]][l[1]]['inference'][t] = tg.LIKELY
+                else:
+                    trunk_l0_res = helper(g, trunk_l0, t, l)
+                    trunk_l1_res = helper(g, trunk_l1, t, l)
+                    if trunk_l1_res == tg.SURE or trunk_l0_res == tg.SURE:
+                        g[l[0]][l[1]]['inference'][t] = tg.NEG
+                    elif trunk_l0_res == tg.LIKELY or trunk_l1_res == tg.LIKELY:
+                        g[l[0]][l[1]]['inference'][t] = tg.LIKELY
+                    else:
+                        g[l[0]][l[1]]['inference'][t] = tg.SURE
+        # 5/ both side has no extension branch, i.e standalone link
+        elif len(ext[l[1]]) == 0 and len(ext[l[0]]) == 0:
+            g[l[0]][l[1]]['inference'][t] = tg.SURE
+        # 4/ one side has no extension branch
+        elif len(ext[l[0]]) == 0:
+            if ext_con_count_prop[l[1]] > 1:
+                pb_hash = set()
+                for ext_n, a, b, h in ext[l[1]]:
+                    if g[l[1]][ext_n]['score'][t] > float(b) / a * link_threshold:
+                        pb_hash.add(h)
+                if len(pb_hash) > 1:
+                    g[l[0]][l[1]]['inference'][t] = tg.SURE
+                else:
+                    g[l[0]][l[1]]['inference'][t] = tg.LIKELY
+            elif len(ext[l[1]]) == 1:
+                if ext_con_count_abs[l[1]] < 1:
+                    g[l[0]][l[1]]['inference'][t] = tg.SURE
+                else:
+                    trunk = (l[1], ext[l[1]][0][0])  # the only extension branch on l[1]
+                    if from_link and (trunk == from_link or trunk == from_link[::-1]):
+                        g[l[0]][l[1]]['inference'][t] = tg.LIKELY
+                    else:
+                        trunk_res = helper(g, trunk, t, l)
+                        if trunk_res == tg.SURE:
+                            g[l[0]][l[1]]['inference'][t] = tg.NEG
+                        else:
+                            g[l[0]][l[1]]['inference'][t] = tg.LIKELY
+            else:
+                g[l[0]][l[1]]['inference'][t] = tg.NEG
+        elif len(ext[l[1]]) == 0:
+            if ext_con_count_prop[l[0]] > 1:
+                pb_hash = set()
+                for ext_n, a, b, h in ext[l[0]]:
+                    if g[l[0]][ext_n]['score'][t] > float(b) / a * link_threshold:
+                        pb_hash.add(h)
+                if len(pb_hash) > 1:
+                    g[l[0]][l[1]]['inference'][t] = tg.SURE
+                else:
+                    g[l[0]][l[1]]['inference'][t] = tg.LIKELY
+            elif len(ext[l[0]]) == 1:
+                if ext_con_count_abs[l[0]] < 1:
+                    g[l[0]][l[1]]['inference'][t] = tg.SURE
+                else:
+                    trunk = (l[0], ext[l[0]][0][0])  # the only extension branch on l[1]
+                    if from_link and (trunk == from_link or trunk == from_link[::-1]):
+                        g[l[0]][l[1]]['inference'][t] = tg.LIKELY
+                    else:
+                        trunk_res = helper(g, trunk, t, l)
+                        if trunk_res == tg.SURE:
+                            g[l[0]][l[1]]['inference'][t] = tg.NEG
+                        else:
+                            g[l[0]][l[1]]['inference'][t] = tg.LIKELY
+            else:
+                g[l[0]][l[1]]['inference'][t] = tg.NEG
+        else:
+            g[l[0]][l[1]]['inference'][t] = tg.NEG
+
+        return g[l[0]][l[1]]['inference'][t]
+
+    active = store.active(link_threshold, store.link_rows)
+    for ts in store.bins():
+        for row in active[ts]:
+            link = store.links[row]
+            if graph[link[0]][link[1]]['inference'][ts] == tg.UNKNOWN:
+                helper(graph, link, ts)
+
+
+def add_probes(g, link_probes):
+    """set the probes of the links of g, and those of nodes as the union of their links"""
+    for (u, v), pbs in zip(g.edges(), link_probes):
+        g[u][v]['probe'] = ps.ProbeSet(pbs)
+    for x in g.nodes():
+        g.node[x]['probe'] = ps.ProbeSet(pb for y in g[x] for pb in g[x][y]['probe'])
+    return g
+
+
+def random_graph(seed):
+    """a random tree with a few more links, random probes and scores over 5 bins"""
+    rnd = random.Random(seed)
+    n = rnd.randint(5, 60)
+    g = nx.Graph()
+    for i in range(1, n):
+        g.add_edge(i, rnd.randrange(i))
+    for _ in range(rnd.randint(0, 4)):
+        g.add_edge(rnd.randrange(n), rnd.randrange(n))
+    g.remove_edges_from(g.selfloop_edges())
+    probes = range(rnd.randint(4, 15))
+    add_probes(g, [rnd.sample(probes, rnd.randint(1, 4)) for _ in g.edges()])
+    return g, np.random.RandomState(seed).rand(g.number_of_edges() + g.number_of_nodes(), 5)
+
+
+def infer(g, scores, engine):
+    """the inferences of g given scores per row of ScoreStore, nodes being inferred first
+
+    Args:
+        engine (callable): link inference, called as engine(graph, link_threshold, store)
+    """
+    g = copy.deepcopy(g)
+    store = ss.ScoreStore(g.edges(), g.nodes(), 0, 3600 * (scores.shape[1] - 1), 3600)
+    store.score[:] = scores
+    store.attach(g)
+    tg.change_inference_node(g, NODE_THRESHOLD, store)
+    engine(g, LINK_THRESHOLD, store)
+    return store.inference
+
+
+def uniform_scores(g, bins=1):
+    """links all above LINK_THRESHOLD, nodes all below NODE_THRESHOLD"""
+    scores = np.zeros((g.number_of_edges() + g.number_of_nodes(), bins))
+    scores[:g.number_of_edges()] = 1.
+    return scores
+
+
+def with_stack(func, size, limit):
+    """the result of func() run in a thread of that stack size in bytes and recursion limit"""
+    res = []
+    former_size, former_limit = threading.stack_size(size), sys.getrecursionlimit()
+    sys.setrecursionlimit(limit)
+    try:
+        worker = threading.Thread(target=lambda: res.append(func()))
+        worker.start()
+        worker.join()
+    finally:
+        threading.stack_size(former_size)
+        sys.setrecursionlimit(former_limit)
+    return res[0]
+
+
+class TestInferenceLink(unittest.TestCase):
+
+    def test_random_graphs(self):
+        for seed in range(300):
+            g, scores = random_graph(seed)
+            np.testing.assert_array_equal(infer(g, scores, tg.change_inference_link),
+                                          infer(g, scores, recursive_inference_link), "seed %d" % seed)
+
+    def test_long_chain(self):
+        # each link waits for the next one, deeper than the recursion limit
+        n = 2 * sys.getrecursionlimit()
+        g = add_probes(nx.path_graph(n + 1), [(0, 1000 + i) for i in range(n)])
+        scores = uniform_scores(g)
+        with self.assertRaisesRegexp(RuntimeError, "recursion"):
+            infer(g, scores, recursive_inference_link)
+        stats = dict()
+        res = infer(g, scores, lambda *args: tg.change_inference_link(*args, stats=stats))
+        self.assertEqual(stats['max_depth'], n)
+        expected = with_stack(lambda: infer(g, scores, recursive_inference_link), 256 << 20, 4 * n)
+        np.testing.assert_array_equal(res, expected)
+
+    def test_loops(self):
+        # each link of a ring waits for both its neighbours, the last one for the first link again
+        for n in (3, 4, 7):
+            g = add_probes(nx.cycle_graph(n), [(0,)] * n)
+            scores = uniform_scores(g, bins=2)
+            res = infer(g, scores, tg.change_inference_link)
+            self.assertTrue((res[:n] == tg.LIKELY).all(), "ring of %d links" % n)
+            with self.assertRaisesRegexp(RuntimeError, "recursion"):
+                infer(g, scores, recursive_inference_link)
+
+
+if __name__ == '__main__':
+    unittest.main()
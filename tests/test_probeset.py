@@ -0,0 +1,32 @@
+"""
+tests of probeset.IntBitSet, the probe set used when pyroaring is not installed
+
+    python -m unittest discover -s tests -t .
+"""
+import random
+import unittest
+import probeset as ps
+
+
+class TestIntBitSet(unittest.TestCase):
+
+    def test_iter(self):
+        self.assertEqual(list(ps.IntBitSet()), [])
+        self.assertEqual(list(ps.IntBitSet([0, 7, 8, 63, 64, 65])), [0, 7, 8, 63, 64, 65])
+        for seed in range(200):
+            rnd = random.Random(seed)
+            values = set(rnd.randrange(rnd.choice([8, 64, 1000, 100000])) for _ in xrange(rnd.randint(0, 300)))
+            s = ps.IntBitSet(values)
+            self.assertEqual(list(s), sorted(values), "seed %d" % seed)
+            self.assertEqual(len(s), len(values))
+
+    def test_pending(self):
+        s = ps.IntBitSet([3])
+        s.add(1)
+        s.update([200, 3])
+        self.assertEqual(list(s), [1, 3, 200])
+        self.assertEqual(list(s & ps.IntBitSet([200, 1, 5])), [1, 200])
+
+
+if __name__ == '__main__':
+    unittest.main()
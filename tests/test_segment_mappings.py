@@ -0,0 +1,51 @@
+"""
+tests of congestion.segment_mappings(): time ranges of constant topology learnt from snapshots must be made of whole
+bins of inference, snapshots of other bin sizes are rejected.
+
+    python -m unittest discover -s tests -t .
+"""
+import unittest
+import networkx as nx
+import congestion as cg
+import interning as it
+import probeset as ps
+import snapshots as sn
+
+FIRST = 1480550400  # 2016-12-01 00:00:00 UTC
+
+
+def snapshots(bin_size, first=FIRST, bin_count=8):
+    """probe 0 traverses link (0, 1) then link (1, 2) from bin 3 on"""
+    probes = it.Interner(['20000'])
+    timeline = {0: {first: [[0, 1]], first + 3 * bin_size: [[1, 2]]}}
+    return sn.build(timeline, first, bin_count, bin_size, {n: dict(name=n) for n in range(3)}, probes)
+
+
+def topology():
+    """the union of snapshots()"""
+    g = nx.Graph()
+    for n in range(3):
+        g.add_node(n, name=n)
+    g.add_edge(0, 1, probe=ps.ProbeSet([0]))
+    g.add_edge(1, 2, probe=ps.ProbeSet([0]))
+    return g
+
+
+class TestSegmentMappings(unittest.TestCase):
+
+    def test_whole_bins(self):
+        for bin_size in [cg.BIN, 3 * cg.BIN]:
+            snap = snapshots(bin_size)
+            starts, pb2links, _, _ = cg.segment_mappings(topology(), snap, FIRST, FIRST + 8 * bin_size - 1)
+            self.assertEqual(starts, [FIRST, FIRST + 3 * bin_size])
+            self.assertEqual(pb2links, {(0, 0): [(0, 1)], (0, 1): [(1, 2)]})
+
+    def test_bin_size_mismatch(self):
+        for bin_size, first in [(900, FIRST), (300, FIRST), (2 * cg.BIN, FIRST + 300)]:
+            snap = snapshots(bin_size, first)
+            with self.assertRaises(ValueError):
+                cg.segment_mappings(topology(), snap, first, first + 8 * bin_size - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
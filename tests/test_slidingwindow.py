@@ -0,0 +1,58 @@
+"""
+tests of slidingwindow.SlidingWindow: the change detection files of a directory, binned one group of files spanning
+the same time range at a time, give the same results as all their records fed at once.
+
+    python -m unittest discover -s tests -t .
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import benchmark
+import congestion as cg
+import jsonstream as js
+import slidingwindow as sw
+
+
+class TestSlidingWindow(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.data = benchmark.write_dataset(cls.directory, 200)
+        # writes topo.json, as done by as_graph.py
+        benchmark.time_pipeline(cls.data, cls.directory)
+        cls.mappings = cg.load_topology(os.path.join(cls.directory, 'topo.json'))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_overlapping(self):
+        self.assertEqual(sw.overlapping([]), [])
+        self.assertEqual(sw.overlapping([(10, 20, 'b'), (0, 10, 'a'), (21, 30, 'c'), (25, 26, 'd'), (15, 40, 'e')]),
+                         [['a', 'b', 'e', 'c', 'd']])
+        self.assertEqual(sw.overlapping([(21, 30, 'c'), (0, 10, 'a'), (5, 20, 'b')]), [['a', 'b'], ['c']])
+
+    def test_feed_files(self):
+        items = []
+        for fn in self.data['changes']:
+            with open(fn, 'r') as fp:
+                items.extend(js.load_items(fp))
+        expected = sw.SlidingWindow(*self.mappings)
+        expected = expected.feed(items) + expected.flush()
+        self.assertTrue(expected)
+        for stream in [False, True]:
+            window = sw.SlidingWindow(*self.mappings)
+            self.assertEqual(window.feed_files(self.data['changes'], stream) + window.flush(), expected)
+            self.assertEqual(window.dropped, 0)
+
+    def test_late_file(self):
+        window = sw.SlidingWindow(*self.mappings)
+        window.feed_files(self.data['changes'][:1])
+        window.feed_files(self.data['changes'][1:2])
+        self.assertGreater(window.dropped, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
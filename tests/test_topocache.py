@@ -0,0 +1,66 @@
+"""
+tests of the topology cache of congestion.py: a run loading the topology and probe mappings from cache gives the same
+result as the run writing it and as a run without cache, links being visited by inference in the same order.
+
+    python -m unittest discover -s tests -t .
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+import unittest
+import benchmark
+import congestion as cg
+import timetools as tt
+import topobin as tb
+
+CONGESTION = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'congestion.py')
+
+
+class TestTopologyCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.data = benchmark.write_dataset(cls.directory, 500)
+        # writes topo.json, as done by as_graph.py
+        benchmark.time_pipeline(cls.data, cls.directory)
+        cls.topo_fn = os.path.join(cls.directory, 'topo.json')
+        cls.binary_fn = os.path.join(cls.directory, 'topo' + tb.EXTENSION)
+        with open(cls.topo_fn, 'r') as fp:
+            tb.dump(json.load(fp), cls.binary_fn)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def run_congestion(self, topo_fn, outfile, *options):
+        subprocess.check_call([sys.executable, CONGESTION, '-g', topo_fn, '-s', 'cpt.json', '-d', self.directory,
+                               '-b', tt.epoch_to_string(self.data['begin']),
+                               '-t', tt.epoch_to_string(self.data['stop']),
+                               '-o', os.path.join(self.directory, outfile)] + list(options), cwd=self.directory)
+        with open(os.path.join(self.directory, outfile), 'r') as fp:
+            return fp.read()
+
+    def test_graph_order(self):
+        for fn in [self.topo_fn, self.binary_fn]:
+            loaded = cg.load_topology(fn)[0]
+            written = cg.load_topology(fn, cache=True)[0]
+            cached = cg.load_topology(fn, cache=True)[0]
+            for g in [written, cached]:
+                self.assertEqual(g.nodes(), loaded.nodes(), fn)
+                self.assertEqual(g.edges(), loaded.edges(), fn)
+                self.assertEqual([list(g.adj[n]) for n in g], [list(loaded.adj[n]) for n in loaded], fn)
+
+    def test_same_output(self):
+        uncached = self.run_congestion(self.topo_fn, 'uncached.json', '-p', '1')
+        # outputs are compared as a whole, their differences are too long to be printed
+        for outfile in ['written.json', 'cached.json']:
+            self.assertTrue(self.run_congestion(self.topo_fn, outfile, '-p', '1', '--cache') == uncached,
+                            "%s differs from uncached.json" % outfile)
+
+
+if __name__ == '__main__':
+    unittest.main()
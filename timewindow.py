@@ -0,0 +1,47 @@
+"""
+timewindow.py locates time windows and time bins in the sorted epoch series attached to each probe
+"""
+from bisect import bisect_left, bisect_right
+
+
+def window_index(epochs, begin=None, stop=None):
+    """find by bisection the index range of a sorted epoch series falling in [begin, stop]
+
+    Args:
+        epochs (list of int): sorted seconds since epoch, e.g. the 'epoch' field of a probe record
+        begin (int): sec since epoch, the window is not bounded at left if None
+        stop (int): sec since epoch, the window is not bounded at right if None
+
+    Returns:
+        tuple (begin_idx, stop_idx), epochs[begin_idx:stop_idx] are all the values v with begin <= v <= stop
+    """
+    begin_idx = bisect_left(epochs, begin) if begin is not None else 0
+    stop_idx = bisect_right(epochs, stop) if stop is not None else len(epochs)
+    return begin_idx, max(begin_idx, stop_idx)
+
+
+def bin_floor(t, bin_size):
+    """the beginning of the bin t falls in
+
+    Args:
+        t (int): sec since epoch
+        bin_size (int): the size of bin in seconds
+
+    Returns:
+        int, sec since epoch
+    """
+    return (t // bin_size) * bin_size
+
+
+def bin_range(begin, stop, bin_size):
+    """the beginnings of all the bins covering [begin, stop]
+
+    Args:
+        begin (int): sec since epoch
+        stop (int): sec since epoch
+        bin_size (int): the size of bin in seconds
+
+    Returns:
+        xrange of sec since epoch
+    """
+    return xrange(bin_floor(begin, bin_size), bin_floor(stop, bin_size) + bin_size, bin_size)
@@ -0,0 +1,231 @@
+"""
+topobin.py stores topology graphs in a compact binary format, as an alternative to the node-link .json files.
+
+Node names (ASNs and IXP names) and probe IDs are interned, i.e. replaced by their index in a name table.
+The file made of:
+    MAGIC, 8 bytes
+    length of header, uint64 little endian
+    header, JSON: graph attributes, name tables, remaining node and link attributes, offsets of arrays
+    arrays, each starting at a multiple of 8 bytes:
+        indptr, indices, adj_link: CSR adjacency, the neighbours of node i are indices[indptr[i]:indptr[i+1]],
+            through the links adj_link[indptr[i]:indptr[i+1]]
+        src, dst: end nodes of each link
+        probe_ptr, probe: probes of link i are probe[probe_ptr[i]:probe_ptr[i+1]], as indexes in sorted probe table
+Arrays are memory mapped on loading, hence shared among processes and read in only when accessed.
+
+It can be used as script to convert between the two formats, the direction is told by file extensions:
+    python topobin.py -i graph.json -o graph.tgb
+    python topobin.py -i graph.tgb -o graph.json
+"""
+import json
+import mmap
+import struct
+import argparse
+import logging
+import networkx as nx
+import numpy as np
+import probeset as ps
+
+MAGIC = 'TGBIN\x00\x01\x00'
+EXTENSION = '.tgb'
+ALIGN = 8
+# link attributes rebuilt from the arrays
+_LINK_KEYS = ('source', 'target', 'src_name', 'tgt_name', 'probe')
+_ARRAYS = (('indptr', '<i8'), ('indices', '<i4'), ('adj_link', '<i4'),
+           ('src', '<i4'), ('dst', '<i4'), ('probe_ptr', '<i8'), ('probe', '<i4'))
+
+
+def is_binary(fn):
+    """tell by file extension if a topology file is in binary format"""
+    return fn.endswith(EXTENSION)
+
+
+def dump(data, fn):
+    """save a topology to binary format
+
+    Args:
+        data (dict): node-link data of topology, as produced by tracegraph.node_link_data_modify(),
+            node ids must be their positions in data['nodes']
+        fn (string): path to the output file
+    """
+    if data.get('multigraph'):
+        raise ValueError("Multigraph is not supported.")
+    nodes, links = data['nodes'], data['links']
+    for i, n in enumerate(nodes):
+        if n['id'] != i:
+            raise ValueError("Node id %r is not its position %d." % (n['id'], i))
+
+    # probe table is sorted, so that indexes don't depend on the order of links
+    probes = sorted(set(pb for l in links for pb in l.get('probe', [])))
+    probe_index = {pb: i for i, pb in enumerate(probes)}
+    src = np.array([l['source'] for l in links], dtype='<i4')
+    dst = np.array([l['target'] for l in links], dtype='<i4')
+    probe_ptr = np.zeros(len(links) + 1, dtype='<i8')
+    probe = []
+    for i, l in enumerate(links):
+        probe.extend(probe_index[pb] for pb in l.get('probe', []))
+        probe_ptr[i + 1] = len(probe)
+    probe = np.array(probe, dtype='<i4')
+
+    # CSR adjacency, each link is seen from both ends unless graph is directed
+    if data.get('directed'):
+        ends, others, link_ids = src, dst, np.arange(len(links), dtype='<i4')
+    else:
+        ends, others = np.concatenate([src, dst]), np.concatenate([dst, src])
+        link_ids = np.concatenate([np.arange(len(links), dtype='<i4')] * 2)
+    order = np.argsort(ends, kind='mergesort')
+    indices, adj_link = others[order], link_ids[order]
+    indptr = np.zeros(len(nodes) + 1, dtype='<i8')
+    np.cumsum(np.bincount(ends, minlength=len(nodes)), out=indptr[1:])
+
+    node_attrs = [{k: v for k, v in n.iteritems() if k not in ('id', 'name')} for n in nodes]
+    link_attrs = [{k: v for k, v in l.iteritems() if k not in _LINK_KEYS} for l in links]
+    header = dict(directed=data.get('directed', False), graph=data.get('graph', {}),
+                  congestion=data.get('congestion', False),
+                  names=[n.get('name', i) for i, n in enumerate(nodes)], probes=probes,
+                  node_attrs=node_attrs, link_attrs=link_attrs if any(link_attrs) else None)
+    arrays = dict(indptr=indptr, indices=indices, adj_link=adj_link, src=src, dst=dst,
+                  probe_ptr=probe_ptr, probe=probe)
+
+    # offsets are relative to the end of header, which is then independent of its own length
+    offset, layout = 0, dict()
+    for name, dtype in _ARRAYS:
+        layout[name] = (offset, dtype, len(arrays[name]))
+        offset += -(-arrays[name].nbytes // ALIGN) * ALIGN
+    header['arrays'] = layout
+    head = json.dumps(header)
+    head += ' ' * (-(len(MAGIC) + 8 + len(head)) % ALIGN)
+
+    with open(fn, 'wb') as fp:
+        fp.write(MAGIC)
+        fp.write(struct.pack('<Q', len(head)))
+        fp.write(head)
+        for name, dtype in _ARRAYS:
+            buf = arrays[name].astype(dtype).tobytes()
+            fp.write(buf)
+            fp.write('\x00' * (-len(buf) % ALIGN))
+
+
+class TopoBin(object):
+    """a topology loaded from binary format
+
+    Attributes:
+        header (dict): graph attributes, name tables, remaining node and link attributes
+        names (list): names of nodes, i.e. ASNs and IXP names, indexed by node
+        probes (list): probe IDs, indexed as in probe array
+        indptr, indices, adj_link, src, dst, probe_ptr, probe (np.array): read-only arrays mapped from file
+    """
+
+    def __init__(self, fn):
+        """
+        Args:
+            fn (string): path to the binary topology file
+        """
+        with open(fn, 'rb') as fp:
+            if fp.read(len(MAGIC)) != MAGIC:
+                raise ValueError("%s is not a binary topology file." % fn)
+            length, = struct.unpack('<Q', fp.read(8))
+            self.header = json.loads(fp.read(length))
+            self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        start = len(MAGIC) + 8 + length
+        for name, (offset, dtype, count) in self.header['arrays'].iteritems():
+            setattr(self, name, np.frombuffer(self._mm, dtype=dtype, count=count, offset=start + offset))
+        self.names = self.header['names']
+        self.probes = self.header['probes']
+
+    @property
+    def node_count(self):
+        return len(self.names)
+
+    @property
+    def link_count(self):
+        return len(self.src)
+
+    def neighbours(self, i):
+        """indexes of neighbour nodes of node i"""
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def link_probes(self, i):
+        """probe IDs of link i"""
+        return [self.probes[k] for k in self.probe[self.probe_ptr[i]:self.probe_ptr[i + 1]]]
+
+    def to_graph(self, interned=False):
+        """the topology as nx.Graph, same as loaded from node-link .json file with json_graph.node_link_graph()
+
+        Args:
+            interned (bool): if True, probes of links are ps.ProbeSet of their indexes in probes table,
+                built straight from the probe array
+
+        Returns:
+            nx.Graph or nx.DiGraph, nodes are indexes in names, and have their name as attribute
+        """
+        g = nx.DiGraph() if self.header['directed'] else nx.Graph()
+        g.graph = self.header['graph']
+        for i, (name, attrs) in enumerate(zip(self.names, self.header['node_attrs'])):
+            g.add_node(i, dict(attrs, name=name))
+        link_attrs = self.header['link_attrs'] or [dict() for _ in xrange(self.link_count)]
+        src, dst, probe_ptr = self.src.tolist(), self.dst.tolist(), self.probe_ptr.tolist()
+        probe = self.probe.tolist() if interned else [self.probes[k] for k in self.probe.tolist()]
+        for i, attrs in enumerate(link_attrs):
+            s, d = src[i], dst[i]
+            pbs = probe[probe_ptr[i]:probe_ptr[i + 1]]
+            g.add_edge(s, d, dict(attrs, src_name=self.names[s], tgt_name=self.names[d],
+                                  probe=ps.ProbeSet(pbs) if interned else pbs))
+        return g
+
+    def to_data(self):
+        """the topology as node-link data, as loaded from .json file
+
+        Returns:
+            dict
+        """
+        data = dict(directed=self.header['directed'], multigraph=False, graph=self.header['graph'])
+        if self.header['congestion']:
+            data['congestion'] = True
+        data['nodes'] = [dict(attrs, id=i, name=name)
+                         for i, (name, attrs) in enumerate(zip(self.names, self.header['node_attrs']))]
+        link_attrs = self.header['link_attrs'] or [dict() for _ in xrange(self.link_count)]
+        data['links'] = [dict(attrs, source=s, target=d, src_name=self.names[s], tgt_name=self.names[d],
+                              probe=self.link_probes(i))
+                         for i, (s, d, attrs) in enumerate(zip(self.src.tolist(), self.dst.tolist(), link_attrs))]
+        return data
+
+
+def load(fn):
+    """load a topology from binary format, see TopoBin"""
+    return TopoBin(fn)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S %z')
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--infile",
+                        help="topology file to be converted, binary if ending with %s, node-link .json otherwise" %
+                             EXTENSION,
+                        action="store")
+    parser.add_argument("-o", "--outfile",
+                        help="converted topology file, binary if ending with %s, node-link .json otherwise" % EXTENSION,
+                        action="store")
+    args = parser.parse_args()
+
+    if not args.infile or not args.outfile:
+        parser.print_help()
+        return
+
+    if is_binary(args.infile):
+        data = load(args.infile).to_data()
+    else:
+        with open(args.infile, 'r') as fp:
+            data = json.load(fp)
+
+    if is_binary(args.outfile):
+        dump(data, args.outfile)
+    else:
+        with open(args.outfile, 'w') as fp:
+            json.dump(data, fp)
+    logging.info("%s converted to %s" % (args.infile, args.outfile))
+
+
+if __name__ == '__main__':
+    main()
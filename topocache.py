@@ -0,0 +1,120 @@
+"""
+topocache.py saves the structures derived from a topology file to a sidecar cache file, and reloads them.
+
+Each cache is keyed by the content hash of the topology file plus the parameters the structures depend on;
+a cache whose key differs from the current one is stale, it is ignored and overwritten.
+
+The order nodes and links of a graph are iterated in depends on the order they were added in, which pickle doesn't
+keep; it is yet the order links are visited in by inference. The topology is thus cached along with the order its
+nodes and links were added in when loaded, and rebuilt in that order, see ordered_graph().
+"""
+import os
+import hashlib
+import logging
+import cPickle as pickle
+
+VERSION = 5  # bumped whenever the content of cache changes
+SUFFIX = '.cache'
+
+
+def cache_path(fn):
+    """the sidecar cache file of a topology file"""
+    return fn + SUFFIX
+
+
+def file_digest(fn, chunk_size=1 << 20):
+    """sha1 hex digest of the content of a file
+
+    Args:
+        fn (string): path to the file
+        chunk_size (int): number of bytes read at a time
+
+    Returns:
+        string
+    """
+    h = hashlib.sha1()
+    with open(fn, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_key(fn, **params):
+    """the key of the cache for a topology file and the parameters used in deriving the cached structures
+
+    Args:
+        fn (string): path to the topology file
+        params: parameters, must be comparable with ==
+
+    Returns:
+        dict
+    """
+    return dict(version=VERSION, digest=file_digest(fn), params=params)
+
+
+def ordered_graph(g, nodes, links):
+    """rebuild a graph by adding its nodes then its links in the given order, into a graph of the same type
+
+    Args:
+        g (nx.Graph): graph as unpickled, attributes of its nodes and links are reused
+        nodes (list): nodes in the order they were added in
+        links (list of tuple): (u, v) in the order they were added in
+
+    Returns:
+        nx.Graph, iterating its nodes and links in the same order as the graph cached
+    """
+    res = g.__class__()
+    res.graph = g.graph
+    for n in nodes:
+        res.add_node(n, g.node[n])
+    for u, v in links:
+        res.add_edge(u, v, g[u][v])
+    return res
+
+
+def load(fn, key):
+    """load the cache of a topology file if it is for the given key
+
+    Args:
+        fn (string): path to the topology file
+        key (dict): see cache_key()
+
+    Returns:
+        dict of cached structures, None if there is no cache, or it is stale or unreadable
+    """
+    path = cache_path(fn)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as fp:
+            cached_key = pickle.load(fp)
+            if cached_key != key:
+                logging.info("Cache %s is stale." % path)
+                return None
+            return pickle.load(fp)
+    except (IOError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, ValueError) as e:
+        logging.warning("Failed to read cache %s: %s" % (path, e))
+        return None
+
+
+def save(fn, key, data):
+    """save the structures derived from a topology file to its cache
+
+    The cache is written to a temporary file first, then renamed, so that a concurrent run never reads a partial one.
+
+    Args:
+        fn (string): path to the topology file
+        key (dict): see cache_key()
+        data (dict): structures to be cached, must be picklable
+    """
+    path = cache_path(fn)
+    tmp = "%s.%d" % (path, os.getpid())
+    try:
+        with open(tmp, 'wb') as fp:
+            pickle.dump(key, fp, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, fp, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
+    except (IOError, OSError, pickle.PicklingError) as e:
+        logging.warning("Failed to write cache %s: %s" % (path, e))
+        if os.path.exists(tmp):
+            os.remove(tmp)
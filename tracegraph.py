@@ -1,28 +1,64 @@
 import networkx as nx
 from itertools import count, chain
-from collections import defaultdict
+from collections import defaultdict, Counter
+from bisect import bisect_right
 import time
-import json
+import resource
 import logging
 import timetools as tt
+import jsonstream as js
+import timewindow as tw
+import interning as it
+import probeset as ps
 
 _attrs = dict(id='id', source='source', target='target', key='key', name='name', src_name='src_name', tgt_name='tgt_name')
 
-SURE, LIKELY, NEG = 2, 1, 0
+SURE, LIKELY, NEG, UNKNOWN = 2, 1, 0, -1
 
 def path_to_graph(paths, probe, g):
     """give a series of paths attached to a given probe, add them to graph g
 
+    Each distinct path is walked only once; edge membership is tested against the adjacency dict of g,
+    which is constant time and independent of the orientation in which an edge was first added.
+
     Args:
         paths (list of list of hops): it contains a list of path, which is a list of hops from source to dest
-        probe: (int or string): the name of the probe from which the above path measurements are performed
-        g: (nx.Graph): the graph object to which new nodes and edges are added
+        probe: (int): the interned id of the probe from which the above path measurements are performed
+        g: (nx.Graph): the graph object to which new nodes and edges are added, probes of edges are ps.ProbeSet
+
+    Returns:
+        multiplicity (Counter): {tuple of hops: number of times the path appears in paths}
     """
-    for p in paths:
-        for e in zip(p[:-1], p[1:]):
-            if e not in g.edges():
-                g.add_edge(e[0], e[1], probe=set([]))
-            g[e[0]][e[1]]['probe'].add(probe)
+    multiplicity = Counter(tuple(p) for p in paths)
+    adj = g.adj
+    for p in multiplicity:
+        for u, v in zip(p[:-1], p[1:]):
+            try:
+                pbs = adj[u][v]['probe']
+            except KeyError:
+                pbs = ps.ProbeSet()
+                g.add_edge(u, v, probe=pbs)
+            pbs.add(probe)
+    return multiplicity
+
+
+def paths_to_graph(paths, g):
+    """add distinct paths to graph g, each along with all the probes having measured it
+
+    Unlike path_to_graph(), which is called per probe, each path is walked only once whatever the number of its probes.
+
+    Args:
+        paths (iterable of tuple): (path, probes), path is a sequence of hops, probes the ps.ProbeSet of interned ids
+            of the probes having measured it
+        g: (nx.Graph): the graph object to which new nodes and edges are added, probes of edges are ps.ProbeSet
+    """
+    adj = g.adj
+    for p, probes in paths:
+        for u, v in zip(p[:-1], p[1:]):
+            try:
+                adj[u][v]['probe'] |= probes
+            except KeyError:
+                g.add_edge(u, v, probe=ps.ProbeSet() | probes)
 
 
 def node_link_data_modify(G, attrs=_attrs):
@@ -30,6 +66,7 @@ def node_link_data_modify(G, attrs=_attrs):
     It is a modified version of node_link_data() function provided in nx library.
     It fixes a potential issue where the the ids of nodes is different from thoses used in edges, which leads to error
     when visulaizing the graph.
+    Graphs built on interned ids are translated back to node and probe names, see interning.
 
     Args:
         G (nx.Graph or nx.MultiGraph): the graph to be dumpped
@@ -50,21 +87,28 @@ def node_link_data_modify(G, attrs=_attrs):
     if len(set([source, target, key])) < 3:
         raise nx.NetworkXError('Attribute names are not unique.')
     mapping = dict(zip(G, count()))
+    graph, node_name, items = G.graph, lambda n: n, lambda d: d.items()
+    if it.interned(G):
+        nodes, probes = G.graph[it.NODES], G.graph[it.PROBES]
+        graph = {k: v for k, v in G.graph.iteritems() if k not in (it.NODES, it.PROBES)}
+        node_name = nodes.name
+        items = lambda d: [(k, [probes.name(i) for i in v] if k in it.PROBE_ATTRS else v) for k, v in d.iteritems()]
     data = {}
     data['directed'] = G.is_directed()
     data['multigraph'] = multigraph
-    data['graph'] = G.graph
-    data['nodes'] = [dict(chain(G.node[n].items(), [(id_, mapping[n]), (name, n)])) for n in G]
+    data['graph'] = graph
+    data['nodes'] = [dict(chain(items(G.node[n]), [(id_, mapping[n]), (name, node_name(n))])) for n in G]
     # in the original version the over line goes (id_, n), can causes the id to be different from that of edges
     if multigraph:
         data['links'] = [
-            dict(chain(d.items(),
+            dict(chain(items(d),
                        [(source, mapping[u]), (target, mapping[v]), (key, k)]))
             for u, v, k, d in G.edges_iter(keys=True, data=True)]
     else:
         data['links'] = [
-            dict(chain(d.items(),
-                       [(source, mapping[u]), (src_name, u), (target, mapping[v]), (tgt_name, v)]))
+            dict(chain(items(d),
+                       [(source, mapping[u]), (src_name, node_name(u)), (target, mapping[v]),
+                        (tgt_name, node_name(v))]))
             for u, v, d in G.edges_iter(data=True)]
 
     return data
@@ -119,6 +163,10 @@ def compose_modify(G, H):
 def graph_update(original, delta):
     """update the originial graph with the delta graph
 
+    Nodes and edges of delta are looked up in the adjacency dict of original, which takes constant time and
+    matches an undirected edge whatever the orientation it is stored in.
+    If delta is built on interned ids, they are translated to those of original beforehand, see interning.remap().
+
     Args:
         original (nx.Graph)
         delta (nx.Graph)
@@ -130,19 +178,33 @@ def graph_update(original, delta):
     if not original.is_multigraph() == delta.is_multigraph() == False:
         raise nx.NetworkXError('Doesn\'t handle multi-graph.')
 
+    node_map, probe_map = it.remap(original, delta)
+
+    def translate(d):
+        """attributes of delta with probe ids translated to those of original"""
+        if probe_map is None:
+            return d
+        return {k: ps.ProbeSet([probe_map[i] for i in v]) if k in it.PROBE_ATTRS else v for k, v in d.iteritems()}
+
     for n, d in delta.nodes_iter(data=True):
-        if n in original.nodes_iter():
+        n = n if node_map is None else node_map[n]
+        if original.has_node(n):
             # there should be always a tag for each node
             original.node[n]['tag'].update(d['tag'])
         else:
-            original.add_node(n, d)
+            original.add_node(n, translate(d))
 
+    adj = original.adj
     for src, tgt, d in delta.edges_iter(data=True):
-        if (src, tgt) in original.edges_iter():
-            for k, v in d.iteritems():
-                original[src][tgt][k].update(v)
+        if node_map is not None:
+            src, tgt = node_map[src], node_map[tgt]
+        try:
+            d1 = adj[src][tgt]
+        except KeyError:
+            original.add_edge(src, tgt, translate(d))
         else:
-            original.add_edge(src, tgt, d)
+            for k, v in translate(d).iteritems():
+                d1[k].update(v)
 
 
 def graph_union(graphs):
@@ -161,6 +223,46 @@ def graph_union(graphs):
     return comb
 
 
+def graph_merge(pair):
+    """merge the second graph of the pair into the first one; module level so that it can be sent to pool workers
+
+    Args:
+        pair (tuple of nx.Graph)
+
+    Returns:
+        nx.Graph, the first graph updated with the second one
+    """
+    original, delta = pair
+    graph_update(original, delta)
+    return original
+
+
+def graph_union_tree(graphs, pool=None):
+    """combine a list of graphs by merging them pairwise, level by level, as a binary tree
+
+    Each level halves the number of graphs. The merges of a level are independent from each other,
+    hence can be performed by the workers of a multiprocessing pool.
+    The result is the same as that of graph_union().
+
+    Args:
+        graphs (list of nx.Graph): graphs in it can be modified
+        pool (multiprocessing.Pool): pool of workers performing the merges; merges are done locally if None
+
+    Returns:
+        C (nx.graph): combined graph
+    """
+    graphs = list(graphs)
+    if not graphs:
+        return nx.Graph()
+    merge = pool.map if pool else map
+    while len(graphs) > 1:
+        merged = merge(graph_merge, zip(graphs[0::2], graphs[1::2]))
+        if len(graphs) % 2:
+            merged.append(graphs[-1])
+        graphs = merged
+    return graphs[0]
+
+
 def compose_all_modify(graphs):
     """combine a list of graphs
 
@@ -177,131 +279,174 @@ def compose_all_modify(graphs):
     return C
 
 
-def change_binsum(fn, method, g, pb2links, pb2nodes, bin_size, begin, stop):
+def change_binsum(fn, method, store, pb2links, pb2nodes, bin_size, begin, stop, stream=False, probes=None,
+                  segments=None):
     """calculate binned sum of RTT changes for each link and node in a given topo
 
     Args:
         fn (string): path to the RTT file
         method (string): field in the file to be extracted as the result of change detection
-        g (nx.Graph): network topology learnt from traceroute; link is annotated with probes traverse it
+        store (ScoreStore): scores of the network topology learnt from traceroute
         pb2links (dict): {probe id : [link in g (n1, n2),...]}
         pb2nodes (dict): {probe id: [nodes in g...]}
         bin_size (int): the size of bin in seconds
         begin (int): sec since epoch from which records in fn is considered
         stop (int): sec since epoch till which records in fn is considered
+        stream (bool): read fn one probe at a time instead of loading it as a whole
+        probes (interning.Interner): if given, probe ids in pb2links and pb2nodes are interned in it,
+            probe IDs in fn are translated with it
+        segments (list of int): if given, sorted sec since epoch where the topology changes, see snapshots;
+            pb2links and pb2nodes are then keyed by (probe id, index of the segment the record falls in)
 
     Notes:
-        no return will be provided. update is directly applied to g.
-        g has to be initialized for each of its link and node a dictionary "score", default to int type.
+        no return will be provided. update is directly applied to store.
+    """
+    binsum_update(store, change_binsum_partial(fn, method, pb2links, pb2nodes, bin_size, begin, stop, stream, probes,
+                                               segments))
+
+
+def change_binsum_partial(fn, method, pb2links, pb2nodes, bin_size, begin, stop, stream=False, probes=None,
+                          segments=None):
+    """calculate binned sum of RTT changes in a given file for each link and node, without touching the topo
+
+    It allows files to be handled in separate processes, see change_binsum() for the arguments.
+
+    Returns:
+        tuple of dict ({link (n1, n2): {bin: change sum}}, {node: {bin: change sum}})
     """
     t1 = time.time()
+    link_score = defaultdict(lambda: defaultdict(int))
+    node_score = defaultdict(lambda: defaultdict(int))
 
     try:
         with open(fn, 'r') as fp:
-            data = json.load(fp)
-    except IOError as e:
-        logging.critical(e)
-        return
-
-    if 'data' in locals() and data:
-        for pb in data:
-            pb_rec = data[pb]
-            if pb_rec:
-                for t, v in zip(pb_rec.get("epoch", []), pb_rec.get(method, [])):
-                    if begin <= t <= stop:
-                        t = (t // bin_size) * bin_size
-                        for l in pb2links.get(pb, []):
-                            g[l[0]][l[1]]['score'][t] += v
-                        for n in pb2nodes.get(pb, []):
-                            g.node[n]['score'][t] += v
+            for pb, pb_rec in js.load_items(fp, stream):
+                if probes is not None:
+                    pb = probes.get(pb)
+                if pb_rec:
+                    epochs = pb_rec.get("epoch", [])
+                    begin_idx, stop_idx = tw.window_index(epochs, begin, stop)
+                    for t, v in zip(epochs[begin_idx:stop_idx], pb_rec.get(method, [])[begin_idx:stop_idx]):
+                        t = tw.bin_floor(t, bin_size)
+                        key = pb if segments is None else (pb, bisect_right(segments, t) - 1)
+                        for l in pb2links.get(key, []):
+                            link_score[l][t] += v
+                        for n in pb2nodes.get(key, []):
+                            node_score[n][t] += v
+    except (IOError, ValueError) as e:
+        # malformed content, e.g. a truncated file, may only be met halfway when streaming; the file is skipped
+        logging.critical("%s skipped: %s" % (fn, e))
+        return dict(), dict()
     t2 = time.time()
-    logging.debug("%s handled in %.2f sec" % (fn, t2 - t1))
+    # ru_maxrss is in KB on Linux
+    logging.debug("%s handled in %.2f sec, peak RSS %.1f MB" %
+                  (fn, t2 - t1, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.))
+    return dict(link_score), dict(node_score)
 
 
-def change_inference_node(g, node_threshold, bin_size, begin, stop):
+def binsum_update(store, partial):
+    """add the partial binned sums of change_binsum_partial() to the scores of links and nodes
+
+    Args:
+        store (ScoreStore): scores of the network topology
+        partial (tuple of dict): ({link (n1, n2): {bin: change sum}}, {node: {bin: change sum}})
+    """
+    link_score, node_score = partial
+    for l, score in link_score.iteritems():
+        store.add_sums(store.link_row[l], score)
+    for n, score in node_score.iteritems():
+        store.add_sums(store.node_row[n], score)
+
+
+def change_inference_node(g, node_threshold, store, bins=None, active=None):
     """perform node change location inference
 
     Args:
         g (nx.Graph): network topology learnt from traceroute; link is annotated with probes traverse it
         node_threshold (float): parameter for node inference; minimum portion of trace traversing that node experience change
-        bin_size (int): the size of bin in seconds
-        begin (int): sec since epoch from which records in fn is considered
-        stop (int): sec since epoch till which records in fn is considered
+        store (ScoreStore): scores and inferences of g over the time window
+        bins (list of int): offsets of the bins to be inferred, all the bins of store if None
+        active (list of np.array): node rows above node_threshold per bin, see ScoreStore.active(); built if None
 
     Notes:
         no return will be provided. update is directly applied to g.
-        g has to be initialized for each of its node a dictionary "inference", default to int type.
+        the "score" and "inference" of each node in g has to be the rows of store, see ScoreStore.attach().
         2 (SURE) for inferred (pretty sure) as cause
         1 (LIKELY) for susceptible (not so sure) as cause
     """
     t1 = time.time()
-    for t in range((begin // bin_size) * bin_size, ((stop // bin_size) + 1) * bin_size, bin_size):
-        for n in g.nodes_iter():
-            if len(g.node[n]['probe']) > 1 and g.node[n]['score'][t] > node_threshold:
+    if active is None:
+        active = store.active(node_threshold, store.node_rows)
+    for t in (store.bins() if bins is None else bins):
+        for row in active[t]:
+            n = store.element(row)
+            if len(g.node[n]['probe']) > 1:
                 g.node[n]['inference'][t] = SURE
     t2 = time.time()
     logging.debug("Node congestion inference in %.2f sec" % (t2 - t1))
 
 
-def change_inference_link(graph, link_threshold, bin_size, begin, stop):
+def change_inference_link(graph, link_threshold, store, bins=None, branches=None, active=None, stats=None):
     """perform link change location inference
 
     Args:
         graph (nx.Graph): network topology learnt from traceroute; link is annotated with probes traverse it
         link_threshold (float): parameter for link inference; minimum portion of trace on that link experience change
-        bin_size (int): the size of bin in seconds
-        begin (int): sec since epoch from which records in fn is considered
-        stop (int): sec since epoch till which records in fn is considered
+        store (ScoreStore): scores and inferences of graph over the time window
+        bins (list of int): offsets of the bins to be inferred, all the bins of store if None
+        branches (dict): extension branches of links, see branch_index(); built along the way if None
+        active (list of np.array): link rows above link_threshold per bin, see ScoreStore.active(); built if None
+        stats (dict): if given, 'evaluated' is increased by the number of links evaluated from the top,
+            and 'max_depth' raised to the deepest chain of links waiting for their trunk, see evaluate()
 
     Notes:
         no return will be provided. update is directly applied to g.
-        g has to be initialized for each of its link a dictionary "inference", default to int type.
+        the "score" and "inference" of each link and node in g has to be the rows of store, see ScoreStore.attach().
         2 (SURE) for inferred (pretty sure) as cause
         1 (LIKELY) for susceptible (not so sure) as cause
     """
 
-    call_depth = []
+    branches = dict() if branches is None else branches
+    # messages are only formatted when they are going to be logged
+    log_info = logging.getLogger().isEnabledFor(logging.INFO)
+    log_debug = logging.getLogger().isEnabledFor(logging.DEBUG)
 
-    def helper(g, l, t, from_link=None):
+    def decide(g, l, t, from_link=None):
         """ the actual inference in done here
 
+        It is a generator: whenever the result of l depends on that of a trunk link, the trunk link is yielded
+        and its result is expected to be sent back, see evaluate().
+        The result of l is written to its inference; l is NEG if left UNKNOWN.
+
         Args:
             g (nx.Graph): the graph operated on
             l (tuple of nodes): the link currently being investigated
-            t (int): the time stamp (second since epoch) of inference
-            from_link (tuple of nodes): the function can be called recursively, from_link indicates the outerlayer link
-
-        Returns:
-            SURE, LIKELY, NEG
+            t (int): the bin offset of inference
+            from_link (tuple of nodes): the link whose result depends on that of l, if any
         """
 
-        call_depth.append(0)
-        if len(call_depth) > 2:
-            logging.info("%d level deep Call at %s: %r" % (len(call_depth), tt.epoch_to_string(t), l))
-
         # skip if already inferred
-        if t in g[l[0]][l[1]]['inference']:
-            call_depth.pop()
-            return g[l[0]][l[1]]['inference'][t]
+        if g[l[0]][l[1]]['inference'][t] != UNKNOWN:
+            return
 
         # a safe check; the a link doesn't even meet the threshold, it can not be the cause
         if g[l[0]][l[1]]["score"][t] <= link_threshold:
-            call_depth.pop()
-            return NEG
+            return
 
         # if connecting nodes are the cause, then link can not be the cause according to single cause assumption
-        l0_res = g.node[l[0]]["inference"].get(t, NEG)
-        l1_res = g.node[l[1]]["inference"].get(t, NEG)
+        l0_res = g.node[l[0]]["inference"][t]
+        l1_res = g.node[l[1]]["inference"][t]
         caused_by_node = bool(l0_res == SURE or l1_res == SURE)
 
         if caused_by_node:
             g[l[0]][l[1]]['inference'][t] = NEG
-            call_depth.pop()
-            return NEG
+            return
 
         # verifies if the link itself is the cause
-        branches = find_branches(g, l[0], l[1])
-        ext = {k: [i for i in v if i[-1] > 0] for k, v in branches.items()}
+        # topology only, thus computed once per link and reused for all bins
+        ext = branches.get(l) or branches.get(l[::-1])
+        if ext is None:
+            ext = branches[l] = link_branches(g, l[0], l[1])
         ext_con_count_abs = {
             k: sum([1 if g[i[0]][k]['score'][t] > link_threshold else 0 for i in v]) for
             k, v in ext.items()}
@@ -316,9 +461,9 @@ def change_inference_link(graph, link_threshold, bin_size, begin, stop):
             # verify if the extension branches are ALL LB branches; if the cause return LIKELY
             pb_hash = defaultdict(set)
             for n in l:
-                for ext_n, a, b in ext[n]:
+                for ext_n, a, b, h in ext[n]:
                     if g[n][ext_n]['score'][t] > float(b)/a * link_threshold:
-                        pb_hash[n].add(hash(frozenset(set(g[n][ext_n]["probe"]) & set(g[l[0]][l[1]]["probe"]))))
+                        pb_hash[n].add(h)
             if all([len(i[1]) > 1 for i in pb_hash.items()]):
                 g[l[0]][l[1]]['inference'][t] = SURE
             else:
@@ -328,9 +473,9 @@ def change_inference_link(graph, link_threshold, bin_size, begin, stop):
             if ext_con_count_abs[l[0]] < 1:  # the single extension branch not being the cause
                 # again verify for LB
                 pb_hash = set()
-                for ext_n, a, b in ext[l[1]]:
-                    if g[l[1]][ext_n]['score'][t] > float(b)/a * link_threshold:
-                        pb_hash.add(hash(frozenset(set(g[l[1]][ext_n]["probe"]) & set(g[l[0]][l[1]]["probe"]))))
+                for ext_n, a, b, h in ext[l[1]]:
+                    if g[l[1]][ext_n]['score'][t] > float(b) / a * link_threshold:
+                        pb_hash.add(h)
                 if len(pb_hash) > 1:
                     g[l[0]][l[1]]['inference'][t] = SURE
                 else:
@@ -340,11 +485,13 @@ def change_inference_link(graph, link_threshold, bin_size, begin, stop):
                 trunk = (l[0], ext[l[0]][0][0])  # the only extension branch on l[0]
                 # the single extension branch depends as well on current link
                 if from_link and (trunk == from_link or trunk == from_link[::-1]):
-                    logging.debug("Dependence loop: %s, %r <-> %r" % (tt.epoch_to_string(t), l, trunk))
+                    if log_debug:
+                        logging.debug("Dependence loop: %s, %r <-> %r" % (tt.epoch_to_string(store.epoch(t)), l, trunk))
                     g[l[0]][l[1]]['inference'][t] = LIKELY
                 else:
-                    logging.debug("Dependence chain: %s, %r -> %r" % (tt.epoch_to_string(t), l, trunk))
-                    trunk_res = helper(g, trunk, t, l)
+                    if log_debug:
+                        logging.debug("Dependence chain: %s, %r -> %r" % (tt.epoch_to_string(store.epoch(t)), l, trunk))
+                    trunk_res = (yield trunk)
                     # if the trunk_res == neg
                     # 1/ possible that l cause the change
                     # 2/ possible that upstream of trunk causes a change,
@@ -357,9 +504,9 @@ def change_inference_link(graph, link_threshold, bin_size, begin, stop):
         elif len(ext[l[1]]) == 1 and ext_con_count_prop[l[0]] > 1:
             if ext_con_count_abs[l[1]] < 1:  # the extension branch not being the cause
                 pb_hash = set()
-                for ext_n, a, b in ext[l[0]]:
+                for ext_n, a, b, h in ext[l[0]]:
                     if g[l[0]][ext_n]['score'][t] > float(b) / a * link_threshold:
-                        pb_hash.add(hash(frozenset(set(g[l[0]][ext_n]["probe"]) & set(g[l[0]][l[1]]["probe"]))))
+                        pb_hash.add(h)
                 if len(pb_hash) > 1:
                     g[l[0]][l[1]]['inference'][t] = SURE
                 else:
@@ -367,11 +514,13 @@ def change_inference_link(graph, link_threshold, bin_size, begin, stop):
             else:
                 trunk = (l[1], ext[l[1]][0][0])  # the only extension branch on l[0]
                 if from_link and (trunk == from_link or trunk == from_link[::-1]):
-                    logging.debug("Dependence loop: %s, %r <-> %r" % (tt.epoch_to_string(t), l, trunk))
+                    if log_debug:
+                        logging.debug("Dependence loop: %s, %r <-> %r" % (tt.epoch_to_string(store.epoch(t)), l, trunk))
                     g[l[0]][l[1]]['inference'][t] = LIKELY
                 else:
-                    logging.debug("Dependence chain: %s, %r -> %r" % (tt.epoch_to_string(t), l, trunk))
-                    trunk_res = helper(g, trunk, t, l)
+                    if log_debug:
+                        logging.debug("Dependence chain: %s, %r -> %r" % (tt.epoch_to_string(store.epoch(t)), l, trunk))
+                    trunk_res = (yield trunk)
                     if trunk_res == SURE:
                         g[l[0]][l[1]]['inference'][t] = NEG
                     else:
@@ -388,28 +537,31 @@ def change_inference_link(graph, link_threshold, bin_size, begin, stop):
                 # if ext branch attached to l[0] depend on current link,
                 # then the res of current link depend on the ext branch attached to l[1]
                 if from_link and (trunk_l0 == from_link or trunk_l0 == from_link[::-1]):
-                    logging.debug("Dependence loop: %s, %r <-> %r" % (tt.epoch_to_string(t), l, trunk_l0))
+                    if log_debug:
+                        logging.debug("Dependence loop: %s, %r <-> %r" % (tt.epoch_to_string(store.epoch(t)), l, trunk_l0))
                     # it now depends on the result of trunk_l1 which must be different from l
-                    trunk_l1_res = helper(g, trunk_l1, t, l)
+                    trunk_l1_res = (yield trunk_l1)
                     if trunk_l1_res == SURE:
                         g[l[0]][l[1]]['inference'][t] = NEG
                     else:
                         g[l[0]][l[1]]['inference'][t] = LIKELY
                 elif from_link and (trunk_l1 == from_link or trunk_l1 == from_link[::-1]):
-                    logging.debug("Dependence loop: %s, %r <-> %r" % (tt.epoch_to_string(t), l, trunk_l1))
+                    if log_debug:
+                        logging.debug("Dependence loop: %s, %r <-> %r" % (tt.epoch_to_string(store.epoch(t)), l, trunk_l1))
                     # it now depends on the result of trunk_l0 which must be different from l
-                    trunk_l0_res = helper(g, trunk_l0, t, l)
+                    trunk_l0_res = (yield trunk_l0)
                     if trunk_l0_res == SURE:
                         g[l[0]][l[1]]['inference'][t] = NEG
                     else:
                         g[l[0]][l[1]]['inference'][t] = LIKELY
                 else:
-                    logging.debug("Dependence chain: %s, %r -> (%r, %r) \n%r\n%r\n%r" %
-                                  (tt.epoch_to_string(t), l, trunk_l0, trunk_l1,
-                                   g[l[0]][l[1]]['probe'],
-                                   g[trunk_l0[0]][trunk_l0[1]]['probe'], g[trunk_l1[0]][trunk_l1[1]]['probe']))
-                    trunk_l0_res = helper(g, trunk_l0, t, l)
-                    trunk_l1_res = helper(g, trunk_l1, t, l)
+                    if log_debug:
+                        logging.debug("Dependence chain: %s, %r -> (%r, %r) \n%r\n%r\n%r" %
+                                      (tt.epoch_to_string(store.epoch(t)), l, trunk_l0, trunk_l1,
+                                       g[l[0]][l[1]]['probe'],
+                                       g[trunk_l0[0]][trunk_l0[1]]['probe'], g[trunk_l1[0]][trunk_l1[1]]['probe']))
+                    trunk_l0_res = (yield trunk_l0)
+                    trunk_l1_res = (yield trunk_l1)
                     if trunk_l1_res == SURE or trunk_l0_res == SURE:
                         g[l[0]][l[1]]['inference'][t] = NEG
                     elif trunk_l0_res == LIKELY or trunk_l1_res == LIKELY:
@@ -423,9 +575,9 @@ def change_inference_link(graph, link_threshold, bin_size, begin, stop):
         elif len(ext[l[0]]) == 0:
             if ext_con_count_prop[l[1]] > 1:
                 pb_hash = set()
-                for ext_n, a, b in ext[l[1]]:
+                for ext_n, a, b, h in ext[l[1]]:
                     if g[l[1]][ext_n]['score'][t] > float(b) / a * link_threshold:
-                        pb_hash.add(hash(frozenset(set(g[l[1]][ext_n]["probe"]) & set(g[l[0]][l[1]]["probe"]))))
+                        pb_hash.add(h)
                 if len(pb_hash) > 1:
                     g[l[0]][l[1]]['inference'][t] = SURE
                 else:
@@ -436,11 +588,13 @@ def change_inference_link(graph, link_threshold, bin_size, begin, stop):
                 else:
                     trunk = (l[1], ext[l[1]][0][0])  # the only extension branch on l[1]
                     if from_link and (trunk == from_link or trunk == from_link[::-1]):
-                        logging.debug("Dependence loop: %s, %r <-> %r" % (tt.epoch_to_string(t), l, trunk))
+                        if log_debug:
+                            logging.debug("Dependence loop: %s, %r <-> %r" % (tt.epoch_to_string(store.epoch(t)), l, trunk))
                         g[l[0]][l[1]]['inference'][t] = LIKELY
                     else:
-                        logging.debug("Dependence chain: %s, %r -> %r" % (tt.epoch_to_string(t), l, trunk))
-                        trunk_res = helper(g, trunk, t, l)
+                        if log_debug:
+                            logging.debug("Dependence chain: %s, %r -> %r" % (tt.epoch_to_string(store.epoch(t)), l, trunk))
+                        trunk_res = (yield trunk)
                         if trunk_res == SURE:
                             g[l[0]][l[1]]['inference'][t] = NEG
                         else:
@@ -450,9 +604,9 @@ def change_inference_link(graph, link_threshold, bin_size, begin, stop):
         elif len(ext[l[1]]) == 0:
             if ext_con_count_prop[l[0]] > 1:
                 pb_hash = set()
-                for ext_n, a, b in ext[l[0]]:
+                for ext_n, a, b, h in ext[l[0]]:
                     if g[l[0]][ext_n]['score'][t] > float(b) / a * link_threshold:
-                        pb_hash.add(hash(frozenset(set(g[l[0]][ext_n]["probe"]) & set(g[l[0]][l[1]]["probe"]))))
+                        pb_hash.add(h)
                 if len(pb_hash) > 1:
                     g[l[0]][l[1]]['inference'][t] = SURE
                 else:
@@ -463,11 +617,13 @@ def change_inference_link(graph, link_threshold, bin_size, begin, stop):
                 else:
                     trunk = (l[0], ext[l[0]][0][0])  # the only extension branch on l[1]
                     if from_link and (trunk == from_link or trunk == from_link[::-1]):
-                        logging.debug("Dependence loop: %s, %r <-> %r" % (tt.epoch_to_string(t), l, trunk))
+                        if log_debug:
+                            logging.debug("Dependence loop: %s, %r <-> %r" % (tt.epoch_to_string(store.epoch(t)), l, trunk))
                         g[l[0]][l[1]]['inference'][t] = LIKELY
                     else:
-                        logging.debug("Dependence chain: %s, %r -> %r" % (tt.epoch_to_string(t), l, trunk))
-                        trunk_res = helper(g, trunk, t, l)
+                        if log_debug:
+                            logging.debug("Dependence chain: %s, %r -> %r" % (tt.epoch_to_string(store.epoch(t)), l, trunk))
+                        trunk_res = (yield trunk)
                         if trunk_res == SURE:
                             g[l[0]][l[1]]['inference'][t] = NEG
                         else:
@@ -477,20 +633,71 @@ def change_inference_link(graph, link_threshold, bin_size, begin, stop):
         else:
             g[l[0]][l[1]]['inference'][t] = NEG
 
-        call_depth.pop()
-        return g[l[0]][l[1]]['inference'][t]
+    def evaluate(g, link, t):
+        """ infer link at bin t, along with the chain of trunk links it depends on
+
+        Links waiting for the result of their trunk are kept on an explicit stack instead of recursive calls.
+        Each link is at most once on the stack, a trunk already waiting is a dependence loop, and taken as LIKELY.
+
+        Args:
+            g (nx.Graph): the graph operated on
+            link (tuple of nodes): the link to be inferred
+            t (int): the bin offset of inference
+
+        Returns:
+            tuple (SURE, LIKELY or NEG, the max depth of stack)
+        """
+        stack = [(link, decide(g, link, t))]
+        waiting = {link, link[::-1]}
+        res = None
+        depth = 1
+        while stack:
+            l, pending = stack[-1]
+            try:
+                trunk = pending.send(res)
+            except StopIteration:
+                stack.pop()
+                waiting.difference_update((l, l[::-1]))
+                res = g[l[0]][l[1]]['inference'][t]
+                res = NEG if res == UNKNOWN else res
+                continue
+            if trunk in waiting:
+                if log_debug:
+                    logging.debug("Dependence loop: %s, %r <-> ... <-> %r" % (tt.epoch_to_string(store.epoch(t)), l, trunk))
+                res = LIKELY
+            else:
+                stack.append((trunk, decide(g, trunk, t, l)))
+                waiting.update((trunk, trunk[::-1]))
+                depth = max(depth, len(stack))
+                if log_info and len(stack) > 2:
+                    logging.info("%d level deep Call at %s: %r" % (len(stack), tt.epoch_to_string(store.epoch(t)), trunk))
+                res = None
+        return res, depth
 
     t1 = time.time()
-    for ts in range((begin // bin_size) * bin_size, ((stop // bin_size) + 1) * bin_size, bin_size):
-        for link in graph.edges_iter():
-            if graph[link[0]][link[1]]['score'][ts] > link_threshold and ts not in graph[link[0]][link[1]]['inference']:
-                _ = helper(graph, link, ts)
+    if active is None:
+        active = store.active(link_threshold, store.link_rows)
+    evaluated, max_depth = 0, 0
+    # only links above threshold are visited, in the order of store.links, i.e. that of edges_iter()
+    for ts in (store.bins() if bins is None else bins):
+        for row in active[ts]:
+            link = store.links[row]
+            if graph[link[0]][link[1]]['inference'][ts] == UNKNOWN:
+                _, depth = evaluate(graph, link, ts)
+                evaluated += 1
+                max_depth = max(max_depth, depth)
+    if stats is not None:
+        stats['evaluated'] = stats.get('evaluated', 0) + evaluated
+        stats['max_depth'] = max(stats.get('max_depth', 0), max_depth)
     t2 = time.time()
     logging.debug("Link congestion inference in %.2f sec" % (t2 - t1))
 
 
 def find_branches(graph, n1, n2):
     """ find all the links sharing nodes with the given link (n1, n2)
+
+    Probes of links are expected to be ps.ProbeSet, common probes are counted without building their intersection.
+
     Args:
         graph (nx.Graph)
         n1 (int): one node of the link
@@ -500,7 +707,7 @@ def find_branches(graph, n1, n2):
         empty dict in the case (n1, n2) is not an edge in graph
     """
     try:
-        pbs = set(graph.edge[n1][n2]['probe'])
+        pbs = graph.edge[n1][n2]['probe']
     except KeyError:
         return {n1: [], n2: []}
     res = {n1: [], n2: []}
@@ -508,55 +715,126 @@ def find_branches(graph, n1, n2):
         n, other = tup
         for neighbour in graph.neighbors(n):
             if neighbour != other:
-                n_pbs = set(graph.edge[n][neighbour]['probe'])
-                common = n_pbs & pbs
-                res[n].append((neighbour, len(n_pbs), len(common)))
+                n_pbs = graph.edge[n][neighbour]['probe']
+                res[n].append((neighbour, len(n_pbs), n_pbs.intersection_cardinality(pbs)))
+    return res
+
+
+def link_branches(graph, n1, n2):
+    """ find the extension branches of link (n1, n2), i.e. links sharing a node and some probes with it
+
+    Args:
+        graph (nx.Graph)
+        n1 (int): one node of the link
+        n2 (int): the other node of the link
+
+    Returns:
+        dict{n1: [(x, probe # on (n1,x), common pb # with (n1, n2), hash of common pbs)...], n2: []}
+        the hash of common probes tells apart branches carrying different probes of (n1, n2), e.g. load balancing
+    """
+    pbs = graph[n1][n2]['probe']
+    res = {n1: [], n2: []}
+    for n, branches in find_branches(graph, n1, n2).items():
+        for x, a, b in branches:
+            if b > 0:
+                res[n].append((x, a, b, ps.digest(graph[n][x]['probe'] & pbs)))
     return res
 
 
-def divergent_set(l, crosspoints):
+def branch_index(graph):
+    """ extension branches of all the links in graph, see link_branches()
+
+    Args:
+        graph (nx.Graph)
+
+    Returns:
+        dict {(n1, n2): link_branches(graph, n1, n2)}, links are in the orientation of graph.edges_iter()
+    """
+    return {(n1, n2): link_branches(graph, n1, n2) for n1, n2 in graph.edges_iter()}
+
+
+def divergent_set(l, crosspoints, budget=None, max_seeds=None, element_name=None, attr_name=None):
     """ find largest subsets of l so that only common part among any elements in the subset is those in the crosspoints
 
+    Elements with identical attributes are interchangeable, they are grouped by attributes first;
+    attribute sets are then handled as bitsets, i.e. ints with one bit per attribute.
+    Starting from each group in turn, a candidate subset is greedily extended by visiting all the other groups once.
+
     Args:
         l (dict): {element: set(attributes),...}
         crosspoints (set): set of attributes allowed for being in common
+        budget (float): sec, no more candidate is started once spent, at least one is anyway; no limit if None
+        max_seeds (int): max number of candidates started, the fewer the faster but the result may be smaller;
+            all the groups are tried if None
+        element_name (callable): name of an element, e.g. the probe ID of an interned probe id;
+            elements are ordered by themselves if None
+        attr_name (callable): name of an attribute, e.g. the ASN of an interned node id
 
     Return:
-        tuple (the size of subset, {'member':[keys of l], 'attr': union of member attributes})
+        tuple (the size of subset, [{'member':[keys of l], 'attr': union of member attributes},...])
     """
-
-    def ok(o, target):
-        """test if intersection between o and target is equal to crosspoints"""
-        if set.intersection(target, o) == set(crosspoints):
-            return True
-        else:
-            return False
-
-    # source https://stackoverflow.com/questions/10823227/how-to-get-all-the-maximums-max-function
-    def maxes(a, key=None):
-        """return all the i with the maximum of key(i) for i in a"""
-        if key is None:
-            key = lambda x: x
-        m, max_list = key(a[0]), []
-        for s in a:
-            k = key(s)
-            if k > m:
-                m, max_list = k, [s]
-            elif k == m:
-                max_list.append(s)
-        return m, max_list
-
-    candidate = []
-
-    # TODO: not all possible combination is tested; it is in fact a maximum clique problem NP-complete
+    t0 = time.time()
+
+    # group elements by attributes; groups and their elements are sorted so that the result doesn't depend on
+    # the iteration order of l, groups with fewer attributes come first as they are less likely to exclude the others
+    # ties are broken on names rather than on interned ids, which depend on the order names were met in
+    element_name = element_name if element_name is not None else (lambda e: e)
+    attr_name = attr_name if attr_name is not None else (lambda a: a)
+    members = defaultdict(list)
     for e in l:
-        for c in candidate:
-            if ok(l[e], c['attr']):
-                c['member'].append(e)
-                c['attr'] |= l[e]
-        candidate.append({"member": [e], "attr": set(l[e])})
+        members[frozenset(l[e])].append(e)
+    if not members:
+        return 0, []
+    groups = sorted(((attr, sorted(m, key=element_name)) for attr, m in members.iteritems()),
+                    key=lambda g: (len(g[0]), sorted(attr_name(a) for a in g[0])))
+
+    bit = dict()
+    for attr, _ in groups:
+        for a in attr:
+            bit.setdefault(a, 1 << len(bit))
+    cross = 0
+    for a in crosspoints:
+        cross |= bit.setdefault(a, 1 << len(bit))
+    masks = [sum(bit[a] for a in attr) for attr, _ in groups]
+
+    def ok(mask, target):
+        """test if intersection between mask and target is equal to crosspoints"""
+        return mask & target == cross
+
+    def size(picked):
+        """number of elements in a candidate, all the elements of a group count if it has no more than crosspoints"""
+        return sum(len(groups[i][1]) if masks[i] == cross else 1 for i in picked)
 
-    return maxes(candidate, key=lambda a: len(a['member']))
+    # TODO: not all possible combination is tested; it is in fact a maximum clique problem NP-complete
+    m, max_list, seen = 0, [], set()
+    for seed in xrange(len(groups)):
+        if seed and ((max_seeds is not None and seed >= max_seeds) or
+                     (budget is not None and time.time() - t0 > budget)):
+            logging.debug("Divergent set: %d groups out of %d tried as seed" % (seed, len(groups)))
+            break
+        acc, picked = masks[seed], [seed]
+        for i in xrange(len(groups)):
+            if i != seed and ok(masks[i], acc):
+                acc |= masks[i]
+                picked.append(i)
+        key = frozenset(picked)
+        if key in seen:
+            continue
+        seen.add(key)
+        k = size(picked)
+        if k > m:
+            m, max_list = k, [picked]
+        elif k == m:
+            max_list.append(picked)
+
+    res = []
+    for picked in max_list:
+        member, attr = [], set()
+        for i in picked:
+            member.extend(groups[i][1] if masks[i] == cross else groups[i][1][:1])
+            attr |= groups[i][0]
+        res.append({'member': member, 'attr': attr})
+    return m, res
 
 
 